@@ -0,0 +1,193 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import time
+
+PREV = 0
+NEXT = 1
+KEY  = 2
+VAL  = 3
+
+class LRU(object):
+    """
+    A size-bounded cache that evicts the least recently used entry
+    first. It keeps count of hits, misses and evictions.
+
+    Entries are kept in a circular doubly linked list of [prev, next,
+    key, value] nodes [the same layout functools.lru_cache uses], as
+    OrderedDict is way too slow for the hot paths this is used on.
+    """
+
+    def __init__(self, maxsize):
+        if (maxsize < 1):
+            raise(ValueError("maxsize must be positive"))
+        self.maxsize   = maxsize
+        self.items     = {}
+        self.root      = []
+        self.root[:]   = [self.root, self.root, None, None]
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def _unlink(self, node):
+        node[PREV][NEXT] = node[NEXT]
+        node[NEXT][PREV] = node[PREV]
+
+    def _append(self, node):
+        last       = self.root[PREV]
+        node[PREV] = last
+        node[NEXT] = self.root
+        last[NEXT] = node
+        self.root[PREV] = node
+
+    def get(self, k, default=None):
+        node = self.items.get(k)
+        if (node is None):
+            self.misses += 1
+            return(default)
+        # inlined _unlink/_append, this is the hot path
+        self.hits       += 1
+        node[PREV][NEXT] = node[NEXT]
+        node[NEXT][PREV] = node[PREV]
+        last             = self.root[PREV]
+        node[PREV]       = last
+        node[NEXT]       = self.root
+        last[NEXT]       = node
+        self.root[PREV]  = node
+        return(node[VAL])
+
+    def put(self, k, v):
+        node = self.items.get(k)
+        if (node is not None):
+            self._unlink(node)
+        elif (len(self.items) >= self.maxsize):
+            oldest = self.root[NEXT]
+            self._unlink(oldest)
+            del(self.items[oldest[KEY]])
+            self.evictions += 1
+        node = [None, None, k, v]
+        self._append(node)
+        self.items[k] = node
+
+    def popitem(self):
+        # removes and returns the least recently used (key, value)
+        oldest = self.root[NEXT]
+        if (oldest is self.root):
+            raise(KeyError("popitem: cache is empty"))
+        self._unlink(oldest)
+        del(self.items[oldest[KEY]])
+        return((oldest[KEY], oldest[VAL]))
+
+    def pop(self, k, default=None):
+        node = self.items.pop(k, None)
+        if (node is None):
+            return(default)
+        self._unlink(node)
+        return(node[VAL])
+
+    def clear(self):
+        self.items.clear()
+        self.root[:] = [self.root, self.root, None, None]
+
+    def stats(self):
+        return({"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.items)
+               })
+
+    def __len__(self):
+        return(len(self.items))
+
+    def __contains__(self, k):
+        return(k in self.items)
+
+class TTLCache(object):
+    """
+    An LRU whose entries may expire. Entries put without a ttl are
+    kept until evicted; an expired entry counts as a miss.
+
+    maxsize bounds the sum of the weights of the entries, `weight'
+    being a function of the value [each entry weighs 1 by default
+    and never less than that]. The least recently used entries are
+    evicted until a new one fits.
+    """
+
+    def __init__(self, maxsize, clock=time.time, weight=None):
+        self.lru       = LRU(maxsize)
+        self.maxsize   = maxsize
+        self.clock     = clock
+        self.weight    = weight
+        self.total     = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.expired   = 0
+        self.evictions = 0
+
+    def get(self, k, default=None):
+        entry = self.lru.get(k)
+        if (entry is None):
+            self.misses += 1
+            return(default)
+        (deadline, w, v) = entry
+        if (deadline is not None and deadline <= self.clock()):
+            self.pop(k)
+            self.misses  += 1
+            self.expired += 1
+            return(default)
+        self.hits += 1
+        return(v)
+
+    def pop(self, k, default=None):
+        entry = self.lru.pop(k)
+        if (entry is None):
+            return(default)
+        self.total -= entry[1]
+        return(entry[2])
+
+    def put(self, k, v, ttl=None):
+        deadline = None
+        if (ttl is not None):
+            deadline = self.clock() + ttl
+        w = 1
+        if (self.weight is not None):
+            w = max(1, self.weight(v))
+        self.pop(k)
+        if (w > self.maxsize):
+            return
+        while (self.total + w > self.maxsize):
+            (_, entry)      = self.lru.popitem()
+            self.total     -= entry[1]
+            self.evictions += 1
+        self.lru.put(k, (deadline, w, v))
+        self.total += w
+
+    def clear(self):
+        self.lru.clear()
+        self.total = 0
+
+    def stats(self):
+        return({"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "size": len(self.lru),
+                "weight": self.total
+               })
+
+    def __len__(self):
+        return(len(self.lru))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+class Coalesce(object):
+    """
+    Keeps only the last object of each (kind, key, minute) as they
+    would all be written to the same column anyway. Objects must be
+    truncated to the minute already.
+
+    Objects are released by flush once their minute [plus `grace'
+    seconds] is over, or by add when more than `maxsize' of them are
+    pending.
+    """
+
+    def __init__(self, maxsize, grace=5):
+        self.maxsize   = maxsize
+        self.grace     = grace
+        self.minutes   = {}
+        self.size      = 0
+        self.coalesced = 0
+
+    def add(self, objects):
+        # returns the objects that must be written right away
+        for o in objects:
+            t = o.unixtimestamp()
+            m = self.minutes.get(t)
+            if (m is None):
+                m               = {}
+                self.minutes[t] = m
+            k = (o.kind(), o.name())
+            if (k in m):
+                self.coalesced += 1
+            else:
+                self.size += 1
+            m[k] = o
+        if (self.size > self.maxsize):
+            return(self.flush())
+        return([])
+
+    def flush(self, now=None):
+        # removes and returns the objects of minutes that are over by
+        # `now', or all of them if it is None
+        objects = []
+        for t in sorted(self.minutes.keys()):
+            if (now is not None and t + 60 + self.grace > now):
+                break
+            m = self.minutes.pop(t)
+            self.size -= len(m)
+            objects.extend(m.itervalues())
+        return(objects)
@@ -14,8 +14,8 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-from leela.server.data.metric import *
 from leela.server import logger
+from leela.server import cache
 import struct
 
 TYPE_HOST            = 0x0000
@@ -39,19 +39,44 @@ DS_GAUGE             = 1
 DS_DERIVE            = 2
 DS_ABSOLUTE          = 3
 
+DS_TYPES             = {DS_COUNTER : "counter",
+                        DS_GAUGE   : "gauge",
+                        DS_DERIVE  : "derive",
+                        DS_ABSOLUTE: "absolute"
+                       }
+
+ST_HEADER            = struct.Struct(">2H")
+ST_NUMERIC           = struct.Struct(">q")
+ST_NVALUES           = struct.Struct(">H")
+
 PA_PARSERS           = None
 DS_PARSERS           = None
 
-def parse_packet(packet):
-    offset = 0
-    psize  = len(packet)
-    parts  = []
-    while (offset < psize):
-        pa_type, _    = struct.unpack_from(">2H", packet[offset:])
-        item, pa_size = PA_PARSERS.get(pa_type, parse_skip)(packet[offset:])
-        offset       += pa_size
-        parts.append((pa_type, item))
-    return(metrics(parts))
+KEYCACHE             = cache.LRU(64*1024)
+
+def parse_packet(packet, keycache=KEYCACHE):
+    """
+    Parses a collectd packet. Parts are read in place using offsets
+    into the packet [struct.unpack_from], so no copies are made but
+    for the strings themselves. Keys are looked up in [and added to]
+    the keycache, which is keyed by plugin [see format].
+
+    Returns a list of (type, key, value, time) tuples.
+    """
+    offset  = 0
+    psize   = len(packet)
+    context = {}
+    metrics = []
+    while (offset + ST_HEADER.size <= psize):
+        (pa_type, pa_size) = ST_HEADER.unpack_from(packet, offset)
+        if (pa_size < ST_HEADER.size or offset + pa_size > psize):
+            raise(ValueError("invalid part size: %d" % pa_size))
+        if (pa_type == TYPE_VALUES):
+            parse_values(packet, offset, pa_size, context, metrics, keycache)
+        elif (pa_type in PA_PARSERS):
+            context[pa_type] = PA_PARSERS[pa_type](packet, offset, pa_size)
+        offset += pa_size
+    return(metrics)
 
 def valid(x):
     return(x not in (None, ""))
@@ -59,101 +84,70 @@ def valid(x):
 def join_(s, *args):
     return(s.join(filter(valid, args)))
 
-def format(metric, value, context):
+def mkkey(user, host, plugin, plugin_instance, mtype, type_instance, suffix):
+    plugin = join_("-", plugin, plugin_instance)
+    mtype  = join_("-", mtype, type_instance)
+    return(intern(join_(".", user, host, plugin, mtype, suffix)))
+
+def format(metric, value, context, keycache=KEYCACHE):
     if (TYPE_SIGNATURE not in context):
         logger.debug("dropping unauthenticated package!")
         return
     elif (TYPE_HOST not in context):
         logger.debug("dropping package without host information")
         return
-    user    = context[TYPE_SIGNATURE]
-    host    = context[TYPE_HOST]
-    plugin  = join_("-", context.get(TYPE_PLUGIN), context.get(TYPE_PLUGIN_INSTANCE))
-    mtype   = join_("-", context.get(TYPE_TYPE), context.get(TYPE_TYPE_INSTANCE))
-    key     = join_(".", user[0], host, plugin, mtype, context.get(MY_TYPE_SUFFIX))
+    # the keycache holds one entry per plugin [user, host, plugin,
+    # plugin instance], each one a dict of the keys built so far for
+    # that plugin. this keeps the number of entries proportional to
+    # the plugins each host runs rather than to the number of keys.
+    pctx = (context[TYPE_SIGNATURE][0],
+            context[TYPE_HOST],
+            context.get(TYPE_PLUGIN),
+            context.get(TYPE_PLUGIN_INSTANCE))
+    tctx = (context.get(TYPE_TYPE),
+            context.get(TYPE_TYPE_INSTANCE),
+            context.get(MY_TYPE_SUFFIX))
+    keys = keycache.get(pctx)
+    if (keys is None):
+        keys = {}
+        keycache.put(pctx, keys)
+    key = keys.get(tctx)
+    if (key is None):
+        key        = mkkey(*(pctx + tctx))
+        keys[tctx] = key
     if (TYPE_TIME_HI in context):
         mtime = context[TYPE_TIME_HI] / float(2**30)
     else:
         mtime = context[TYPE_TIME]
-    if (metric == DS_COUNTER):
-        return(Counter(key, value, mtime))
-    elif (metric == DS_ABSOLUTE):
-        return(Absolute(key, value, mtime))
-    elif (metric == DS_DERIVE):
-        return(Derive(key, value, mtime))
-    elif (metric == DS_GAUGE):
-        return(Gauge(key, value, mtime))
-    else:
-        raise(RuntimeError())
-
-def metrics(parts):
-    context = {}
-    types   = {DS_COUNTER: "counter",
-               DS_ABSOLUTE: "absolute",
-               DS_GAUGE: "gauge",
-               DS_DERIVE: "derive"
-              }
-    metrics = []
-    for (ptype, pvalue) in parts:
-        context[ptype] = pvalue
-        if (ptype == TYPE_VALUES):
-            counter = -1
-            for metric, value in pvalue:
-                counter += 1
-                if (len(pvalue) > 1):
-                    context[MY_TYPE_SUFFIX] = str(counter)
-                elif (MY_TYPE_SUFFIX in context):
-                    del(context[MY_TYPE_SUFFIX])
-                m = format(metric, value, context)
-                if (m is not None):
-                    metrics.append(m)
-    return(metrics)
-
-def parse_string(packet):
-    _, plen = struct.unpack_from(">2H", packet)
-    offset  = 4
-    limit   = plen - offset - 1
-    value   = struct.unpack_from("%ds" % limit, packet, offset)[0]
-    return(value, plen)
-
-def parse_signature(packet):
-    _, plen   = struct.unpack_from(">2H", packet)
-    offset    = 4
-    signature = packet[offset:32]
-    offset   += 32
-    limit     = plen - offset
-    username  = struct.unpack_from("%ds" % limit, packet, offset)[0]
-    return((username, signature), plen)
-
-def parse_skip(packet):
-    _, plen = struct.unpack_from(">2H", packet)
-    return(None, plen)
-
-def parse_numeric(packet):
-    _, plen = struct.unpack_from(">2H", packet)
-    offset  = 4
-    value   = struct.unpack_from(">q", packet[offset:])[0]
-    return(value, plen)
-
-def parse_values_(size, packet):
-    vtypes = []
-    values = []
-    offset = 0
-    for _ in range(size):
-        vtypes.append(struct.unpack_from("B", packet[offset:])[0])
-        offset += 1
-    for vtype in vtypes:
-        vpart, vsize = DS_PARSERS[vtype](packet[offset:])
-        offset      += vsize
-        values.append((vtype, vpart))
-    return(values, offset)
-
-def parse_values(packet):
-    offset        = 4
-    values        = struct.unpack_from(">H", packet[offset:])[0]
-    offset       += 2
-    vparts, vsize = parse_values_(values, packet[offset:])
-    return(vparts, offset + vsize)
+    return((DS_TYPES[metric], key, value, mtime))
+
+def parse_string(packet, offset, size):
+    return(packet[offset+4:offset+size-1])
+
+def parse_signature(packet, offset, size):
+    signature = packet[offset+4:offset+36]
+    username  = packet[offset+36:offset+size]
+    return((username, signature))
+
+def parse_numeric(packet, offset, size):
+    return(ST_NUMERIC.unpack_from(packet, offset+4)[0])
+
+def parse_values(packet, offset, size, context, metrics, keycache):
+    nvalues = ST_NVALUES.unpack_from(packet, offset+4)[0]
+    vtypes  = packet[offset+6:offset+6+nvalues]
+    voffset = offset + 6 + nvalues
+    if (voffset + 8 * nvalues > offset + size):
+        raise(ValueError("invalid values part"))
+    if (nvalues == 1 and MY_TYPE_SUFFIX in context):
+        del(context[MY_TYPE_SUFFIX])
+    for k in range(nvalues):
+        vtype = ord(vtypes[k])
+        value = DS_PARSERS[vtype].unpack_from(packet, voffset + 8 * k)[0]
+        if (nvalues > 1):
+            context[MY_TYPE_SUFFIX] = str(k)
+        m = format(vtype, value, context, keycache)
+        if (m is not None):
+            metrics.append(m)
 
 PA_PARSERS = {TYPE_HOST           : parse_string,
               TYPE_TIME           : parse_numeric,
@@ -162,7 +156,6 @@ PA_PARSERS = {TYPE_HOST           : parse_string,
               TYPE_PLUGIN_INSTANCE: parse_string,
               TYPE_TYPE           : parse_string,
               TYPE_TYPE_INSTANCE  : parse_string,
-              TYPE_VALUES         : parse_values,
               TYPE_INTERVAL       : parse_numeric,
               TYPE_INTERVAL_HI    : parse_numeric,
               TYPE_MESSAGE        : parse_string,
@@ -170,8 +163,8 @@ PA_PARSERS = {TYPE_HOST           : parse_string,
               TYPE_SIGNATURE      : parse_signature
              }
 
-DS_PARSERS = {DS_COUNTER : lambda p: (struct.unpack_from(">Q", p)[0], 8),
-              DS_GAUGE   : lambda p: (struct.unpack_from("<d", p)[0], 8),
-              DS_DERIVE  : lambda p: (struct.unpack_from(">q", p)[0], 8),
-              DS_ABSOLUTE: lambda p: (struct.unpack_from(">Q", p)[0], 8)
+DS_PARSERS = {DS_COUNTER : struct.Struct(">Q"),
+              DS_GAUGE   : struct.Struct("<d"),
+              DS_DERIVE  : struct.Struct(">q"),
+              DS_ABSOLUTE: struct.Struct(">Q")
              }
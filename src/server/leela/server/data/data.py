@@ -19,6 +19,8 @@ from leela.server.data.storable import Timestamp
 
 class Data(storable.Storable):
 
+    __slots__ = ()
+
     @classmethod
     def kind(self):
         return("data")
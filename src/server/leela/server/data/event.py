@@ -19,6 +19,8 @@ from leela.server.data.storable import Timestamp
 
 class Event(storable.Storable):
 
+    __slots__ = ()
+
     @classmethod
     def kind(self):
         return("event")
@@ -2,3 +2,6 @@
 
 class NotFoundExcept(Exception):
     pass
+
+class TruncatedExcept(ValueError):
+    pass
@@ -15,43 +15,136 @@
 #    limitations under the License.
 #
 
-import time
+import json
+import zlib
 from leela.server import funcs
-from leela.server.data import pp
+from leela.server import timeutil
 from leela.server.data import parser
 from leela.server.data import event
 from leela.server.data import data
 
 DEFAULT_EPOCH = 2000
 
+# data values are stored as a version byte followed by the value
+# itself: compact json, zlib compressed when that pays off. columns
+# written before that are plain json, which never starts with these
+# bytes.
+VALUE_JSON         = "\x01"
+VALUE_JSON_ZLIB    = "\x02"
+COMPRESS_THRESHOLD = 256
+
+def encode_value(v, threshold=COMPRESS_THRESHOLD):
+    s = json.dumps(v, separators=(",", ":"))
+    if (len(s) > threshold):
+        z = zlib.compress(s)
+        if (len(z) < len(s)):
+            return(VALUE_JSON_ZLIB + z)
+    return(VALUE_JSON + s)
+
+def decode_value(s):
+    tag = s[:1]
+    if (tag == VALUE_JSON):
+        return(parser.parse_json(s[1:]))
+    elif (tag == VALUE_JSON_ZLIB):
+        return(parser.parse_json(zlib.decompress(s[1:])))
+    else:
+        return(parser.parse_json(s))
+
 def serialize_key(y, mo, d, h, mi, s, epoch):
-    e = funcs.timetuple_timestamp((epoch, 1, 1, 0, 0, 0))
-    t = funcs.timetuple_timestamp((y, mo, d, h, mi, s))
-    return(t - e)
+    return(timeutil.timegm(y, mo, d, h, mi, s) - timeutil.epoch(epoch))
 
 def unserialize_key(k, epoch):
-    e = funcs.timetuple_timestamp((epoch, 1, 1, 0, 0, 0))
-    t = funcs.datetime_fromtimestamp(k + e)
-    return(t.year, t.month, t.day, t.hour, t.minute, t.second)
+    return(timeutil.gmtime(timeutil.decode_key(k, epoch)))
 
 def serialize_event(e, epoch):
-    timestamp = (e.year(), e.month(), e.day(), e.hour(), e.minute(), e.second())
-    k = serialize_key(*timestamp, epoch=epoch)
+    k = timeutil.encode_key(e.unixtimestamp(), epoch)
     v = e.value()
     return((k, v))
 
 def serialize_data(e, epoch):
-    timestamp = (e.year(), e.month(), e.day(), e.hour(), e.minute(), e.second())
-    k = serialize_key(*timestamp, epoch=epoch)
-    v = pp.render_json(e.value())
+    k = timeutil.encode_key(e.unixtimestamp(), epoch)
+    v = encode_value(e.value())
     return((k, v))
 
 def unserialize_event(name, k, v, epoch):
-    timetuple = list(unserialize_key(k, epoch=epoch))
-    timestamp = funcs.timetuple_timestamp(timetuple)
-    return(event.Event(name, v, timestamp))
+    return(event.Event(name, v, timeutil.decode_key(k, epoch)))
 
 def unserialize_data(name, k, v, epoch):
-    timetuple = list(unserialize_key(k, epoch=epoch))
-    timestamp = funcs.timetuple_timestamp(timetuple)
-    return(data.Data(name, parser.parse_json(v), timestamp))
+    return(data.Data(name, decode_value(v), timeutil.decode_key(k, epoch)))
+
+def unserialize_events(name, kvs, epoch):
+    e = timeutil.epoch(epoch)
+    return(event.Event.make_many(name, [(v, k + e) for (k, v) in kvs]))
+
+def unserialize_datas(name, kvs, epoch):
+    e = timeutil.epoch(epoch)
+    return(data.Data.make_many(name, [(decode_value(v), k + e) for (k, v) in kvs]))
+
+def group_mutations(f, items, maxrows, maxcols):
+    # groups items into batch_mutate mappings ({key: {cf: {col:
+    # value}}}), `f' turns each item into a (cf, key, col, value)
+    # tuple. each mapping holds at most `maxrows' distinct (key, cf)
+    # rows and `maxcols' columns; returns a list of (items, mapping)
+    # pairs.
+    if (maxrows < 1 or maxcols < 1):
+        raise(ValueError("maxrows and maxcols must be positive"))
+    batches = []
+    group   = []
+    batch   = {}
+    rows    = 0
+    for item in items:
+        (cf, key, col, value) = f(item)
+        if (len(group) == maxcols or (rows == maxrows and cf not in batch.get(key, ()))):
+            batches.append((group, batch))
+            group = []
+            batch = {}
+            rows  = 0
+        cfs = batch.get(key)
+        if (cfs is None):
+            cfs        = {}
+            batch[key] = cfs
+        row = cfs.get(cf)
+        if (row is None):
+            row     = {}
+            cfs[cf] = row
+            rows   += 1
+        row[col] = value
+        group.append(item)
+    if (group):
+        batches.append((group, batch))
+    return(batches)
+
+CATALOG_END = u"\uffff".encode("utf8")
+
+def catalog_name(name):
+    # catalog columns are compared as bytes: names [and the prefixes
+    # they are listed by] are normalized and encoded as utf8, so that
+    # buckets are byte prefixes too
+    name = funcs.norm_key(name)
+    if (isinstance(name, unicode)):
+        return(name.encode("utf8"))
+    return(name)
+
+def catalog_row(kind, bucket):
+    return("%s:%s" % (kind, bucket))
+
+def catalog_index(kind):
+    return("%s/" % kind)
+
+def catalog_entries(objects, seen, size):
+    # yields the (y, m, row, column) catalog entries the objects
+    # produce that are not in `seen' yet: the key itself, in the row
+    # of its prefix bucket, and that bucket, in the index row. the
+    # entries themselves are the keys of `seen'.
+    for obj in objects:
+        (y, m) = timeutil.month_bucket(obj.unixtimestamp())
+        name   = catalog_name(obj.name())
+        bucket = name[:size]
+        entry  = (y, m, catalog_row(obj.kind(), bucket), name)
+        if (seen.get(entry) is None):
+            seen.put(entry, True)
+            yield(entry)
+            entry = (y, m, catalog_index(obj.kind()), bucket)
+            if (seen.get(entry) is None):
+                seen.put(entry, True)
+                yield(entry)
@@ -22,6 +22,16 @@ from leela.server import config
 from leela.server.data import event
 from leela.server.data import data
 from leela.server.data import metric
+from leela.server.data import excepts
+from leela.server.data import pp
+
+METRICS     = { "gauge"   : metric.Gauge,
+                "counter" : metric.Counter,
+                "derive"  : metric.Derive,
+                "absolute": metric.Absolute
+              }
+METRIC_HEAD = re.compile(r"\s*(gauge|counter|derive|absolute) (\d+)\|")
+METRIC_TAIL = re.compile(r" (-?(?:nan|inf|\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)) (\d+\.\d+);")
 
 def parse_json(x):
     return(json.loads(x))
@@ -103,6 +113,244 @@ def parse_data(s):
     else:
         raise(ValueError("; was expected"))
 
+def parse_int_at(s, o, w):
+    i = s.find(w, o)
+    n = s[o:i]
+    if (i == -1 and s[o:].isdigit()):
+        raise(excepts.TruncatedExcept("%s was expected" % w))
+    if (i == -1 or not n.isdigit()):
+        raise(ValueError("number was expected"))
+    return(int(n, 10), i + len(w))
+
+def parse_double_at(s, o, w):
+    i = s.find(w, o)
+    if (i == -1):
+        raise(excepts.TruncatedExcept("%s was expected" % w))
+    return(float(s[o:i]), i + len(w))
+
+def parse_take_at(s, o, n, w):
+    i = o + n
+    if (i + len(w) > len(s)):
+        raise(excepts.TruncatedExcept("%s was expected" % w))
+    if (not s.startswith(w, i)):
+        raise(ValueError("%s was expected" % w))
+    return(s[o:i], i + len(w))
+
+def parse_event_at(s, o):
+    (l, o) = parse_int_at(s, o, "|")
+    (n, o) = parse_take_at(s, o, l, " ")
+    (v, o) = parse_double_at(s, o, " ")
+    (t, o) = parse_double_at(s, o, ";")
+    return(event.Event(n, v, t), o)
+
+def parse_data_at(s, o):
+    (l, o) = parse_int_at(s, o, "|")
+    (n, o) = parse_take_at(s, o, l, " ")
+    (l, o) = parse_int_at(s, o, "|")
+    (v, o) = parse_take_at(s, o, l, " ")
+    (t, o) = parse_double_at(s, o, ";")
+    return(data.Data(n, parse_json(v), t), o)
+
+def parse_struct_at(s, o, fmt):
+    if (o + fmt.size > len(s)):
+        raise(excepts.TruncatedExcept("%d bytes were expected" % fmt.size))
+    return(fmt.unpack_from(s, o), o + fmt.size)
+
+def parse_bytes_at(s, o, n):
+    if (o + n > len(s)):
+        raise(excepts.TruncatedExcept("%d bytes were expected" % n))
+    return(s[o:o+n], o + n)
+
+def parse_binary_event_at(s, o):
+    ((_, l), o) = parse_struct_at(s, o, pp.BIN_HEADER)
+    (n, o)      = parse_bytes_at(s, o, l)
+    ((v, t), o) = parse_struct_at(s, o, pp.BIN_EVENT_)
+    return(event.Event(n, v, t), o)
+
+def parse_binary_data_at(s, o):
+    ((_, l), o) = parse_struct_at(s, o, pp.BIN_HEADER)
+    (n, o)      = parse_bytes_at(s, o, l)
+    ((t, l), o) = parse_struct_at(s, o, pp.BIN_DATA_)
+    (v, o)      = parse_bytes_at(s, o, l)
+    return(data.Data(n, parse_json(v), t), o)
+
+def split_binary_at(s, o):
+    ((k, l), i) = parse_struct_at(s, o, pp.BIN_HEADER)
+    i          += l
+    if (k == pp.BIN_EVENT):
+        i += pp.BIN_EVENT_.size
+    else:
+        ((_, l), i) = parse_struct_at(s, i, pp.BIN_DATA_)
+        i          += l
+    if (i > len(s)):
+        raise(excepts.TruncatedExcept("%d bytes were expected" % (i - o)))
+    return(i - o)
+
+def skip_at(s, o):
+    if (s.startswith(pp.BIN_EVENT, o) or s.startswith(pp.BIN_DATA, o)):
+        try:
+            return(o + split_binary_at(s, o))
+        except ValueError:
+            return(len(s))
+    i = s.find(";", o)
+    if (i == -1):
+        return(len(s))
+    return(i + 1)
+
+def split_at(s, o):
+    if (s.startswith(pp.BIN_EVENT, o) or s.startswith(pp.BIN_DATA, o)):
+        return(split_binary_at(s, o))
+    i = s.find(" ", o)
+    if (i == -1):
+        raise(excepts.TruncatedExcept("message was expected"))
+    (l, i) = parse_int_at(s, i + 1, "|")
+    i     += l
+    if (s.startswith("data ", o)):
+        (l, i) = parse_int_at(s, i + 1, "|")
+        i     += l
+    i = s.find(";", i)
+    if (i == -1):
+        raise(excepts.TruncatedExcept("; was expected"))
+    return(i + 1 - o)
+
+def key_at(s, o):
+    # the name of the message at `o', which split_at must have
+    # accepted already
+    if (s.startswith(pp.BIN_EVENT, o) or s.startswith(pp.BIN_DATA, o)):
+        ((_, l), i) = parse_struct_at(s, o, pp.BIN_HEADER)
+    else:
+        (l, i) = parse_int_at(s, s.find(" ", o) + 1, "|")
+    return(s[i:i+l])
+
+def split_keys(s):
+    """
+    Splits a packet into messages without parsing them. This honors
+    the length-prefixed names and data values, so a `;' inside them
+    does not break the message apart. Only the length prefix of each
+    message is parsed to find its name.
+
+    Returns (name, message) pairs along with the number of malformed
+    and truncated messages.
+    """
+    frames    = []
+    malformed = 0
+    truncated = 0
+    offset    = 0
+    size      = len(s)
+    while (offset < size):
+        try:
+            n = split_at(s, offset)
+            frames.append((key_at(s, offset), s[offset:offset+n]))
+            offset += n
+        except excepts.TruncatedExcept:
+            truncated += 1
+            offset     = skip_at(s, offset)
+        except ValueError:
+            malformed += 1
+            offset     = skip_at(s, offset)
+    return(frames, malformed, truncated)
+
+def parse_frames(s):
+    """
+    Parses all event and data messages of a packet. Instead of
+    slicing the input after each token, this keeps an offset into
+    the packet, which is much cheaper for large datagrams. Malformed
+    messages are skipped up to the next `;'. Both the text and the
+    binary [see pp.storable_renderer] encodings are accepted, even
+    in the same packet.
+
+    Returns the list of messages along with the number of malformed
+    and truncated messages.
+    """
+    msgs      = []
+    malformed = 0
+    truncated = 0
+    offset    = 0
+    size      = len(s)
+    while (offset < size):
+        try:
+            if (s.startswith("event ", offset)):
+                (x, offset) = parse_event_at(s, offset + 6)
+            elif (s.startswith("data ", offset)):
+                (x, offset) = parse_data_at(s, offset + 5)
+            elif (s.startswith(pp.BIN_EVENT, offset)):
+                (x, offset) = parse_binary_event_at(s, offset)
+            elif (s.startswith(pp.BIN_DATA, offset)):
+                (x, offset) = parse_binary_data_at(s, offset)
+            else:
+                raise(ValueError("unknown message"))
+            msgs.append(x)
+        except excepts.TruncatedExcept:
+            truncated += 1
+            offset     = skip_at(s, offset)
+        except ValueError:
+            malformed += 1
+            offset     = skip_at(s, offset)
+    return(msgs, malformed, truncated)
+
+def parse_many(s):
+    """
+    The same as parse_frames, but returns only the messages and the
+    number of rejected ones.
+    """
+    (msgs, malformed, truncated) = parse_frames(s)
+    return(msgs, malformed + truncated)
+
+def parse_metric_at(s, o):
+    h = METRIC_HEAD.match(s, o)
+    if (h is None):
+        raise(ValueError("gauge|counter|derive|absolute were expected"))
+    i = h.end() + int(h.group(2), 10)
+    t = METRIC_TAIL.match(s, i)
+    if (t is None):
+        raise(ValueError("syntax error"))
+    m = METRICS[h.group(1)](s[h.end():i], float(t.group(1)), float(t.group(2)))
+    return(m, h.start(1), t.end())
+
+def parse_metric(s):
+    (m, _, o) = parse_metric_at(s, 0)
+    return(m, s[o:])
+
+def scan_metrics(s):
+    """
+    Validates and splits a packet of metrics in one pass. This
+    accepts the same grammar the timeline does, so anything it
+    yields may be forwarded as is.
+
+    Yields (metric, msg) pairs, where msg is the raw message. For
+    malformed messages metric is None and msg is the fragment that
+    was skipped (up to the next `;').
+    """
+    offset = 0
+    size   = len(s)
+    while (offset < size):
+        try:
+            (m, i, offset) = parse_metric_at(s, offset)
+        except ValueError:
+            i = s.find(";", offset)
+            if (i == -1):
+                if (s[offset:].strip() != ""):
+                    yield(None, s[offset:])
+                break
+            yield(None, s[offset:i+1])
+            offset = i + 1
+            continue
+        yield(m, s[i:offset])
+
+def parse_metrics(s):
+    """
+    Parses all metrics of a packet, returning the list of metrics
+    and the number of rejected messages.
+    """
+    metrics  = []
+    rejected = 0
+    for (m, _) in scan_metrics(s):
+        if (m is None):
+            rejected += 1
+        else:
+            metrics.append(m)
+    return(metrics, rejected)
+
 def parse_status(s):
     s      = parse_string(s, "status ")
     (l, s) = parse_int(s)
@@ -165,6 +413,12 @@ def parse_data_(s):
     except:
         return(None, "")
 
+def parse_metric_(s):
+    try:
+        return(parse_metric(s))
+    except:
+        return(None, "")
+
 def parse_timespec(s):
     """
     %Y%m%dT%H%M
@@ -229,3 +483,26 @@ def parse_json_metric(s, name=None):
     else:
         return([parse_json_metric1(results, name)])
 
+
+def parse_json_multi(s, maxkeys=1000):
+    """
+    {"keys": [key, ...], "start": timespec, "finish": timespec}
+    """
+    result = parse_json(s)
+    if (not isinstance(result, dict)):
+        raise(ValueError("json must be an object"))
+    keys = result["keys"]
+    if (not isinstance(keys, list) or len(keys) == 0):
+        raise(ValueError("keys must be a non-empty list"))
+    if (len(keys) > maxkeys):
+        raise(ValueError("too many keys [maximum: %d]" % (maxkeys,)))
+    for k in keys:
+        if (not isinstance(k, basestring) or k == ""):
+            raise(ValueError("keys must be non-empty strings"))
+    uniq = []
+    seen = set()
+    for k in keys:
+        if (k not in seen):
+            seen.add(k)
+            uniq.append(k)
+    return((uniq, parse_timespec(result["start"]), parse_timespec(result["finish"])))
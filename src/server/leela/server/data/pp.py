@@ -16,9 +16,16 @@
 #
 
 import json
+import struct
 from leela.server.data import event
 from leela.server.data import data
 
+BIN_EVENT  = "\x01"
+BIN_DATA   = "\x02"
+BIN_HEADER = struct.Struct(">cH")
+BIN_EVENT_ = struct.Struct(">dd")
+BIN_DATA_  = struct.Struct(">dI")
+
 def render_json(x):
     return(json.dumps(x, allow_nan=True, sort_keys=True))
 
@@ -31,6 +38,13 @@ def render_metric(m):
 def render_metrics(ms):
     return("".join(map(render_metric, ms)))
 
+def render_metric_tuple(m):
+    (mtype, key, val, time) = m
+    return("%s %d|%s %s %s;" % (mtype, len(key), key, repr(float(val)), repr(float(time))))
+
+def render_metric_tuples(ms):
+    return("".join(map(render_metric_tuple, ms)))
+
 def render_data(e):
     value = render_json(e.value())
     return("data %d|%s %d|%s %d.0;" % (len(e.name()), e.name(), len(value), value, e.unixtimestamp()))
@@ -46,6 +60,42 @@ def render_storable(s):
     else:
         raise(RuntimeError())
 
+def render_name_binary(kind, name):
+    if (isinstance(name, unicode)):
+        name = name.encode("utf-8")
+    return(BIN_HEADER.pack(kind, len(name)) + name)
+
+def render_event_binary(e):
+    return(render_name_binary(BIN_EVENT, e.name()) + BIN_EVENT_.pack(e.value(), e.unixtimestamp()))
+
+def render_data_binary(e):
+    value = render_json(e.value())
+    return(render_name_binary(BIN_DATA, e.name()) + BIN_DATA_.pack(e.unixtimestamp(), len(value)) + value)
+
+def render_storable_binary(s):
+    if isinstance(s, event.Event):
+        return(render_event_binary(s))
+    elif isinstance(s, data.Data):
+        return(render_data_binary(s))
+    else:
+        raise(RuntimeError())
+
+def render_storables_binary(ss):
+    return("".join(map(render_storable_binary, ss)))
+
+def storable_renderer(encoding):
+    """
+    The function to use to render storables for a given databus
+    encoding [text|binary]. The binary encoding packs value and
+    timestamp as doubles, so no float formatting/parsing takes place
+    in either side. Only python peers [e.g. Databus] understand it.
+    """
+    if (encoding == "text"):
+        return(render_storable)
+    elif (encoding == "binary"):
+        return(render_storable_binary)
+    raise(ValueError("unknown encoding: %s" % encoding))
+
 def render_storable_to_json(e):
     return({"name": e.name(), "value": e.value(), "timestamp": e.unixtimestamp()})
 
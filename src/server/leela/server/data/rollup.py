@@ -0,0 +1,155 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import math
+from leela.server import cache
+from leela.server.data import event
+
+# the resolution [in seconds] of raw events and of each rollup
+RAW         = 60
+RESOLUTIONS = (300, 3600, 86400)
+
+MIN    = 0
+MAX    = 1
+SUM    = 2
+COUNT  = 3
+MERGED = 4
+
+AGGREGATES = {"min"  : lambda a: a[MIN],
+              "max"  : lambda a: a[MAX],
+              "sum"  : lambda a: a[SUM],
+              "count": lambda a: a[COUNT],
+              "mean" : lambda a: a[SUM] / a[COUNT]
+             }
+
+def aggregate(name):
+    if (name not in AGGREGATES):
+        raise(ValueError("unknown aggregate: %s" % name))
+    return(AGGREGATES[name])
+
+def plan(t0, t1, maxpoints, resolutions=RESOLUTIONS):
+    """
+    The finest resolution that gives at most `maxpoints' points for
+    [t0, t1], None meaning raw events. The coarsest resolution is
+    used when none of them does.
+    """
+    if (maxpoints < 1):
+        raise(ValueError("maxpoints must be positive"))
+    if ((t1 - t0) // RAW + 1 <= maxpoints):
+        return(None)
+    for r in resolutions:
+        if ((t1 - t0) // r + 1 <= maxpoints):
+            return(r)
+    return(resolutions[-1])
+
+def combine(a, b):
+    # the aggregate of two [min, max, sum, count] aggregates
+    return((min(a[MIN], b[MIN]), max(a[MAX], b[MAX]), a[SUM] + b[SUM], a[COUNT] + b[COUNT]))
+
+def downsample(events, resolution, f):
+    """
+    Rolls up events [oldest first] on the fly: one event per bucket
+    of `resolution' seconds, whose value is the aggregate `f' of the
+    events in that bucket.
+    """
+    buckets = []
+    for e in events:
+        v = e.value()
+        if (math.isnan(v) or math.isinf(v)):
+            continue
+        t = int(e.unixtimestamp())
+        t = t - t % resolution
+        if (buckets and buckets[-1][0] == t):
+            buckets[-1][1] = combine(buckets[-1][1], (v, v, v, 1))
+        else:
+            buckets.append([t, (v, v, v, 1)])
+    return([event.Event(e.name(), f(a), t) for (t, a) in buckets])
+
+class Rollup(object):
+    """
+    Keeps [min, max, sum, count] of the events of each key in buckets
+    of each resolution. Buckets are kept in an LRU of `maxsize'
+    entries; the ones updated since the last flush are dirty and get
+    returned by flush.
+
+    A bucket created here [after a restart, or after it was evicted
+    from the LRU] only holds the events seen since; it is flushed as
+    not merged, and the caller must combine it with the stored one
+    before writing it [see merge]. maxsize should comfortably hold
+    the active keys times the number of resolutions, or buckets get
+    read back over and over.
+    """
+
+    def __init__(self, maxsize, resolutions=RESOLUTIONS):
+        self.resolutions = resolutions
+        self.buckets     = cache.LRU(maxsize)
+        self.dirty       = {}
+
+    def update(self, events):
+        for e in events:
+            v = e.value()
+            if (math.isnan(v) or math.isinf(v)):
+                continue
+            n = e.name()
+            t = int(e.unixtimestamp())
+            for r in self.resolutions:
+                k = (n, r, t - t % r)
+                a = self.buckets.get(k)
+                if (a is None):
+                    a = [v, v, v, 1, False]
+                    self.buckets.put(k, a)
+                else:
+                    a[MIN]    = min(a[MIN], v)
+                    a[MAX]    = max(a[MAX], v)
+                    a[SUM]   += v
+                    a[COUNT] += 1
+                self.dirty[k] = a
+
+    def flush(self):
+        # [(name, resolution, time, (min, max, sum, count), merged)]
+        dirty      = self.dirty
+        self.dirty = {}
+        return([(k[0], k[1], k[2], tuple(a[:MERGED]), a[MERGED]) for (k, a) in dirty.iteritems()])
+
+    def merge(self, buckets, stored):
+        # combines the buckets flush returned as not merged with
+        # their stored aggregates [stored maps (name, resolution,
+        # time) to one, buckets never written have none]. returns the
+        # buckets ready to be written.
+        merged = []
+        for (n, r, t, a, _) in buckets:
+            k = (n, r, t)
+            s = stored.get(k)
+            if (s is not None):
+                a = combine(a, s)
+            merged.append((n, r, t, a, True))
+            b = self.buckets.get(k)
+            if (b is not None and not b[MERGED]):
+                if (s is not None):
+                    b[:MERGED] = combine(b, s)
+                b[MERGED] = True
+        return(merged)
+
+    def retry(self, buckets):
+        # makes buckets that could not be merged dirty again
+        for (n, r, t, a, _) in buckets:
+            k = (n, r, t)
+            b = self.buckets.get(k)
+            if (b is None):
+                b = list(a) + [False]
+                self.buckets.put(k, b)
+            self.dirty[k] = b
@@ -16,9 +16,8 @@
 
 import collections
 import time
-import calendar
-from datetime import timedelta
 from leela.server import funcs
+from leela.server import timeutil
 
 TFF       = 30*60 # 1/2 hour (fuge factor)
 Timestamp = collections.namedtuple("Timestamp", ("year", "month", "day", "hour", "minute", "second"))
@@ -30,85 +29,106 @@ class Storable(object):
         raise(RuntimeError("abstract method"))
 
     @classmethod
-    def load_range(self, storage, k, ys, ms, ds, hs, mins, yf, mf, df, hf, minf):
+    def load_range(self, storage, k, ys, ms, ds, hs, mins, yf, mf, df, hf, minf, maxpoints=None, aggregate="mean"):
         start  = Timestamp._make((ys, ms, ds, hs, mins, 0))
         finish = Timestamp._make((yf, mf, df, hf, minf, 59))
-        return(storage.load(self.kind(), k, start, finish, 31*24*60*60))
+        return(storage.load(self.kind(), k, start, finish, 31*24*60*60, maxpoints, aggregate))
 
     @classmethod
-    def load_time(self, storage, k, y, m, d, h):
+    def load_multi(self, storage, ks, ys, ms, ds, hs, mins, yf, mf, df, hf, minf):
+        start  = Timestamp._make((ys, ms, ds, hs, mins, 0))
+        finish = Timestamp._make((yf, mf, df, hf, minf, 59))
+        return(storage.load_multi(self.kind(), ks, start, finish, 31*24*60*60))
+
+    @classmethod
+    def load_time(self, storage, k, y, m, d, h, maxpoints=None, aggregate="mean"):
         start  = Timestamp._make((y, m, d, h, 0, 0))
         finish = Timestamp._make((y, m, d, h, 59, 59))
-        return(storage.load(self.kind(), k, start, finish, 60*60))
+        return(storage.load(self.kind(), k, start, finish, 60*60, maxpoints, aggregate))
 
     @classmethod
-    def load_day(self, storage, k, y, m, d):
+    def load_day(self, storage, k, y, m, d, maxpoints=None, aggregate="mean"):
         start  = Timestamp._make((y, m, d, 0, 0, 0))
         finish = Timestamp._make((y, m, d, 23, 59, 59))
-        return(storage.load(self.kind(), k, start, finish, 24*60*60))
+        return(storage.load(self.kind(), k, start, finish, 24*60*60, maxpoints, aggregate))
 
     @classmethod
-    def load_month(self, storage, k, y, m):
-        ds, dt = calendar.monthrange(y, m)
-        start  = Timestamp._make((y, m, ds, 0, 0, 0))
-        finish = Timestamp._make((y, m, dt, 23, 59, 59))
-        return(storage.load(self.kind(), k, start, finish, 31*24*60*60))
+    def load_month(self, storage, k, y, m, maxpoints=None, aggregate="mean"):
+        start  = Timestamp._make((y, m, 1, 0, 0, 0))
+        finish = Timestamp._make((y, m, timeutil.month_days(y, m), 23, 59, 59))
+        return(storage.load(self.kind(), k, start, finish, 31*24*60*60, maxpoints, aggregate))
 
     @classmethod
-    def load_past24(self, storage, k):
-        now      = time.time()
-        pasttime = funcs.datetime_fromtimestamp(now) - timedelta(days=1, seconds=TFF)
-        currtime = funcs.datetime_fromtimestamp(now) + timedelta(seconds=TFF)
-        start    = Timestamp._make((pasttime.year, pasttime.month, pasttime.day, pasttime.hour, pasttime.minute, pasttime.second))
-        finish   = Timestamp._make((currtime.year, currtime.month, currtime.day, currtime.hour, currtime.minute, currtime.second))
-        return(storage.load(self.kind(), k, start, finish, 2*24*60*60))
+    def load_past24(self, storage, k, maxpoints=None, aggregate="mean"):
+        now    = timeutil.seconds(time.time())
+        start  = Timestamp._make(timeutil.gmtime(now - timeutil.DAY - TFF))
+        finish = Timestamp._make(timeutil.gmtime(now + TFF))
+        return(storage.load(self.kind(), k, start, finish, 2*24*60*60, maxpoints, aggregate))
 
     @classmethod
-    def load_pastweek(self, storage, k):
-        now      = time.time()
-        pasttime = funcs.datetime_fromtimestamp(now) - timedelta(days=7, seconds=TFF)
-        currtime = funcs.datetime_fromtimestamp(now) + timedelta(seconds=TFF)
-        start    = Timestamp._make((pasttime.year, pasttime.month, pasttime.day, pasttime.hour, pasttime.minute, pasttime.second))
-        finish   = Timestamp._make((currtime.year, currtime.month, currtime.day, currtime.hour, currtime.minute, currtime.second))
-        return(storage.load(self.kind(), k, start, finish, 7*24*60*60))
+    def load_pastweek(self, storage, k, maxpoints=None, aggregate="mean"):
+        now    = timeutil.seconds(time.time())
+        start  = Timestamp._make(timeutil.gmtime(now - 7 * timeutil.DAY - TFF))
+        finish = Timestamp._make(timeutil.gmtime(now + TFF))
+        return(storage.load(self.kind(), k, start, finish, 7*24*60*60, maxpoints, aggregate))
 
     @classmethod
     def enum(self, storage, klimit=100, limit=100):
         return(storage.enum(self.kind(), klimit, limit))
 
+    __slots__ = ("n", "v", "t", "d")
+
+    @classmethod
+    def make_many(self, name, items):
+        """
+        Creates one storable for each (value, timestamp) pair, all of
+        them sharing the same name. The name gets normalized only
+        once, which makes this cheaper than calling the constructor
+        for each item [e.g. when reading columns from a row].
+        """
+        name    = funcs.norm_key(name)
+        new     = self.__new__
+        results = []
+        for (value, timestamp) in items:
+            s   = new(self)
+            s.n = name
+            s.v = value
+            s.t = timestamp
+            s.d = None
+            results.append(s)
+        return(results)
+
     def __init__(self, name, value, timestamp):
-        d = funcs.datetime_fromtimestamp(timestamp)
         self.n = funcs.norm_key(name)
         self.v = value
         self.t = timestamp
-        self.d = Timestamp._make((d.year, d.month, d.day, d.hour, d.minute, d.second))
+        self.d = None
 
     def year(self):
-        return(self.d.year)
+        return(self.timestamp().year)
 
     def month(self):
-        return(self.d.month)
+        return(self.timestamp().month)
 
     def day(self):
-        return(self.d.day)
+        return(self.timestamp().day)
 
     def hour(self):
-        return(self.d.hour)
+        return(self.timestamp().hour)
 
     def minute(self):
-        return(self.d.minute)
+        return(self.timestamp().minute)
 
     def second(self):
-        return(self.d.second)
+        return(self.timestamp().second)
 
     def set_time(self, timetuple):
-        self.t = funcs.timetuple_timestamp(timetuple)
+        self.t = timeutil.timegm(*timetuple)
         self.d = Timestamp._make(timetuple)
 
     def set_unixtimestamp(self, timestamp):
-        d = funcs.datetime_fromtimestamp(timestamp)
         self.t = timestamp
-        self.d = Timestamp._make((d.year, d.month, d.day, d.hour, d.minute, d.second))
+        self.d = None
 
     def name(self):
         return(self.n)
@@ -120,6 +140,10 @@ class Storable(object):
         return(self.t)
 
     def timestamp(self):
+        # the calendar fields are only computed on demand as most
+        # consumers only need the unix timestamp
+        if (self.d is None):
+            self.d = Timestamp._make(timeutil.gmtime(self.t))
         return(self.d)
 
     def store(self, storage):
@@ -21,9 +21,11 @@ from leela.server.data import collectd
 
 class UDP(protocol.DatagramProtocol):
 
+    keycache = collectd.KEYCACHE
+
     def datagramReceived(self, string, peer):
         try:
-            metrics = collectd.parse_packet(string)
+            metrics = collectd.parse_packet(string, self.keycache)
             if (len(metrics) > 0):
                 self.recv_metrics(metrics)
         except:
@@ -18,85 +18,354 @@
 import socket
 import errno
 import time
+import zlib
+import itertools
+import collections
+from twisted.internet import defer
 from twisted.internet import task
 from twisted.internet import protocol
 from twisted.internet import reactor
 from leela.server import logger
 from leela.server.data.pp import *
 from leela.server.data.parser import *
-from leela.server.data.metric import Derive
-from leela.server.data.metric import Gauge
 
 MULTICAST_SOCKET = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
 MAXQUEUE         = 1000000
+MAXDGRAM         = 32*1024
+MINDELAY         = 0.01
+MAXDELAY         = 1.0
+BACKLOG          = 256*1024
+BATCH            = 4096
+DROP_OLDEST      = "drop-oldest"
+DROP_NEWEST      = "drop-newest"
 
-def listen_from(sock):
-    conn = lambda proto: reactor.listenUNIXDatagram(sock, proto, 32*1024)
-    dbus = Databus(conn)
+def listen_from(sock, encoding="text", maxqueue=MAXQUEUE, overflow=DROP_OLDEST, peer=None):
+    conn = lambda proto: reactor.listenUNIXDatagram(sock, proto, MAXDGRAM)
+    dbus = Databus(conn, encoding, maxqueue, overflow, peer)
     dbus.connect()
     return(dbus)
 
 def attach(multicast, peer):
     MULTICAST_SOCKET.sendto(peer, socket.MSG_DONTWAIT, multicast)
 
+def relay_from(cfg, section, option="relay", monit_prefix=None, encoding="text"):
+    # the Relay to the socket `option' of `section' names [a
+    # ShardedRelay if it names more than one, separated by commas];
+    # the datagram option of that section, if present, is the
+    # largest datagram it sends
+    maxsize = MAXDGRAM
+    paths   = [p.strip() for p in cfg.get(section, option).split(",")]
+    if (cfg.has_option(section, "datagram")):
+        maxsize = cfg.getint(section, "datagram")
+    if (len(paths) == 1):
+        return(Relay(paths[0], monit_prefix, encoding, maxsize))
+    return(ShardedRelay(paths, monit_prefix, encoding, maxsize))
+
+def pack(queue, maxsize):
+    # how many packets from the head of the queue fit in a single
+    # datagram [at least one] and their size
+    n    = 0
+    size = 0
+    for p in queue:
+        if (n > 0 and size + len(p) > maxsize):
+            break
+        size += len(p)
+        n    += 1
+    return((n, size))
+
+def mkmetrics(prefix, counters, now):
+    # counters maps names to (type, value) pairs, type being one of
+    # the metric types [gauge, derive, ...]
+    return([METRICS[t]("%s.%s" % (prefix, k), v, now) for (k, (t, v)) in sorted(counters.iteritems())])
+
+def sum_counters(counters):
+    # adds up many counters dicts, name by name
+    total = {}
+    for c in counters:
+        for (k, (t, v)) in c.iteritems():
+            total[k] = (t, total.get(k, (t, 0))[1] + v)
+    return(total)
+
+def shard_of(key, n):
+    # jump consistent hash [Lamping & Veach] of the crc32 of the key:
+    # growing from n to n+1 shards moves only 1/(n+1) of the keys
+    h = zlib.crc32(key) & 0xffffffff
+    b = -1
+    j = 0
+    while (j < n):
+        b = j
+        h = (h * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * (float(1 << 31) / float((h >> 33) + 1)))
+    return(b)
+
 class Relay(object):
+    """
+    Sends packets to a databus socket. Packets are queued and packed
+    into datagrams of at most `maxsize' bytes [a packet larger than
+    that goes alone]. The queue is drained right away; when the peer
+    is full the remaining packets wait for the socket to become
+    writable, and when the peer is gone they are retried with an
+    exponential backoff, so a backlog never waits for the next
+    packet to arrive. At most `maxqueue' packets wait; past that
+    the newest [DROP_NEWEST] or the oldest [DROP_OLDEST] one is
+    dropped.
+    """
 
-    def __init__(self, path, monit_prefix=None):
-        self.fd       = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
-        self.queue    = []
+    def __init__(self, path, monit_prefix=None, encoding="text", maxsize=MAXDGRAM, maxqueue=MAXQUEUE, overflow=DROP_NEWEST):
+        self.render   = storable_renderer(encoding)
+        self.fd       = None
+        self.queue    = collections.deque()
+        self.qbytes   = 0
         self.socket   = path
+        self.maxsize  = maxsize
+        self.maxqueue = maxqueue
+        self.overflow = overflow
         self.packages = 0
+        self.bytes    = 0
+        self.dropped  = 0
+        self.writing  = False
+        self.timer    = None
+        self.delay    = MINDELAY
         self.key      = monit_prefix
         if (monit_prefix is not None):
             task.LoopingCall(self.statistics).start(60)
 
+    def counters(self):
+        return({"writes/s": ("derive", self.packages),
+                "bytes/s": ("derive", self.bytes),
+                "drops/s": ("derive", self.dropped),
+                "queue_size": ("gauge", len(self.queue)),
+                "queue_bytes": ("gauge", self.qbytes)
+               })
+
     def statistics(self):
-        self.queue.append(render_metric(Derive("%s.writes/s" % self.key, self.packages, time.time())))
-        self.queue.append(render_metric(Gauge("%s.queue_size" % self.key, len(self.queue), time.time())))
+        self.relay(render_metrics(mkmetrics(self.key, self.counters(), time.time())))
 
-    def relay(self, packet, sync=False):
-        if (len(self.queue) < MAXQUEUE):
-            self.queue.append(packet)
-        else:
-            logger.warn("discarding packet, queue full!!!")
-        packet = "".join(self.queue[:25])
-        flags  = sync and 0 or socket.MSG_DONTWAIT
+    def fileno(self):
+        if (self.fd is None):
+            return(-1)
+        return(self.fd.fileno())
+
+    def logPrefix(self):
+        return("Relay")
+
+    def connectionLost(self, reason):
+        self.writing = False
+        self.close()
+        self.backoff()
+
+    def doWrite(self):
+        reactor.removeWriter(self)
+        self.writing = False
+        self.drain()
+
+    def open(self):
+        fd = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
         try:
-            self.fd.sendto(packet, flags, self.socket)
-            del(self.queue[:25])
-            self.packages += len(packet.split(";"))
+            fd.connect(self.socket)
         except socket.error:
-            pass
+            fd.close()
+            return(False)
+        self.fd = fd
+        return(True)
+
+    def close(self):
+        if (self.fd is not None):
+            self.fd.close()
+            self.fd = None
+
+    def backoff(self):
+        if (self.timer is None):
+            self.timer = reactor.callLater(self.delay, self._retry)
+            self.delay = min(self.delay * 2, MAXDELAY)
+
+    def _retry(self):
+        self.timer = None
+        self.drain()
+
+    def waiting(self):
+        return(self.writing or self.timer is not None)
+
+    def enqueue(self, packet):
+        if (len(self.queue) >= self.maxqueue):
+            self.dropped += 1
+            logger.warn("discarding packet, queue full!!!")
+            if (self.overflow == DROP_NEWEST):
+                return
+            self.qbytes -= len(self.queue.popleft())
+        self.queue.append(packet)
+        self.qbytes += len(packet)
+
+    def drain(self, sync=False):
+        flags = sync and 0 or socket.MSG_DONTWAIT
+        while (len(self.queue) > 0):
+            if (self.fd is None and not self.open()):
+                self.backoff()
+                return
+            (n, size) = pack(self.queue, self.maxsize)
+            try:
+                self.fd.send("".join(itertools.islice(self.queue, n)), flags)
+            except socket.error, se:
+                if (se.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN)):
+                    self.writing = True
+                    reactor.addWriter(self)
+                else:
+                    self.close()
+                    self.backoff()
+                return
+            for _ in xrange(n):
+                self.queue.popleft()
+            self.qbytes   -= size
+            self.packages += n
+            self.bytes    += size
+            self.delay     = MINDELAY
+
+    def relay(self, packet, sync=False):
+        self.enqueue(packet)
+        if (not self.waiting()):
+            self.drain(sync)
+
+class ShardedRelay(object):
+    """
+    A Relay per socket; each message goes to the one its name hashes
+    to [see shard_of]. Each shard has its own queue and statistics
+    [prefixed by its index], so a shard that is down does not hold
+    the others back.
+    """
+
+    def __init__(self, paths, monit_prefix=None, encoding="text", maxsize=MAXDGRAM):
+        self.render    = storable_renderer(encoding)
+        self.shards    = []
+        self.malformed = 0
+        for (k, path) in enumerate(paths):
+            prefix = None
+            if (monit_prefix is not None):
+                prefix = "%s.%d" % (monit_prefix, k)
+            self.shards.append(Relay(path, prefix, encoding, maxsize))
+
+    def counters(self):
+        return(sum_counters([shard.counters() for shard in self.shards]))
+
+    def relay(self, packet, sync=False):
+        (frames, malformed, truncated) = split_keys(packet)
+        self.malformed += malformed + truncated
+        n       = len(self.shards)
+        packets = [[] for _ in xrange(n)]
+        for (key, frame) in frames:
+            packets[shard_of(key, n)].append(frame)
+        for (shard, frames) in zip(self.shards, packets):
+            if (frames):
+                shard.relay("".join(frames), sync)
+
+class Subscriber(object):
+    """
+    Delivers messages to a single databus subscriber. Messages are
+    queued [at most `backlog' of them, the oldest being dropped] and
+    handed to recv_broadcast in batches of at most `batch' from the
+    reactor loop, so a slow subscriber neither delays the parsing
+    of the next datagram nor the other subscribers. If
+    recv_broadcast returns a deferred, no other batch is delivered
+    until it fires.
+    """
+
+    def __init__(self, cc, backlog=BACKLOG, batch=BATCH, clock=reactor):
+        self.cc        = cc
+        self.queue     = collections.deque(maxlen=backlog)
+        self.batch     = batch
+        self.clock     = clock
+        self.pending   = None
+        self.busy      = False
+        self.delivered = 0
+        self.dropped   = 0
+
+    def lag(self):
+        return(len(self.queue))
+
+    def stats(self):
+        return({"lag": len(self.queue), "delivered": self.delivered, "dropped": self.dropped})
+
+    def push(self, msgs):
+        self.dropped += max(0, len(self.queue) + len(msgs) - self.queue.maxlen)
+        self.queue.extend(msgs)
+        self.schedule()
+
+    def schedule(self):
+        if (self.pending is None and not self.busy and len(self.queue) > 0):
+            self.pending = self.clock.callLater(0, self.deliver)
+
+    def cancel(self):
+        # stops delivering; returns the messages not delivered yet
+        msgs = list(self.queue)
+        self.queue.clear()
+        if (self.pending is not None):
+            self.pending.cancel()
+            self.pending = None
+        return(msgs)
+
+    def deliver(self):
+        self.pending = None
+        msgs         = [self.queue.popleft() for _ in xrange(min(self.batch, len(self.queue)))]
+        self.busy    = True
+        d = defer.maybeDeferred(self.cc.recv_broadcast, msgs)
+        d.addErrback(lambda f: logger.error("recv_broadcast: %s" % f.getErrorMessage()))
+        d.addBoth(self._delivered, len(msgs))
+
+    def _delivered(self, _, n):
+        self.busy       = False
+        self.delivered += n
+        self.schedule()
 
 class Databus(protocol.ConnectedDatagramProtocol):
 
-    def __init__(self, connect):
+    def __init__(self, connect, encoding="text", maxqueue=MAXQUEUE, overflow=DROP_OLDEST, peer=None):
+        # broadcasts go to the socket `peer' names through a Relay of
+        # their own, never through the listening port [whose
+        # descriptor the reactor watches for reading]. maxqueue
+        # bounds the messages waiting to be broadcast; once it is
+        # reached either the oldest or the newest one is dropped,
+        # according to overflow
+        if (overflow not in (DROP_OLDEST, DROP_NEWEST)):
+            raise(ValueError("unknown overflow policy: %s" % overflow))
+        self.render    = storable_renderer(encoding)
         self.callbacks = {}
         self.connect   = lambda: connect(self)
-        self.wqueue    = []
+        self.relay     = None
+        if (peer is not None):
+            self.relay = Relay(peer, encoding=encoding, maxqueue=maxqueue, overflow=overflow)
+        self.malformed = 0
+        self.truncated = 0
 
-    def attach(self, gid, cc):
-        self.callbacks[gid] = cc
+    def attach(self, gid, cc, backlog=BACKLOG, batch=BATCH):
+        self.callbacks[gid] = Subscriber(cc, backlog, batch)
         logger.info("registering new cc: %s/%d" % (gid, len(self.callbacks)))
 
     def detach(self, gid):
+        # returns the messages the subscriber has not got yet
+        msgs = []
         if (gid in self.callbacks):
-            del(self.callbacks[gid])
+            msgs = self.callbacks.pop(gid).cancel()
         logger.info("unregistering cc: %s/%d" % (gid, len(self.callbacks)))
+        return(msgs)
+
+    def stats(self):
+        return(dict([(gid, cc.stats()) for (gid, cc) in self.callbacks.iteritems()]))
+
+    def depth(self):
+        if (self.relay is None):
+            return(0)
+        return(len(self.relay.queue))
 
     def send_broadcast(self, events):
-        self.wqueue.extend(events)
-        logger.debug("send_broadcast: [qlen=%d]" % len(self.wqueue))
-        while (len(self.wqueue) > 0 and self.transport is not None):
-            e = self.wqueue[:10]
-            try:
-                self.transport.write(render_storables(e))
-                del(self.wqueue[:10])
-            except socket.error, se:
-                map(lambda x: self.wqueue.insert(0, x), reversed(e))
-                if (se.args[0] not in (errno.EWOULDBLOCK, errno.EAGAIN)):
-                    self.transport.loseConnection()
-                break
+        # events are rendered as they are queued; while the peer is
+        # full or gone they wait in the relay, which resumes on its
+        # own instead of being written again on every call
+        if (self.relay is None):
+            raise(RuntimeError("send_broadcast: no peer to broadcast to"))
+        for e in events:
+            self.relay.enqueue(self.render(e))
+        logger.debug("send_broadcast: [qlen=%d]" % len(self.relay.queue))
+        if (not self.relay.waiting()):
+            self.relay.drain()
 
     def connectionLost(self, reason):
         logger.warn("connectionLost: %s" % reason.getErrorMessage())
@@ -117,23 +386,11 @@ class Databus(protocol.ConnectedDatagramProtocol):
         logger.warn("starProtocol")
 
     def datagramReceived(self, data, *args):
-        tmp  = []
-        msgs = []
-        for c in data:
-            tmp.append(c)
-            if (c == ';'):
-                tmp = "".join(tmp)
-                x   = None
-                if (tmp[0] == 'e'):
-                    x = parse_event_(tmp)[0]
-                elif (tmp[0] == 'd'):
-                    x = parse_data_(tmp)[0]
-                if (x is None):
-                    logger.debug("error parsing: %s" % tmp)
-                    tmp = []
-                else:
-                    tmp = []
-                    msgs.append(x)
+        (msgs, malformed, truncated) = parse_frames(data)
+        if (malformed + truncated > 0):
+            self.malformed += malformed
+            self.truncated += truncated
+            logger.debug("error parsing: %d malformed, %d truncated messages" % (malformed, truncated))
         if (len(msgs) > 0):
             for cc in self.callbacks.values():
-                cc.recv_broadcast(msgs)
+                cc.push(msgs)
@@ -16,6 +16,7 @@
 #
 
 import math
+import httplib
 from twisted.internet import defer
 from cyclone import web
 from leela.server import funcs
@@ -45,6 +46,28 @@ def render_series(events, nan=NAN_ALLOW):
             raise(RuntimeError("unknonw value"))
     return(results)
 
+def render_multi(results, nan=NAN_ALLOW):
+    # {key: events | failure} -> {key: {"series": ...} | {"status": ..., "reason": ...}}
+    # a key without data [none stored or all of it purged] gets a 404
+    rendered = {}
+    for (k, events) in results.iteritems():
+        try:
+            if (not isinstance(events, list)):
+                events.raiseException()
+            series = render_series(events, nan)
+            if (series == []):
+                raise(excepts.NotFoundExcept())
+            rendered[k] = {"series": series}
+        except Exception, e:
+            e = resthandler.exception2http(e)
+            rendered[k] = {"status": e.status_code, "reason": httplib.responses[e.status_code]}
+    return(rendered)
+
+def render_metric(m):
+    msg = pp.render_metric(m)
+    parser.parse_metric(msg)
+    return(msg)
+
 def relay_data(render, relay, data):
     size   = 0
     packet = []
@@ -60,6 +83,14 @@ def relay_data(render, relay, data):
 
 class EventsResource(resthandler.RestHandler):
 
+    def plan(self):
+        maxpoints = self.get_argument("maxpoints", None)
+        if (maxpoints is not None):
+            maxpoints = int(maxpoints, 10)
+        return({"maxpoints": maxpoints,
+                "aggregate": self.get_argument("aggregate", "mean")
+               })
+
     def load_events(self, key, cc):
         nan = read_nanopt(self.get_argument("nan", "purge"))
         t0  = funcs.timer_start()
@@ -73,14 +104,16 @@ class EventsResource(resthandler.RestHandler):
 class Past24(EventsResource):
 
     @web.asynchronous
+    @resthandler.catch
     def get(self, key):
-        self.load_events(key, self.class_.load_past24(self.storage, key))
+        self.load_events(key, self.class_.load_past24(self.storage, key, **self.plan()))
 
 class PastWeek(EventsResource):
 
     @web.asynchronous
+    @resthandler.catch
     def get(self, key):
-        self.load_events(key, self.class_.load_pastweek(self.storage, key))
+        self.load_events(key, self.class_.load_pastweek(self.storage, key, **self.plan()))
 
 class RangeRdonly(EventsResource):
 
@@ -90,7 +123,7 @@ class RangeRdonly(EventsResource):
         start  = parser.parse_timespec(self.get_argument("start"))
         finish = parser.parse_timespec(self.get_argument("finish"))
         args   = list(start) + list(finish)
-        self.load_events(key, self.class_.load_range(self.storage, key, *args))
+        self.load_events(key, self.class_.load_range(self.storage, key, *args, **self.plan()))
 
 class RangeDataRdwr(RangeRdonly):
 
@@ -100,7 +133,7 @@ class RangeDataRdwr(RangeRdonly):
     @resthandler.catch
     def post(self, key):
         data = parser.parse_json_data(self.request.body, key)
-        relay_data(pp.render_storable, self.relay.relay, data)
+        relay_data(self.relay.render, self.relay.relay, data)
         self.set_status(201)
         self.finish({"status": 201,
                      "results": pp.render_storables_to_json(data)
@@ -111,25 +144,58 @@ class RangeMetricRdwr(RangeRdonly):
     @resthandler.catch
     def post(self, key):
         data = parser.parse_json_metric(self.request.body, key)
-        relay_data(pp.render_metric, self.relay.relay, data)
+        msgs = map(render_metric, data)
+        relay_data(lambda x: x, self.relay.relay, msgs)
         self.set_status(201)
         self.finish({"status": 201,
                      "results": pp.render_metrics_to_json(data)
                     })
 
+class Multi(resthandler.RestHandler):
+
+    @web.asynchronous
+    @resthandler.catch
+    def post(self):
+        (keys, start, finish) = parser.parse_json_multi(self.request.body)
+        nan  = read_nanopt(self.get_argument("nan", "purge"))
+        args = list(start) + list(finish)
+        t0   = funcs.timer_start()
+        self.class_.load_multi(self.storage, keys, *args)\
+            .addCallback(lambda r: self.finish({"status" : 200,
+                                                "results": render_multi(r, nan),
+                                                "debug"  : {"walltime": funcs.timer_stop(t0)}
+                                               }))\
+            .addErrback(self.catch)
+
 class YearMonthDay(EventsResource):
 
     @web.asynchronous
     @resthandler.catch
     def get(self, year, month, day, key):
-        self.load_events(key, self.class_.load_day(self.storage, key, int(year, 10), int(month, 10), int(day, 10)))
+        self.load_events(key, self.class_.load_day(self.storage, key, int(year, 10), int(month, 10), int(day, 10), **self.plan()))
 
 class YearMonth(EventsResource):
 
     @web.asynchronous
     @resthandler.catch
     def get(self, year, month, key):
-        self.load_events(key, self.class_.load_month(self.storage, key, int(year, 10), int(month, 10)))
+        self.load_events(key, self.class_.load_month(self.storage, key, int(year, 10), int(month, 10), **self.plan()))
+
+class Catalog(resthandler.RestHandler):
+
+    @web.asynchronous
+    @resthandler.catch
+    def get(self, year, month):
+        prefix = self.get_argument("prefix", "")
+        cursor = self.get_argument("cursor", None)
+        limit  = int(self.get_argument("limit", "100"), 10)
+        if (limit < 1 or limit > 10000):
+            raise(ValueError("invalid range (0 < limit ≤ 10000)"))
+        d = self.storage.list_keys(self.class_.kind(), int(year, 10), int(month, 10), prefix, cursor, limit)
+        d.addCallback(lambda r: self.finish({"status" : 200,
+                                             "results": {"keys": r[0], "cursor": r[1]}
+                                            }))\
+         .addErrback(self.catch)
 
 class Version(resthandler.RestHandler):
 
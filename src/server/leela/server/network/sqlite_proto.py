@@ -0,0 +1,102 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import struct
+import sqlite3
+import collections
+from twisted.internet import defer
+from twisted.application import service
+from leela.server.network.storage_proto import *
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS columns (
+  cf    TEXT NOT NULL,
+  key   BLOB NOT NULL,
+  ord   NOT NULL,
+  name  BLOB NOT NULL,
+  value BLOB NOT NULL,
+  PRIMARY KEY (cf, key, ord)
+) WITHOUT ROWID
+"""
+
+Column              = collections.namedtuple("Column", ["name", "value"])
+ColumnOrSuperColumn = collections.namedtuple("ColumnOrSuperColumn", ["column"])
+
+def ordering(cf):
+    # what the column names of `cf' sort by: catalog columns are
+    # ordered as bytes, the others as ReversedType(Int32Type)
+    if (cf.startswith(CF_CATALOG.split("%")[0])):
+        return(buffer)
+    return(lambda name: -struct.unpack(">i", name)[0])
+
+class SqliteProto(StorageProto, service.Service):
+    """
+    A backend that keeps the column families of the cassandra one in
+    a single sqlite table, so that the services can be benchmarked
+    and tested without a cluster. Queries run synchronously in the
+    reactor thread; this is not meant for production.
+    """
+
+    def __init__(self, cfg, cache=None, ttl=30, horizon=HORIZON):
+        StorageProto.__init__(self, cfg, cache, ttl, horizon)
+        path = ":memory:"
+        if (self.cfg.has_option("cassandra", "sqlite_path")):
+            path = self.cfg.get("cassandra", "sqlite_path")
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute(SCHEMA)
+
+    def _mutate(self, rows):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO columns VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _slice(self, key, cf, start, finish, count):
+        f    = ordering(cf)
+        sql  = ["SELECT name, value FROM columns WHERE cf = ? AND key = ?"]
+        args = [cf, buffer(key)]
+        if (start):
+            sql.append("AND ord >= ?")
+            args.append(f(start))
+        if (finish):
+            sql.append("AND ord <= ?")
+            args.append(f(finish))
+        sql.append("ORDER BY ord LIMIT ?")
+        args.append(count)
+        return([ColumnOrSuperColumn(Column(str(n), str(v))) for (n, v) in self.db.execute(" ".join(sql), args)])
+
+    def insert(self, key, column_family, value, column):
+        row = (column_family, buffer(key), ordering(column_family)(column), buffer(column), buffer(value))
+        return(defer.execute(self._mutate, [row]))
+
+    def batch_mutate(self, mapping):
+        rows = []
+        for (key, cfs) in mapping.iteritems():
+            for (cf, cols) in cfs.iteritems():
+                f = ordering(cf)
+                rows.extend([(cf, buffer(key), f(c), buffer(c), buffer(v)) for (c, v) in cols.iteritems()])
+        return(defer.execute(self._mutate, rows))
+
+    def get_slice(self, key, column_family, start="", finish="", count=100):
+        return(defer.execute(self._slice, key, column_family, start, finish, count))
+
+    def multiget_slice(self, keys, column_family, start="", finish="", count=100):
+        return(defer.execute(lambda: dict([(k, self._slice(k, column_family, start, finish, count)) for k in keys])))
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.db.close()
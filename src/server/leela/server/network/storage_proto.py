@@ -0,0 +1,427 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import time
+import struct
+from twisted.internet import defer
+from leela.server import timeutil
+from leela.server import scheduler
+from leela.server.data import event
+from leela.server.data import data
+from leela.server.data import marshall
+from leela.server.data import rollup
+
+CF_EVENTS  = "events_%02d%04d"
+CF_DATA    = "data_%02d%04d"
+CF_CATALOG = "catalog_%02d%04d"
+CF_ROLLUP  = "rollup%d_%02d%04d"
+
+BATCH_ROWS       = 64
+BATCH_COLUMNS    = 1024
+LOAD_CONCURRENCY = 4
+PAGE_SIZE        = 4096
+CATALOG_BUCKET   = 4
+MULTIGET_KEYS    = 64
+HORIZON          = 3600
+
+def encode_string(s):
+    try:
+        return(s.encode("ascii"))
+    except UnicodeError:
+        return(s)
+
+def unserialize_event(k, cols):
+    f = lambda col: (struct.unpack(">i", col.column.name)[0], struct.unpack(">d", col.column.value)[0])
+    return(marshall.unserialize_events(k, map(f, cols), marshall.DEFAULT_EPOCH))
+
+def unserialize_rollup(k, cols, aggregate):
+    f = lambda col: (struct.unpack(">i", col.column.name)[0], aggregate(struct.unpack(">4d", col.column.value)))
+    return(marshall.unserialize_events(k, map(f, cols), marshall.DEFAULT_EPOCH))
+
+def unserialize_data(k, cols):
+    f = lambda col: (struct.unpack(">i", col.column.name)[0], col.column.value)
+    return(marshall.unserialize_datas(k, map(f, cols), marshall.DEFAULT_EPOCH))
+
+def page_of(events, t0, count):
+    cursor = None
+    if (events and len(events) == count and events[-1].unixtimestamp() > t0):
+        cursor = events[-1].unixtimestamp() - 1
+    return((events, cursor))
+
+class StorageProto(object):
+    """
+    What Storable and the http handlers expect from a storage
+    backend. Everything is written in terms of four cassandra-like
+    primitives that subclasses must provide, all of them returning
+    deferreds:
+
+      * insert(key, column_family, value, column);
+      * batch_mutate(mapping), the mapping being {key: {cf: {col: value}}};
+      * get_slice(key, column_family, start, finish, count), the
+        columns of [start, finish] in comparator order, as objects
+        with a column attribute that has name and value;
+      * multiget_slice(keys, column_family, start, finish, count),
+        the same for many keys, as a {key: columns} dict;
+
+    The data, events and rollup column families are ordered by
+    ReversedType(Int32Type) and the catalog ones by BytesType.
+    """
+
+    def __init__(self, cfg, cache=None, ttl=30, horizon=HORIZON):
+        # cache, if given, is a TTLCache for decoded slices. pages that
+        # end more than `horizon' seconds ago never change [writes land
+        # late by a coalesced minute, or by a spool replay, both well
+        # within it] and are kept until evicted; the others for `ttl'
+        # seconds only.
+        self.cfg              = cfg
+        self.batch_rows       = BATCH_ROWS
+        self.batch_columns    = BATCH_COLUMNS
+        self.load_concurrency = LOAD_CONCURRENCY
+        self.page_size        = PAGE_SIZE
+        self.catalog_bucket   = CATALOG_BUCKET
+        self.multiget_keys    = MULTIGET_KEYS
+        self.cache            = cache
+        self.cache_ttl        = ttl
+        self.cache_horizon    = horizon
+        if (self.cfg.has_option("cassandra", "batch_rows")):
+            self.batch_rows = self.cfg.getint("cassandra", "batch_rows")
+        if (self.cfg.has_option("cassandra", "batch_columns")):
+            self.batch_columns = self.cfg.getint("cassandra", "batch_columns")
+        if (self.cfg.has_option("cassandra", "load_concurrency")):
+            self.load_concurrency = self.cfg.getint("cassandra", "load_concurrency")
+        if (self.cfg.has_option("cassandra", "page_size")):
+            self.page_size = self.cfg.getint("cassandra", "page_size")
+        if (self.cfg.has_option("cassandra", "catalog_bucket")):
+            self.catalog_bucket = self.cfg.getint("cassandra", "catalog_bucket")
+        if (self.cfg.has_option("cassandra", "multiget_keys")):
+            self.multiget_keys = self.cfg.getint("cassandra", "multiget_keys")
+
+    def mutation(self, s):
+        (y, m) = timeutil.month_bucket(s.unixtimestamp())
+        if (s.kind() == event.Event.kind()):
+            (k, v) = marshall.serialize_event(s, marshall.DEFAULT_EPOCH)
+            return((CF_EVENTS % (m, y), encode_string(s.name()), struct.pack(">i", k), struct.pack(">d", v)))
+        elif (s.kind() == data.Data.kind()):
+            (k, v) = marshall.serialize_data(s, marshall.DEFAULT_EPOCH)
+            return((CF_DATA % (m, y), encode_string(s.name()), struct.pack(">i", k), v))
+        else:
+            raise(RuntimeError("unknown data type: %s" % s.kind()))
+
+    def store(self, s):
+        (cf, k, c, v) = self.mutation(s)
+        return(self.insert(key=k, column_family=cf, value=v, column=c))
+
+    def batches(self, objects):
+        # groups objects by row; returns a list of (objects, mapping)
+        # pairs, each mapping suitable for a single batch_mutate.
+        return(marshall.group_mutations(self.mutation, objects, self.batch_rows, self.batch_columns))
+
+    def rollup_batches(self, buckets):
+        # the buckets Rollup.flush returns, grouped like batches does
+        def f(b):
+            (y, m) = timeutil.month_bucket(b[2])
+            k      = timeutil.encode_key(b[2], marshall.DEFAULT_EPOCH)
+            return((CF_ROLLUP % (b[1], m, y), encode_string(b[0]), struct.pack(">i", k), struct.pack(">4d", *b[3])))
+        return(marshall.group_mutations(f, buckets, self.batch_rows, self.batch_columns))
+
+    def load_rollups(self, buckets):
+        # the stored aggregates of rollup buckets [as Rollup.flush
+        # returns them], as {(name, resolution, time): (min, max, sum,
+        # count)}; buckets never written are left out. one
+        # multiget_slice per bucket and group of multiget_keys keys.
+        groups = {}
+        for b in buckets:
+            groups.setdefault((b[1], b[2]), []).append(b[0])
+        jobs = []
+        for ((r, t), names) in groups.iteritems():
+            for k in range(0, len(names), self.multiget_keys):
+                jobs.append((r, t, names[k:k + self.multiget_keys]))
+        results = {}
+        def g(rows, r, t, names):
+            for (k, cols) in rows.iteritems():
+                if (cols):
+                    results[(names[k], r, t)] = struct.unpack(">4d", cols[0].column.value)
+        def f(job):
+            (r, t, group) = job
+            (y, m) = timeutil.month_bucket(t)
+            c      = struct.pack(">i", timeutil.encode_key(t, marshall.DEFAULT_EPOCH))
+            names  = dict([(encode_string(n), n) for n in group])
+            d = self.multiget_slice(keys          = names.keys(),
+                                    start         = c,
+                                    finish        = c,
+                                    count         = 1,
+                                    column_family = CF_ROLLUP % (r, m, y))
+            d.addCallback(g, r, t, names)
+            return(d)
+        d = scheduler.fanout(f, jobs, self.load_concurrency, lambda _: None)
+        d.addCallback(lambda _: results)
+        return(d)
+
+    def catalog_batches(self, objects, seen):
+        # the catalog entries of objects not in `seen', grouped like
+        # batches does
+        def f(e):
+            return((CF_CATALOG % (e[1], e[0]), encode_string(e[2]), encode_string(e[3]), ""))
+        entries = marshall.catalog_entries(objects, seen, self.catalog_bucket)
+        return(marshall.group_mutations(f, entries, self.batch_rows, self.batch_columns))
+
+    def list_keys(self, kind, y, m, prefix="", cursor=None, limit=100):
+        # lists, in order, at most `limit' keys of a given month that
+        # start with `prefix' and come after `cursor'. returns (keys,
+        # cursor), the later being None when there is nothing left.
+        cf     = CF_CATALOG % (m, y)
+        size   = self.catalog_bucket
+        prefix = marshall.catalog_name(prefix)
+        lo     = prefix
+        hi     = prefix + marshall.CATALOG_END
+        keys   = []
+        if (cursor is not None):
+            lo = max(lo, marshall.catalog_name(cursor) + "\x00")
+        def scan(buckets, more):
+            if (len(keys) >= limit):
+                return(None)
+            if (len(buckets) == 0):
+                return(None if (more is None) else index(more))
+            b = buckets.pop(0)
+            d = self.get_slice(key           = marshall.catalog_row(kind, b),
+                               start         = max(lo, b),
+                               finish        = hi,
+                               count         = limit - len(keys),
+                               column_family = cf)
+            d.addCallback(lambda cols: keys.extend([c.column.name for c in cols]))
+            d.addCallback(lambda _: scan(buckets, more))
+            return(d)
+        def index(start):
+            def f(cols):
+                buckets = [c.column.name for c in cols]
+                more    = None
+                if (len(buckets) == self.page_size):
+                    more = buckets[-1] + "\x00"
+                return(scan(buckets, more))
+            d = self.get_slice(key           = marshall.catalog_index(kind),
+                               start         = start,
+                               finish        = hi,
+                               count         = self.page_size,
+                               column_family = cf)
+            d.addCallback(f)
+            return(d)
+        if (len(prefix) >= size):
+            d = defer.maybeDeferred(scan, [prefix[:size]], None)
+        else:
+            d = defer.maybeDeferred(index, lo[:size])
+        d.addCallback(lambda _: (keys, keys[-1] if (len(keys) == limit) else None))
+        return(d)
+
+    def enum(self, kind, klimit=100, limit=100):
+        # the last `limit' events of `klimit' keys seen this month
+        now     = timeutil.seconds(time.time())
+        (y, m)  = timeutil.month_bucket(now)
+        t0      = timeutil.month_start(y, m)
+        results = []
+        def f(keys):
+            g = lambda k: self.load_page(kind, k, t0, now, limit)
+            return(scheduler.fanout(g, keys, self.load_concurrency, lambda r: results.extend(r[0])))
+        d = self.list_keys(kind, y, m, limit=klimit)
+        d.addCallback(lambda r: f(r[0]))
+        d.addCallback(lambda _: results)
+        return(d)
+
+    def slice_of(self, kind, t0, t1, resolution=None, aggregate=None):
+        # the column family, the column range and the unserializer of
+        # a slice [which must not span more than one month]; events
+        # come from the rollups of the given resolution if there is one.
+        (y, m) = timeutil.month_bucket(t0)
+        k0     = struct.pack(">i", timeutil.encode_key(t0, marshall.DEFAULT_EPOCH))
+        k1     = struct.pack(">i", timeutil.encode_key(t1, marshall.DEFAULT_EPOCH))
+        if (resolution is not None):
+            return((CF_ROLLUP % (resolution, m, y), k0, k1, lambda k, cols: unserialize_rollup(k, cols, aggregate)))
+        elif (kind == event.Event.kind()):
+            return((CF_EVENTS % (m, y), k0, k1, unserialize_event))
+        else:
+            return((CF_DATA % (m, y), k0, k1, unserialize_data))
+
+    def load_page(self, kind, key, t0, t1, count, resolution=None, aggregate=None):
+        # fetches at most `count' columns of [t0, t1], newest first;
+        # returns (events, cursor) where cursor is the upper bound of
+        # the next page, or None if this was the last one.
+        (cf, k0, k1, f) = self.slice_of(kind, t0, t1, resolution, aggregate)
+        ck = (kind, key, cf, t0, t1, count, aggregate)
+        if (self.cache is not None):
+            page = self.cache.get(ck)
+            if (page is not None):
+                return(defer.succeed(page))
+        d = self.get_slice(key           = encode_string(key),
+                           start         = k1,
+                           finish        = k0,
+                           count         = count,
+                           column_family = cf)
+        d.addCallback(lambda cols: page_of(f(key, cols), t0, count))
+        if (self.cache is not None):
+            # a rollup column changes until its bucket is over
+            d.addCallback(self.remember, ck, t1 + (resolution or 0))
+        return(d)
+
+    def remember(self, page, ck, t1):
+        if (t1 < self.cache.clock() - self.cache_horizon):
+            self.cache.put(ck, page)
+        else:
+            self.cache.put(ck, page, self.cache_ttl)
+        return(page)
+
+    def load_pages(self, kind, key, t0, t1, limit):
+        # all the pages of [t0, t1] for a single key, up to `limit'
+        # events, newest first
+        events = []
+        def g(r):
+            events.extend(r[0])
+            if (r[1] is None or len(events) >= limit):
+                return(events[:limit])
+            return(self.load_page(kind, key, t0, r[1], min(self.page_size, limit - len(events))).addCallback(g))
+        return(self.load_page(kind, key, t0, t1, min(self.page_size, limit)).addCallback(g))
+
+    def multiget_page(self, kind, keys, t0, t1, count):
+        # load_page for many keys at once; returns {key: (events, cursor)}
+        (cf, k0, k1, f) = self.slice_of(kind, t0, t1)
+        names = dict([(encode_string(k), k) for k in keys])
+        def g(rows):
+            return(dict([(names[k], page_of(f(names[k], cols), t0, count)) for (k, cols) in rows.iteritems()]))
+        d = self.multiget_slice(keys          = names.keys(),
+                                start         = k1,
+                                finish        = k0,
+                                count         = count,
+                                column_family = cf)
+        d.addCallback(g)
+        return(d)
+
+    def load_multi(self, kind, keys, start, finish, limit=100):
+        # load for many keys: one multiget_slice per month and group
+        # of multiget_keys keys; keys that have more than one page in
+        # a month have the remaining pages fetched one by one. returns
+        # {key: events | failure}, the failure being the one of the
+        # group the key belongs to.
+        t0      = timeutil.timegm(*start)
+        t1      = timeutil.timegm(*finish)
+        slices  = timeutil.split_months(t0, t1)
+        groups  = [keys[k:k + self.multiget_keys] for k in range(0, len(keys), self.multiget_keys)]
+        results = dict([(k, []) for k in keys])
+        count   = min(self.page_size, limit)
+        def rest(key, t0, cursor):
+            d = self.load_pages(kind, key, t0, cursor, limit - count)
+            d.addCallback(results[key].extend)
+            return(d)
+        def store(rows, t0):
+            ds = []
+            for (k, (events, cursor)) in rows.iteritems():
+                if (isinstance(results[k], list)):
+                    results[k].extend(events)
+                    if (cursor is not None and limit > count):
+                        ds.append(rest(k, t0, cursor).addErrback(failed, [k]))
+            return(defer.DeferredList(ds))
+        def failed(failure, group):
+            for k in group:
+                results[k] = failure
+        def f(job):
+            ((_, _, s0, s1), group) = job
+            d = self.multiget_page(kind, group, s0, s1, count)
+            d.addCallback(store, s0)
+            d.addErrback(failed, group)
+            return(d)
+        def done(_):
+            for (k, events) in results.iteritems():
+                if (isinstance(events, list)):
+                    events.sort(key=lambda e: e.unixtimestamp())
+                    results[k] = events[-limit:]
+            return(results)
+        jobs = [(s, g) for s in slices for g in groups]
+        d = scheduler.fanout(f, jobs, self.load_concurrency, lambda _: None)
+        d.addCallback(done)
+        return(d)
+
+    def load_stream(self, kind, key, start, finish, consume, limit=100, resolution=None, aggregate=None):
+        # splits [start, finish] in monthly slices and pages through
+        # each one [page_size columns at a time]. the first page of
+        # at most load_concurrency slices is fetched concurrently;
+        # the remaining pages of a slice only when it is its turn to
+        # be consumed. consume gets each page, newest first, and no
+        # more than `limit' events are given overall.
+        t0 = timeutil.timegm(*start)
+        t1 = timeutil.timegm(*finish)
+        slices = timeutil.split_months(t0, t1)
+        slices.reverse()
+        state  = {"limit": limit}
+        def page(t0, t1):
+            d = self.load_page(kind, key, t0, t1, min(self.page_size, state["limit"]), resolution, aggregate)
+            d.addCallback(lambda r: (t0, r[0], r[1]))
+            return(d)
+        def g(r):
+            (t0, events, cursor) = r
+            events = events[:state["limit"]]
+            state["limit"] -= len(events)
+            consume(events)
+            if (state["limit"] <= 0):
+                return(True)
+            if (cursor is None):
+                return(False)
+            return(page(t0, cursor).addCallback(g))
+        return(scheduler.fanout(lambda s: page(s[2], s[3]), slices, self.load_concurrency, g))
+
+    def backfill(self, events, kind, key, start, finish, limit, resolution, aggregate):
+        # rollups only exist from the time they were enabled on; the
+        # range before the oldest rolled up event is read from raw
+        # events, rolled up on the fly
+        t0 = timeutil.timegm(*start)
+        t1 = timeutil.timegm(*finish)
+        if (events):
+            t1 = events[0].unixtimestamp() - 1
+        if (len(events) >= limit or t1 < t0):
+            return(events)
+        raw = []
+        d = self.load_stream(kind, key, start, timeutil.gmtime(t1), raw.extend, (t1 - t0) // rollup.RAW + 1)
+        d.addCallback(lambda _: (rollup.downsample(raw[::-1], resolution, aggregate) + events)[-limit:])
+        return(d)
+
+    def load(self, kind, key, start, finish, limit=100, maxpoints=None, aggregate="mean"):
+        # with maxpoints, events are read from the finest rollup that
+        # gives no more than that many points [if raw events do not]
+        resolution = None
+        f          = rollup.aggregate(aggregate)
+        if (maxpoints is not None and kind == event.Event.kind()):
+            t0         = timeutil.timegm(*start)
+            resolution = rollup.plan(t0, timeutil.timegm(*finish), maxpoints)
+            if (resolution is not None):
+                start = timeutil.gmtime(t0 - t0 % resolution)
+        results = []
+        d = self.load_stream(kind, key, start, finish, results.extend, limit, resolution, f)
+        d.addCallback(lambda _: results[::-1])
+        if (resolution is not None):
+            d.addCallback(self.backfill, kind, key, start, finish, limit, resolution, f)
+        return(d)
+
+def connect(cfg, cache=None, ttl=30, horizon=HORIZON):
+    # the backend [cassandra] backend names; telephus is only needed
+    # by the cassandra one
+    backend = "cassandra"
+    if (cfg.has_option("cassandra", "backend")):
+        backend = cfg.get("cassandra", "backend")
+    if (backend == "cassandra"):
+        from leela.server.network import cassandra_proto
+        return(cassandra_proto.CassandraProto(cfg, cache, ttl, horizon))
+    elif (backend == "sqlite"):
+        from leela.server.network import sqlite_proto
+        return(sqlite_proto.SqliteProto(cfg, cache, ttl, horizon))
+    else:
+        raise(ValueError("unknown storage backend: %s" % backend))
@@ -43,7 +43,17 @@ class UDP(protocol.DatagramProtocol):
             string.startswith("derive ") or
             string.startswith("counter ") or
             string.startswith("absolute ")):
-            self.forward_packet(string)
+            packet   = []
+            rejected = 0
+            for (m, msg) in scan_metrics(string):
+                if (m is None):
+                    rejected += 1
+                else:
+                    packet.append(msg)
+            if (rejected > 0):
+                logger.debug("dropping %d malformed metrics" % rejected)
+            if (len(packet) > 0):
+                self.forward_packet("".join(packet))
         else:
             tmp = []
             for l in string.splitlines():
@@ -0,0 +1,194 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import collections
+from twisted.internet import defer
+from twisted.python import failure
+
+DROP_OLDEST = "drop-oldest"
+SPILL       = "spill"
+
+class DroppedExcept(Exception):
+    pass
+
+class Scheduler(object):
+    """
+    Runs jobs [functions that may return a deferred] keeping at most
+    `maxinflight' of them running at once. Jobs submitted while the
+    scheduler is busy wait in a queue of at most `maxpending'
+    entries. When that queue is full the oldest job is discarded
+    [DROP_OLDEST] or given to the `spill' function [SPILL], which is
+    called with the arguments the job was submitted with and returns
+    whether it kept the job; jobs it does not keep count as dropped.
+
+    submit returns a deferred that fires with the result of the job
+    or fails with DroppedExcept if the job was discarded or spilled.
+    wait returns a deferred that fires once no job is pending or
+    running [after the callbacks of the last one].
+    """
+
+    def __init__(self, maxinflight, maxpending, policy=DROP_OLDEST, spill=None):
+        if (maxinflight < 1 or maxpending < 0):
+            raise(ValueError("maxinflight must be positive and maxpending non-negative"))
+        if (policy not in (DROP_OLDEST, SPILL)):
+            raise(ValueError("unknown policy: %s" % policy))
+        if (policy == SPILL and spill is None):
+            raise(ValueError("spill policy requires a spill function"))
+        self.maxinflight = maxinflight
+        self.maxpending  = maxpending
+        self.policy      = policy
+        self.spill       = spill
+        self.pending     = collections.deque()
+        self.inflight    = 0
+        self.completed   = 0
+        self.failed      = 0
+        self.dropped     = 0
+        self.spilled     = 0
+        self.draining    = False
+        self.waiters     = []
+
+    def _run(self, d, f, args):
+        self.inflight += 1
+        tmp = defer.maybeDeferred(f, *args)
+        tmp.addBoth(self._finish)
+        tmp.chainDeferred(d)
+        tmp.addBoth(self._settled)
+
+    def _finish(self, result):
+        self.inflight -= 1
+        if (isinstance(result, failure.Failure)):
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._drain()
+        return(result)
+
+    def _drain(self):
+        # jobs that finish synchronously would otherwise recurse
+        # through _run/_finish once per pending job
+        if (self.draining):
+            return
+        self.draining = True
+        try:
+            while (self.pending and self.inflight < self.maxinflight):
+                self._run(*self.pending.popleft())
+        finally:
+            self.draining = False
+
+    def _settled(self, _):
+        # jobs that finish while draining are followed by the one
+        # that started the drain
+        if (self.draining or self.pending or self.inflight > 0):
+            return
+        waiters      = self.waiters
+        self.waiters = []
+        for w in waiters:
+            w.callback(None)
+
+    def wait(self):
+        d = defer.Deferred()
+        self.waiters.append(d)
+        self._settled(None)
+        return(d)
+
+    def _overflow(self, d, f, args):
+        if (self.policy == SPILL and self.spill(*args)):
+            self.spilled += 1
+        else:
+            self.dropped += 1
+        d.errback(DroppedExcept())
+
+    def submit(self, f, *args):
+        d = defer.Deferred()
+        if (self.inflight < self.maxinflight):
+            self._run(d, f, args)
+        else:
+            self.pending.append((d, f, args))
+            if (len(self.pending) > self.maxpending):
+                self._overflow(*self.pending.popleft())
+        return(d)
+
+    def stats(self):
+        return({"pending"  : len(self.pending),
+                "inflight" : self.inflight,
+                "completed": self.completed,
+                "failed"   : self.failed,
+                "dropped"  : self.dropped,
+                "spilled"  : self.spilled
+               })
+
+def fanout(f, xs, maxinflight, consume):
+    """
+    Applies `f' to every element of `xs', running at most
+    `maxinflight' of them at once. Results are given to `consume' in
+    the order of `xs', each as soon as all the previous ones have
+    been consumed. If consume returns True the jobs that have not
+    started yet are skipped. consume may also return a deferred, in
+    which case the next result waits for it and its result is used
+    as the stop flag.
+
+    Returns a deferred that fires when the last result is consumed,
+    or with the first failure.
+    """
+    done    = defer.Deferred()
+    sched   = Scheduler(maxinflight, len(xs))
+    results = {}
+    state   = {"next": 0, "stop": False, "busy": False}
+
+    def finish(result):
+        state["stop"] = True
+        if (done.called):
+            return
+        if (isinstance(result, failure.Failure)):
+            done.errback(result)
+        else:
+            done.callback(result)
+
+    def run(x):
+        if (state["stop"]):
+            return(None)
+        return(f(x))
+
+    def resume(stop):
+        state["busy"] = False
+        if (stop or state["next"] == len(xs)):
+            finish(None)
+        else:
+            drain()
+
+    def drain():
+        while (not state["stop"] and state["next"] in results):
+            r = results.pop(state["next"])
+            state["next"] += 1
+            stop = consume(r)
+            if (isinstance(stop, defer.Deferred)):
+                state["busy"] = True
+                stop.addCallback(resume).addErrback(finish)
+                return
+            if (stop or state["next"] == len(xs)):
+                finish(None)
+
+    def collect(result, k):
+        results[k] = result
+        if (not state["busy"]):
+            drain()
+
+    if (len(xs) == 0):
+        finish(None)
+    for (k, x) in enumerate(xs):
+        sched.submit(run, x).addCallback(collect, k).addErrback(finish)
+    return(done)
@@ -15,27 +15,63 @@
 #    limitations under the License.
 #
 
-from twisted.internet import reactor
+import time
+from twisted.internet import task
 from twisted.application.service import Service
 from leela.server import logger
 from leela.server import config
+from leela.server import cache
 from leela.server.data import pp
-from leela.server.network.databus import Relay
+from leela.server.data.metric import Derive
+from leela.server.data.metric import Gauge
+from leela.server.network import databus
+from leela.server.services import workers
 from leela.server.network import collectd_proto
 import socket
 
 class CollectdService(Service, collectd_proto.UDP):
 
-    def __init__(self, cfg):
-        self.cfg   = cfg
-        self.relay = Relay(self.cfg.get("collectd", "relay"), "leela.%s.collectd.timeline" % config.hostname())
+    def __init__(self, cfg, worker=None):
+        # see UdpService
+        self.cfg      = cfg
+        self.worker   = worker
+        monit         = "leela.%s.collectd.timeline" % config.hostname()
+        if (worker is not None):
+            monit = None
+        self.relay    = databus.relay_from(self.cfg, "collectd", monit_prefix=monit)
+        self.monit    = "leela.%s.collectd.keycache" % config.hostname()
+        self.keycache = cache.LRU(64*1024)
+        if (self.cfg.has_option("collectd", "keycache")):
+            self.keycache = cache.LRU(self.cfg.getint("collectd", "keycache"))
+
+    def statistics(self):
+        now   = time.time()
+        stats = self.keycache.stats()
+        self.relay.relay(pp.render_metrics([Derive("%s.hits" % self.monit, stats["hits"], now),
+                                            Derive("%s.misses" % self.monit, stats["misses"], now),
+                                            Derive("%s.evictions" % self.monit, stats["evictions"], now),
+                                            Gauge("%s.size" % self.monit, stats["size"], now)]))
+
+    def counters(self):
+        stats    = self.keycache.stats()
+        counters = dict([("timeline.%s" % k, v) for (k, v) in self.relay.counters().iteritems()])
+        counters.update({"keycache.hits": ("derive", stats["hits"]),
+                         "keycache.misses": ("derive", stats["misses"]),
+                         "keycache.evictions": ("derive", stats["evictions"]),
+                         "keycache.size": ("gauge", stats["size"])
+                        })
+        return(counters)
 
     def recv_metrics(self, metrics):
         logger.debug("recv_metrics: %d" % len(metrics))
         try:
-            self.relay.relay(metrics)
+            self.relay.relay(pp.render_metric_tuples(metrics))
         except:
             logger.error("cant relay to peer address")
 
     def startService(self):
-        reactor.listenUDP(self.cfg.getint("collectd", "port"), self, self.cfg.get("collectd", "address"))
+        workers.listen_udp(self.cfg.getint("collectd", "port"), self, self.cfg.get("collectd", "address"), self.worker is not None)
+        if (self.worker is None):
+            task.LoopingCall(self.statistics).start(60)
+        else:
+            workers.Reporter(self.counters).start()
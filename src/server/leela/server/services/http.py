@@ -15,16 +15,22 @@
 #    limitations under the License.
 #
 
+import time
 from cyclone import web
 from twisted.application import service
 from twisted.application import internet
-from leela.server.network import cassandra_proto
+from leela.server.network import storage_proto
 from leela.server.network import http_proto
 from leela.server.network import resthandler
 from leela.server.data import event
 from leela.server.data import data
 from leela.server import config
-from leela.server.network.databus import Relay
+from leela.server import cache
+from leela.server.data import pp
+from leela.server.data.metric import Derive
+from leela.server.data.metric import Gauge
+from leela.server.network import databus
+from leela.server import logger
 
 def x(*args):
     print(args)
@@ -33,11 +39,18 @@ class HttpService(service.Service):
 
     def __init__(self, cfg):
         cfg  = cfg
-        bus0 = Relay(cfg.get("http", "multicast"), "leela.%s.http.multicast" % config.hostname())
-        bus1 = Relay(cfg.get("http", "timeline"), "leela.%s.http.timeline" % config.hostname())
-        sto  = cassandra_proto.CassandraProto(cfg)
+        enc  = "text"
+        if (cfg.has_option("http", "multicast_encoding")):
+            enc = cfg.get("http", "multicast_encoding")
+        bus0 = databus.relay_from(cfg, "http", "multicast", "leela.%s.http.multicast" % config.hostname(), enc)
+        bus1 = databus.relay_from(cfg, "http", "timeline", "leela.%s.http.timeline" % config.hostname())
+        sto  = storage_proto.connect(cfg, *self.mkcache(cfg))
         app  = web.Application([
             (r"^/v1/version$"                   , http_proto.Version),
+            (r"^/v1/data/keys/(\d+)/(\d+)$"     , http_proto.Catalog        , {"storage": sto, "class_" : data.Data}),
+            (r"^/v1/data/multi$"                , http_proto.Multi          , {"storage": sto, "class_" : data.Data}),
+            (r"^/v1/keys/(\d+)/(\d+)$"          , http_proto.Catalog        , {"storage": sto, "class_" : event.Event}),
+            (r"^/v1/multi$"                     , http_proto.Multi          , {"storage": sto, "class_" : event.Event}),
             (r"^/v1/data/past24/(.*)"           , http_proto.Past24         , {"storage": sto, "class_" : data.Data}),
             (r"^/v1/data/pastweek/(.*)"         , http_proto.PastWeek       , {"storage": sto, "class_" : data.Data}),
             (r"^/v1/data/(\d+)/(\d+)/(\d+)/(.*)", http_proto.YearMonthDay   , {"storage": sto, "class_" : data.Data}),
@@ -54,6 +67,29 @@ class HttpService(service.Service):
         self.srv = service.MultiService()
         self.srv.addService(service.IService(internet.TCPServer(cfg.getint("http", "port"), app, interface=cfg.get("http", "address"))))
         self.srv.addService(sto)
+        if (sto.cache is not None):
+            self.srv.addService(internet.TimerService(60, self.statistics, sto.cache, bus1))
+
+    def mkcache(self, cfg):
+        get  = lambda k, d: cfg.getint("http", k) if cfg.has_option("http", k) else d
+        size = get("cache", 256*1024)
+        if (size == 0):
+            return((None,))
+        # pages are weighed by the number of events they hold
+        return((cache.TTLCache(size, weight=lambda page: len(page[0])), get("cache_ttl", 30), get("cache_horizon", storage_proto.HORIZON)))
+
+    def statistics(self, slices, relay):
+        now   = time.time()
+        monit = "leela.%s.http.cache" % config.hostname()
+        stats = slices.stats()
+        try:
+            relay.relay(pp.render_metrics([Derive("%s.hits" % monit, stats["hits"], now),
+                                           Derive("%s.misses" % monit, stats["misses"], now),
+                                           Derive("%s.evictions" % monit, stats["evictions"], now),
+                                           Derive("%s.expired" % monit, stats["expired"], now),
+                                           Gauge("%s.size" % monit, stats["size"], now)]))
+        except:
+            logger.error("cant relay to peer address")
 
     def get(self):
         return(self.srv)
@@ -15,23 +15,70 @@
 #    limitations under the License.
 #
 
+import time
 from twisted.application import service
+from twisted.internet import defer
 from twisted.internet.task import LoopingCall
 from leela.server import funcs
 from leela.server import logger
-from leela.server.network import cassandra_proto
+from leela.server import config
+from leela.server import timeutil
+from leela.server import scheduler
+from leela.server import cache
+from leela.server import spool
+from leela.server.data import pp
+from leela.server.data import parser
+from leela.server.data import event
+from leela.server.data import rollup
+from leela.server.data import coalesce
+from leela.server.data.metric import Derive
+from leela.server.data.metric import Gauge
+from leela.server.network import storage_proto
 from leela.server.network import databus
 
 def scale(e):
-    e.set_time((e.year(), e.month(), e.day(), e.hour(), e.minute(), 0))
+    e.set_unixtimestamp(timeutil.truncate_minute(e.unixtimestamp()))
 
 class StorageService(service.Service):
 
     def __init__(self, cfg, sock):
         self.cfg     = cfg
         self.dbus    = databus.listen_from(sock)
-        self.storage = cassandra_proto.CassandraProto(cfg)
+        self.storage = storage_proto.connect(cfg)
         self.loop    = LoopingCall(self._attach, sock)
+        self.stats   = LoopingCall(self.statistics)
+        self.monit   = "leela.%s.storage" % config.hostname()
+        self.relay   = None
+        if (self.cfg.has_option("storage", "relay")):
+            self.relay = databus.relay_from(self.cfg, "storage")
+        self.catalog = cache.LRU(self.getint("catalog", 256*1024))
+        self.rollup  = rollup.Rollup(self.getint("rollup", 1024*1024))
+        self.flush   = LoopingCall(self.flush_rollups)
+        self.pending = coalesce.Coalesce(self.getint("coalesce", 256*1024))
+        self.tick    = LoopingCall(self.flush_coalesced)
+        self.spool   = None
+        if (self.cfg.has_option("storage", "spool")):
+            self.spool = spool.Spool(self.cfg.get("storage", "spool"), self.getint("spool_segment", 64*1024*1024))
+        if (self.get("overflow", None) == scheduler.SPILL and self.spool is None):
+            raise(ValueError("overflow = spill requires the spool option"))
+        self.rate    = self.getint("spool_rate", 100)
+        self.healthy   = True
+        self.replaying = False
+        self.replay    = LoopingCall(self.replay_spool)
+        self.sched   = scheduler.Scheduler(self.getint("inflight", 32),
+                                           self.getint("pending", 1024),
+                                           self.get("overflow", scheduler.DROP_OLDEST),
+                                           self._spill)
+
+    def get(self, option, default):
+        if (self.cfg.has_option("storage", option)):
+            return(self.cfg.get("storage", option))
+        return(default)
+
+    def getint(self, option, default):
+        if (self.cfg.has_option("storage", option)):
+            return(self.cfg.getint("storage", option))
+        return(default)
 
     def _attach(self, sock):
         try:
@@ -39,23 +86,215 @@ class StorageService(service.Service):
         except:
             logger.exception()
 
-    def recv_broadcast(self, objects):
+    def _healthy(self, result):
+        self.healthy = True
+        return(result)
+
+    def _write(self, objects, batch):
+        d = self.storage.batch_mutate(batch)
+        d.addCallback(self._healthy)
+        return(d)
+
+    def _spill(self, objects, batch):
+        # catalog and rollup batches are not spooled [replaying the
+        # objects rebuilds the catalog anyway]; the scheduler counts
+        # them as dropped
+        if (objects is None or self.spool is None):
+            return(False)
+        try:
+            self.spool.append(pp.render_storables_binary(objects))
+            return(True)
+        except:
+            logger.exception()
+            return(False)
+
+    def _batch_failed(self, failure, objects):
+        if (failure.check(scheduler.DroppedExcept)):
+            if (self.sched.policy != scheduler.SPILL):
+                logger.warn("write queue is full, %d objects dropped" % len(objects))
+            return
+        self.healthy = False
+        if (self._spill(objects, None)):
+            logger.warn("batch_mutate failed, %d objects spooled: %s" % (len(objects), failure.getErrorMessage()))
+        else:
+            logger.error("batch_mutate failed, %d objects lost: %s" % (len(objects), failure.getErrorMessage()))
+
+    def _failed(self, failure, what, n):
+        if (not failure.check(scheduler.DroppedExcept)):
+            self.healthy = False
+        logger.error("%s batch failed, %d columns lost: %s" % (what, n, failure.getErrorMessage()))
+
+    def _catalog_failed(self, failure, entries):
+        # so that they get written again next time they are seen
+        for e in entries:
+            self.catalog.pop(e)
+        self._failed(failure, "catalog", len(entries))
+
+    def write_rollups(self, buckets):
+        ds = []
+        for (group, batch) in self.storage.rollup_batches(buckets):
+            d = self.sched.submit(self._write, None, batch)
+            d.addErrback(self._failed, "rollup", len(group))
+            ds.append(d)
+        return(defer.DeferredList(ds))
+
+    def _merge_failed(self, failure, buckets):
+        logger.error("cant read %d rollup buckets, retrying later: %s" % (len(buckets), failure.getErrorMessage()))
+        self.rollup.retry(buckets)
+
+    def flush_rollups(self):
+        # buckets created since the service started are combined with
+        # the stored ones before being written, so that a restart [or
+        # an eviction] does not overwrite them with partial aggregates
+        buckets  = self.rollup.flush()
+        unmerged = [b for b in buckets if not b[rollup.MERGED]]
+        ds       = [self.write_rollups([b for b in buckets if b[rollup.MERGED]])]
+        if (unmerged):
+            d = self.storage.load_rollups(unmerged)
+            d.addCallback(lambda stored: self.write_rollups(self.rollup.merge(unmerged, stored)))
+            d.addErrback(self._merge_failed, unmerged)
+            ds.append(d)
+        return(defer.DeferredList(ds))
+
+    def flush_coalesced(self):
+        self.commit(self.pending.flush(time.time()))
+
+    def _replayed(self, _, cursor):
+        self.replaying = False
+        try:
+            self.spool.ack(cursor)
+        except:
+            logger.exception()
+
+    def _replay_failed(self, failure):
+        # the records are read again next time; rewriting the
+        # batches that did succeed is harmless
+        self.replaying = False
+        failure = failure.value.subFailure
+        if (not failure.check(scheduler.DroppedExcept)):
+            self.healthy = False
+        logger.warn("spool replay failed, retrying: %s" % failure.getErrorMessage())
+
+    def replay_spool(self):
+        # while cassandra is unhealthy a single record is replayed at
+        # a time, as a probe; spool_rate records per second otherwise.
+        # records are only acknowledged once all of their batches are
+        # written, and nothing else is read from the spool meanwhile.
+        if (self.replaying):
+            return
+        if (self.sched.pending or self.sched.inflight >= self.sched.maxinflight):
+            return
+        if (not self.healthy and self.sched.inflight > 0):
+            return
+        try:
+            (records, cursor) = self.spool.read(self.rate if self.healthy else 1)
+        except:
+            logger.exception()
+            return
+        if (len(records) == 0):
+            return
+        ds = []
+        for r in records:
+            ds.extend([d for (_, d) in self.submit(parser.parse_frames(r)[0])])
+        self.replaying = True
+        d = defer.DeferredList(ds, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallbacks(self._replayed, self._replay_failed, callbackArgs=(cursor,))
+        return(d)
+
+    def statistics(self):
+        now     = time.time()
+        stats   = self.sched.stats()
+        metrics = [Gauge("%s.scheduler.pending" % self.monit, stats["pending"], now),
+                   Gauge("%s.scheduler.inflight" % self.monit, stats["inflight"], now),
+                   Derive("%s.scheduler.completed" % self.monit, stats["completed"], now),
+                   Derive("%s.scheduler.failed" % self.monit, stats["failed"], now),
+                   Derive("%s.scheduler.dropped" % self.monit, stats["dropped"], now),
+                   Derive("%s.scheduler.spilled" % self.monit, stats["spilled"], now),
+                   Derive("%s.coalesce.coalesced" % self.monit, self.pending.coalesced, now),
+                   Gauge("%s.coalesce.size" % self.monit, self.pending.size, now)]
+        dbus    = self.dbus.stats().get("storage")
+        if (dbus is not None):
+            metrics.append(Gauge("%s.databus.lag" % self.monit, dbus["lag"], now))
+            metrics.append(Derive("%s.databus.delivered" % self.monit, dbus["delivered"], now))
+            metrics.append(Derive("%s.databus.dropped" % self.monit, dbus["dropped"], now))
+        if (self.spool is not None):
+            metrics.append(Gauge("%s.spool.size" % self.monit, self.spool.size(), now))
+            metrics.append(Gauge("%s.spool.lag" % self.monit, self.spool.lag(), now))
+        if (self.relay is None):
+            logger.info("statistics: %s" % pp.render_metrics(metrics))
+            return
+        try:
+            self.relay.relay(pp.render_metrics(metrics))
+        except:
+            logger.error("cant relay to peer address")
+
+    def submit(self, objects):
+        # schedules the batches of objects and their catalog entries;
+        # returns a (group, deferred) pair for each data batch
+        batches = []
+        for (group, batch) in self.storage.batches(objects):
+            batches.append((group, self.sched.submit(self._write, group, batch)))
+        for (entries, batch) in self.storage.catalog_batches(objects, self.catalog):
+            d = self.sched.submit(self._write, None, batch)
+            d.addErrback(self._catalog_failed, entries)
+        return(batches)
+
+    def write(self, objects):
+        batches = self.submit(objects)
+        for (group, d) in batches:
+            d.addErrback(self._batch_failed, group)
+        return(batches)
+
+    def commit(self, objects):
+        if (len(objects) == 0):
+            return
         t = funcs.timer_start()
+        # rollups see the objects after coalescing, as raw events do
+        self.rollup.update([obj for obj in objects if obj.kind() == event.Event.kind()])
+        if (not self.healthy and self._spill(objects, None)):
+            logger.debug("spooled %d events [walltime: %s]" % (len(objects), funcs.timer_stop(t)))
+            return
+        batches = self.write(objects)
+        logger.debug("scheduled %d events in %d batches [walltime: %s]" % (len(objects), len(batches), funcs.timer_stop(t)))
+
+    def recv_broadcast(self, objects):
         for obj in objects:
             scale(obj)
-            obj.store(self.storage)
-        logger.debug("wrote %d events [walltime: %s]" % (len(objects), funcs.timer_stop(t)))
+        self.commit(self.pending.add(objects))
 
     def startService(self):
         service.Service.startService(self)
         logger.warn("starting cassandra service")
-        self.dbus.attach("storage", self)
+        self.dbus.attach("storage", self, self.getint("backlog", databus.BACKLOG))
         self.storage.startService()
         self.loop.start(1)
+        self.stats.start(60)
+        self.flush.start(60, now=False)
+        self.tick.start(1)
+        if (self.spool is not None):
+            self.replay.start(1)
+
+    def _stopped(self, _):
+        if (self.spool is not None):
+            self.spool.close()
+        self.storage.stopService()
+        service.Service.stopService(self)
 
     def stopService(self):
+        # what the databus has not delivered yet goes through the
+        # coalescer first, which feeds the rollups, which are flushed
+        # last; storage and the spool are closed once every write
+        # has finished [or been spooled]
         logger.warn("stoppping cassandra service")
         self.loop.stop()
-        self.dbus.detach("storage")
-        self.storage.stopService()
-        service.Service.stopService(self)
+        self.stats.stop()
+        self.flush.stop()
+        self.tick.stop()
+        if (self.spool is not None):
+            self.replay.stop()
+        self.recv_broadcast(self.dbus.detach("storage"))
+        self.commit(self.pending.flush())
+        d = self.flush_rollups()
+        d.addBoth(lambda _: self.sched.wait())
+        d.addBoth(self._stopped)
+        return(d)
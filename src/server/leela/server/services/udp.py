@@ -15,24 +15,36 @@
 #    limitations under the License.
 #
 
-from twisted.internet import reactor
 from twisted.application.service import Service
 from leela.server import logger
 from leela.server import config
 from leela.server.data import pp
-from leela.server.network.databus import Relay
+from leela.server.network import databus
+from leela.server.services import workers
 from leela.server.network import udp_proto
 import socket
 
 class UdpService(Service, udp_proto.UDP):
 
-    def __init__(self, cfg):
-        self.cfg   = cfg
-        self.relay = Relay(self.cfg.get("udp", "relay"), "leela.%s.udp.timeline" % config.hostname())
+    def __init__(self, cfg, worker=None):
+        # as a worker [see workers.Supervisor] the port is shared
+        # with the other workers and the statistics go to the
+        # supervisor
+        self.cfg    = cfg
+        self.worker = worker
+        monit       = "leela.%s.udp.timeline" % config.hostname()
+        if (worker is not None):
+            monit = None
+        self.relay  = databus.relay_from(self.cfg, "udp", monit_prefix=monit)
+
+    def counters(self):
+        return(dict([("timeline.%s" % k, v) for (k, v) in self.relay.counters().iteritems()]))
 
     def forward_packet(self, packet):
         logger.debug("forward: %d" % len(packet))
         self.relay.relay(packet)
 
     def startService(self):
-        reactor.listenUDP(self.cfg.getint("udp", "port"), self, self.cfg.get("udp", "address"))
+        workers.listen_udp(self.cfg.getint("udp", "port"), self, self.cfg.get("udp", "address"), self.worker is not None)
+        if (self.worker is not None):
+            workers.Reporter(self.counters).start()
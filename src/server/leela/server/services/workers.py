@@ -0,0 +1,183 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import os
+import json
+import time
+import socket
+from twisted.internet import reactor
+from twisted.internet import protocol
+from twisted.internet import task
+from twisted.internet import error
+from twisted.application import service
+from leela.server import logger
+from leela.server.data import pp
+from leela.server.data.metric import Derive
+from leela.server.data.metric import Gauge
+from leela.server.network import databus
+
+STATS_FD      = 3
+RESTART_DELAY = 1
+
+def listen_udp(port, proto, address, reuseport=False):
+    # reactor.listenUDP, but with SO_REUSEPORT set before the socket
+    # is bound, so that many workers may share a port
+    if (not reuseport):
+        return(reactor.listenUDP(port, proto, address))
+    fd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        fd.bind((address, port))
+        fd.setblocking(False)
+        return(reactor.adoptDatagramPort(fd.fileno(), socket.AF_INET, proto))
+    finally:
+        fd.close()
+
+class Reporter(object):
+    """
+    Runs in each worker: writes the counters [see databus.mkmetrics]
+    the `counters' function returns to the supervisor, one json
+    object per line on STATS_FD. The worker stops once its
+    supervisor is gone.
+    """
+
+    def __init__(self, counters, interval=10):
+        self.counters = counters
+        self.interval = interval
+        self.parent   = os.getppid()
+        self.out      = os.fdopen(STATS_FD, "w")
+        self.loop     = task.LoopingCall(self.report)
+
+    def start(self):
+        self.loop.start(self.interval, now=False)
+
+    def stop(self):
+        if (self.loop.running):
+            self.loop.stop()
+
+    def report(self):
+        if (os.getppid() != self.parent):
+            logger.warn("supervisor is gone, exiting")
+            reactor.stop()
+            return
+        self.out.write(json.dumps(self.counters()) + "\n")
+        self.out.flush()
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """
+    Reads the counters a worker reports on STATS_FD, and forwards
+    what it writes to stdout/stderr [its log, already filtered by
+    its log level] to the supervisor's log, line by line.
+    """
+
+    def __init__(self, supervisor, k):
+        self.supervisor = supervisor
+        self.k          = k
+        self.buffers    = {}
+
+    def lines(self, fd, data):
+        lines            = (self.buffers.get(fd, "") + data).split("\n")
+        self.buffers[fd] = lines.pop()
+        return(lines)
+
+    def forward(self, line):
+        logger.dolog("worker %d: %s" % (self.k, line))
+
+    def childDataReceived(self, fd, data):
+        if (fd == STATS_FD):
+            for l in self.lines(fd, data):
+                try:
+                    self.supervisor.report(self.k, json.loads(l))
+                except ValueError:
+                    logger.warn("worker %d: malformed stats" % self.k)
+        elif (fd in (1, 2)):
+            for l in self.lines(fd, data):
+                self.forward(l)
+
+    def processEnded(self, reason):
+        for fd in (1, 2):
+            if (self.buffers.get(fd)):
+                self.forward(self.buffers.pop(fd))
+        self.supervisor.died(self.k, reason)
+
+class Supervisor(service.Service):
+    """
+    Runs `workers' copies of a service, each one a process started
+    with `args' plus --worker <k>. Dead workers are restarted after
+    RESTART_DELAY seconds. Their counters are added up and relayed
+    every minute under `monit', as if a single process had them;
+    derives of dead workers are kept so that totals do not go back.
+    """
+
+    def __init__(self, workers, args, monit, relay=None):
+        self.workers  = workers
+        self.args     = args
+        self.monit    = monit
+        self.relay    = relay
+        self.procs    = {}
+        self.last     = {}
+        self.base     = {}
+        self.restarts = 0
+        self.stats    = task.LoopingCall(self.statistics)
+
+    def spawn(self, k):
+        if (not self.running):
+            return
+        proto         = WorkerProtocol(self, k)
+        self.procs[k] = proto
+        reactor.spawnProcess(proto, self.args[0], self.args + ["--worker", str(k)],
+                             env=os.environ, childFDs={0: "w", 1: "r", 2: "r", STATS_FD: "r"})
+
+    def report(self, k, counters):
+        self.last[k] = counters
+
+    def died(self, k, reason):
+        logger.warn("worker %d died: %s" % (k, reason.getErrorMessage()))
+        self.procs.pop(k, None)
+        derives   = dict([(n, c) for (n, c) in self.last.pop(k, {}).iteritems() if c[0] == "derive"])
+        self.base = databus.sum_counters([self.base, derives])
+        if (self.running):
+            self.restarts += 1
+            reactor.callLater(RESTART_DELAY, self.spawn, k)
+
+    def totals(self):
+        return(databus.sum_counters([self.base] + self.last.values()))
+
+    def statistics(self):
+        now     = time.time()
+        metrics = databus.mkmetrics(self.monit, self.totals(), now)
+        metrics.append(Gauge("%s.workers.alive" % self.monit, len(self.procs), now))
+        metrics.append(Derive("%s.workers.restarts" % self.monit, self.restarts, now))
+        if (self.relay is None):
+            logger.info("statistics: %s" % pp.render_metrics(metrics))
+            return
+        self.relay.relay(pp.render_metrics(metrics))
+
+    def startService(self):
+        service.Service.startService(self)
+        for k in range(self.workers):
+            self.spawn(k)
+        self.stats.start(60, now=False)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.stats.stop()
+        for proto in self.procs.values():
+            try:
+                proto.transport.signalProcess("TERM")
+            except error.ProcessExitedAlready:
+                pass
@@ -0,0 +1,183 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import os
+import mmap
+import zlib
+import time
+import struct
+
+# length, crc32 and time of each record
+HEADER = struct.Struct(">IId")
+
+def segment_name(seq):
+    return("%016d.spool" % seq)
+
+class Spool(object):
+    """
+    An append-only queue of records on disk. Records go to segment
+    files of about `segsize' bytes in `path'; each record is a header
+    [length, crc32 and time] followed by the payload. Segments are
+    read back through mmap, and removed once every record in them
+    has been acknowledged. The read position survives restarts.
+
+    A record that fails its crc, or a truncated one, marks the end of
+    the good data in its segment; the rest of it is skipped.
+    """
+
+    def __init__(self, path, segsize=64*1024*1024, clock=time.time):
+        self.path    = path
+        self.segsize = segsize
+        self.clock   = clock
+        if (not os.path.isdir(path)):
+            os.makedirs(path)
+        segments = sorted([int(f[:-6], 10) for f in os.listdir(path) if f.endswith(".spool")])
+        if (len(segments) == 0):
+            segments = [0]
+        (self.rseq, self.roff) = self._load_cursor(segments[0])
+        if (self.rseq < segments[0] or self.rseq > segments[-1]):
+            (self.rseq, self.roff) = (segments[0], 0)
+        for seq in segments:
+            if (seq < self.rseq):
+                os.unlink(self._segment(seq))
+        self.segments = [seq for seq in segments if seq >= self.rseq]
+        # never append to a segment written by a previous run, it may
+        # end with a truncated record
+        if (os.path.exists(self._segment(self.segments[-1])) and os.path.getsize(self._segment(self.segments[-1])) > 0):
+            self.segments.append(self.segments[-1] + 1)
+        self._open(self.segments[-1])
+
+    def _segment(self, seq):
+        return(os.path.join(self.path, segment_name(seq)))
+
+    def _load_cursor(self, default):
+        try:
+            with open(os.path.join(self.path, "cursor"), "r") as fh:
+                (seq, off) = fh.read().split()
+                return((int(seq, 10), int(off, 10)))
+        except (IOError, ValueError):
+            return((default, 0))
+
+    def _save_cursor(self):
+        tmp = os.path.join(self.path, "cursor.tmp")
+        with open(tmp, "w") as fh:
+            fh.write("%d %d\n" % (self.rseq, self.roff))
+        os.rename(tmp, os.path.join(self.path, "cursor"))
+
+    def _open(self, seq):
+        self.wseq = seq
+        self.wfh  = open(self._segment(seq), "ab")
+        self.woff = os.path.getsize(self._segment(seq))
+
+    def _roll(self):
+        self.wfh.close()
+        self.segments.append(self.wseq + 1)
+        self._open(self.wseq + 1)
+
+    def append(self, payload):
+        if (self.woff > 0 and self.woff + HEADER.size + len(payload) > self.segsize):
+            self._roll()
+        self.wfh.write(HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff, self.clock()))
+        self.wfh.write(payload)
+        self.wfh.flush()
+        self.woff += HEADER.size + len(payload)
+
+    def _map(self, seq):
+        with open(self._segment(seq), "rb") as fh:
+            if (os.fstat(fh.fileno()).st_size == 0):
+                return("")
+            return(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _record_at(self, buf, off):
+        # (payload, time, next offset), or None if there is no [good]
+        # record at this offset
+        if (off + HEADER.size > len(buf)):
+            return(None)
+        (size, crc, t) = HEADER.unpack_from(buf, off)
+        start = off + HEADER.size
+        if (start + size > len(buf)):
+            return(None)
+        payload = buf[start:start + size]
+        if (zlib.crc32(payload) & 0xffffffff != crc):
+            return(None)
+        return((payload, t, start + size))
+
+    def _scan(self, n, roll=True):
+        # roll tells whether a bad record in the segment being
+        # written to may close it; when it may not, the scan stops
+        # there as if there was nothing else to read
+        records = []
+        (seq, off) = (self.rseq, self.roff)
+        while (len(records) < n):
+            buf = self._map(seq)
+            try:
+                while (len(records) < n):
+                    r = self._record_at(buf, off)
+                    if (r is None):
+                        break
+                    records.append(r)
+                    off = r[2]
+                end = len(buf)
+            finally:
+                if (buf != ""):
+                    buf.close()
+            if (len(records) == n):
+                break
+            if (seq == self.wseq):
+                if (roll and off < end and off < self.woff):
+                    # a bad record in the segment being written
+                    # to: nothing after it can be trusted
+                    self._roll()
+                else:
+                    break
+            (seq, off) = (seq + 1, 0)
+        return((records, (seq, off)))
+
+    def read(self, n):
+        """
+        Up to `n' payloads from the read position, and the position
+        after them, which should be given to ack once they are dealt
+        with.
+        """
+        (records, cursor) = self._scan(n)
+        return(([r[0] for r in records], cursor))
+
+    def ack(self, cursor):
+        (self.rseq, self.roff) = cursor
+        while (self.segments[0] < self.rseq):
+            os.unlink(self._segment(self.segments.pop(0)))
+        if (self.rseq == self.wseq and self.roff == self.woff and self.woff > 0):
+            # everything was consumed, start over with an empty segment
+            self._roll()
+            os.unlink(self._segment(self.segments.pop(0)))
+            (self.rseq, self.roff) = (self.wseq, 0)
+        self._save_cursor()
+
+    def size(self):
+        # the number of bytes not acknowledged yet
+        return(sum([os.path.getsize(self._segment(seq)) for seq in self.segments]) - self.roff)
+
+    def lag(self):
+        # how old [in seconds] the oldest record not acknowledged is;
+        # this only reads the spool
+        (records, _) = self._scan(1, False)
+        if (len(records) == 0):
+            return(0)
+        return(max(0, self.clock() - records[0][1]))
+
+    def close(self):
+        self.wfh.close()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8; -*-
+#
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+"""
+Time functions using only integer arithmetic on unix timestamps
+[always UTC]. These avoid the datetime/calendar round-trips on the
+hot paths [storage, marshalling].
+
+The calendar conversions follow Howard Hinnant's `days_from_civil'
+and `civil_from_days' algorithms.
+"""
+
+import math
+
+MINUTE = 60
+HOUR   = 60 * MINUTE
+DAY    = 24 * HOUR
+
+def seconds(t):
+    """
+    The integer part of a timestamp [rounding towards -∞].
+    """
+    if (isinstance(t, float)):
+        return(int(math.floor(t)))
+    return(t)
+
+def days_from_civil(y, m, d):
+    y  -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return(era * 146097 + doe - 719468)
+
+def civil_from_days(z):
+    z  += 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp  = (5 * doy + 2) // 153
+    d   = doy - (153 * mp + 2) // 5 + 1
+    m   = mp + (3 if mp < 10 else -9)
+    return(yoe + era * 400 + (m <= 2), m, d)
+
+def timegm(y, mo, d, h=0, mi=0, s=0):
+    """
+    The same as calendar.timegm. Out of range fields [e.g. minute=60]
+    overflow into the next field.
+    """
+    return(days_from_civil(y, mo, 1) * DAY + (d - 1) * DAY + h * HOUR + mi * MINUTE + s)
+
+def gmtime(t):
+    """
+    The same as time.gmtime(t)[:6].
+    """
+    (days, secs) = divmod(seconds(t), DAY)
+    (h, secs)    = divmod(secs, HOUR)
+    (mi, s)      = divmod(secs, MINUTE)
+    (y, mo, d)   = civil_from_days(days)
+    return((y, mo, d, h, mi, s))
+
+def epoch(year):
+    """
+    The timestamp of the first second of a given year.
+    """
+    return(days_from_civil(year, 1, 1) * DAY)
+
+def truncate_minute(t):
+    t = seconds(t)
+    return(t - t % MINUTE)
+
+def month_bucket(t):
+    """
+    The (year, month) a timestamp belongs to.
+    """
+    (y, m, _) = civil_from_days(seconds(t) // DAY)
+    return((y, m))
+
+def month_start(y, m):
+    return(days_from_civil(y, m, 1) * DAY)
+
+def next_month(y, m):
+    if (m == 12):
+        return((y + 1, 1))
+    return((y, m + 1))
+
+def month_days(y, m):
+    (ny, nm) = next_month(y, m)
+    return(days_from_civil(ny, nm, 1) - days_from_civil(y, m, 1))
+
+def encode_key(t, year):
+    """
+    The column name of a timestamp, i.e., the number of seconds since
+    the epoch `year'.
+    """
+    return(seconds(t) - epoch(year))
+
+def decode_key(k, year):
+    return(k + epoch(year))
+
+def split_months(t0, t1):
+    """
+    Splits the closed interval [t0, t1] into monthly slices. Returns
+    a list of (year, month, start, finish) tuples, in chronological
+    order.
+    """
+    t0 = seconds(t0)
+    t1 = seconds(t1)
+    if (t0 > t1):
+        raise(ValueError("start > finish"))
+    slices = []
+    (y, m) = month_bucket(t0)
+    while (t0 <= t1):
+        (ny, nm) = next_month(y, m)
+        tn       = month_start(ny, nm)
+        slices.append((y, m, t0, min(t1, tn - 1)))
+        (y, m)   = (ny, nm)
+        t0       = tn
+    return(slices)
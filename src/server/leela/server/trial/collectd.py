@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+from leela.server.trial import helpers
+from leela.server.data import collectd
+from leela.server.data import metric
+import argparse
+import random
+import struct
+import time
+
+def part_string(ptype, s):
+    return(struct.pack(">2H", ptype, len(s) + 5) + s + "\0")
+
+def part_numeric(ptype, n):
+    return(struct.pack(">2Hq", ptype, 12, n))
+
+def part_signature(user):
+    return(struct.pack(">2H", collectd.TYPE_SIGNATURE, 36 + len(user)) + "\0" * 32 + user)
+
+def part_values(values):
+    fmt = {collectd.DS_COUNTER : ">Q",
+           collectd.DS_GAUGE   : "<d",
+           collectd.DS_DERIVE  : ">q",
+           collectd.DS_ABSOLUTE: ">Q"
+          }
+    tmp = [struct.pack(">3H", collectd.TYPE_VALUES, 6 + 9 * len(values), len(values))]
+    tmp.extend([struct.pack("B", t) for (t, _) in values])
+    tmp.extend([struct.pack(fmt[t], v) for (t, v) in values])
+    return("".join(tmp))
+
+def plugins(ncpus):
+    # (plugin, plugin_instance, type, type_instance, values); this
+    # mimics what a stock collectd.conf sends
+    derive = lambda n: [(collectd.DS_DERIVE, random.randint(0, 2**40)) for _ in range(n)]
+    gauge  = lambda n: [(collectd.DS_GAUGE, random.random() * 2**30) for _ in range(n)]
+    for cpu in range(ncpus):
+        for state in ["user", "nice", "system", "idle", "wait", "interrupt", "softirq", "steal"]:
+            yield("cpu", str(cpu), "cpu", state, derive(1))
+    yield("load", "", "load", "", gauge(3))
+    for state in ["used", "buffered", "cached", "free"]:
+        yield("memory", "", "memory", state, gauge(1))
+    for iface in ["lo", "eth0", "eth1"]:
+        for t in ["if_octets", "if_packets", "if_errors"]:
+            yield("interface", iface, t, "", derive(2))
+    for disk in ["sda", "sda1", "sdb", "sdb1"]:
+        for t in ["disk_octets", "disk_ops", "disk_time", "disk_merged"]:
+            yield("disk", disk, t, "", derive(2))
+    for mount in ["root", "var", "tmp"]:
+        for state in ["free", "used", "reserved"]:
+            yield("df", mount, "df_complex", state, gauge(1))
+    for t in ["fork_rate", "ps_state-running", "ps_state-sleeping", "ps_state-zombies"]:
+        yield("processes", "", t, "", derive(1))
+
+def mkpackets(opts, host):
+    # mimics the network plugin: only parts that have changed are
+    # sent and packets are flushed when they are full
+    header  = part_signature("leela") + part_string(collectd.TYPE_HOST, host)
+    packets = []
+    packet  = None
+    context = None
+    for (p, pi, t, ti, values) in plugins(opts.ncpus):
+        if (packet is None):
+            packet  = [header,
+                       part_numeric(collectd.TYPE_TIME_HI, int(time.time()) << 30),
+                       part_numeric(collectd.TYPE_INTERVAL_HI, 10 << 30)]
+            context = {}
+        for (k, v) in [(collectd.TYPE_PLUGIN, p), (collectd.TYPE_PLUGIN_INSTANCE, pi),
+                       (collectd.TYPE_TYPE, t), (collectd.TYPE_TYPE_INSTANCE, ti)]:
+            if (context.get(k) != v):
+                context[k] = v
+                packet.append(part_string(k, v))
+        packet.append(part_values(values))
+        if (sum(map(len, packet)) > opts.pktsz):
+            packets.append("".join(packet))
+            packet = None
+    if (packet is not None):
+        packets.append("".join(packet))
+    return(packets)
+
+def legacy_values(packet):
+    (nvalues,) = struct.unpack_from(">H", packet[4:])
+    offset     = 6
+    vtypes     = []
+    values     = []
+    for _ in range(nvalues):
+        vtypes.append(struct.unpack_from("B", packet[offset:])[0])
+        offset += 1
+    for vtype in vtypes:
+        values.append((vtype, LEGACY_DS[vtype](packet[offset:])))
+        offset += 8
+    return(values)
+
+def legacy_format(mtype, value, context):
+    user   = context[collectd.TYPE_SIGNATURE]
+    plugin = collectd.join_("-", context.get(collectd.TYPE_PLUGIN), context.get(collectd.TYPE_PLUGIN_INSTANCE))
+    t      = collectd.join_("-", context.get(collectd.TYPE_TYPE), context.get(collectd.TYPE_TYPE_INSTANCE))
+    key    = collectd.join_(".", user, context[collectd.TYPE_HOST], plugin, t, context.get(collectd.MY_TYPE_SUFFIX))
+    mtime  = context[collectd.TYPE_TIME_HI] / float(2**30)
+    return(LEGACY_METRICS[mtype](key, value, mtime))
+
+def parse_legacy(packet):
+    # this is how parse_packet used to work: each part is sliced off
+    # the packet [packet[offset:]] before it gets parsed, keys are
+    # built from scratch and each value becomes a Metric instance
+    offset  = 0
+    context = {}
+    metrics = []
+    while (offset < len(packet)):
+        (ptype, psize) = struct.unpack_from(">2H", packet[offset:])
+        part           = packet[offset:]
+        if (ptype == collectd.TYPE_VALUES):
+            values = legacy_values(part)
+            for (k, (mtype, value)) in enumerate(values):
+                if (len(values) > 1):
+                    context[collectd.MY_TYPE_SUFFIX] = str(k)
+                elif (collectd.MY_TYPE_SUFFIX in context):
+                    del(context[collectd.MY_TYPE_SUFFIX])
+                metrics.append(legacy_format(mtype, value, context))
+        elif (ptype == collectd.TYPE_SIGNATURE):
+            context[ptype] = struct.unpack_from("%ds" % (psize - 36), part, 36)[0]
+        elif (ptype in (collectd.TYPE_TIME_HI, collectd.TYPE_INTERVAL_HI)):
+            context[ptype] = struct.unpack_from(">q", part[4:])[0]
+        else:
+            context[ptype] = struct.unpack_from("%ds" % (psize - 5), part, 4)[0]
+        offset += psize
+    return(metrics)
+
+LEGACY_DS = {collectd.DS_COUNTER : lambda p: struct.unpack_from(">Q", p)[0],
+             collectd.DS_GAUGE   : lambda p: struct.unpack_from("<d", p)[0],
+             collectd.DS_DERIVE  : lambda p: struct.unpack_from(">q", p)[0],
+             collectd.DS_ABSOLUTE: lambda p: struct.unpack_from(">Q", p)[0]
+            }
+
+LEGACY_METRICS = {collectd.DS_COUNTER : metric.Counter,
+                  collectd.DS_GAUGE   : metric.Gauge,
+                  collectd.DS_DERIVE  : metric.Derive,
+                  collectd.DS_ABSOLUTE: metric.Absolute
+                 }
+
+def bench(label, f, packets, rounds):
+    m = helpers.progress()
+    c = 0
+    t = time.time()
+    for _ in range(rounds):
+        for p in packets:
+            c += len(f(p))
+            m.measure(len(p))
+            m.dump_state(label)
+    m.done()
+    t = time.time() - t
+    helpers.debug("%s: %s metrics in %.3fs [%s]\n" % (label, helpers.fmt(c), t, helpers.fmt(c / t, units=m.units)))
+    return(t)
+
+def trial(opts):
+    packets = []
+    for k in range(opts.hosts):
+        packets.extend(mkpackets(opts, "host-%05d.leela" % k))
+    helpers.debug("benchmarking collectd parser ... [hosts: %s, packets: %s, pktsz: %s]\n" % (helpers.fmt(opts.hosts),
+                                                                                             helpers.fmt(len(packets)),
+                                                                                             helpers.fmt(opts.pktsz)))
+    t0 = bench("parse_legacy", parse_legacy, packets, opts.rounds)
+    t1 = bench("parse_packet", collectd.parse_packet, packets, opts.rounds)
+    helpers.debug("speedup: %.2fx\n" % (t0 / t1))
+
+if (__name__ == "__main__"):
+    args = argparse.ArgumentParser()
+    args.add_argument("--hosts",
+                      type    = int,
+                      default = 1000,
+                      dest    = "hosts",
+                      help    = "number of distinct hosts [default: %(default)s]")
+    args.add_argument("--ncpus",
+                      type    = int,
+                      default = 4,
+                      dest    = "ncpus",
+                      help    = "number of cpus each host reports [default: %(default)s]")
+    args.add_argument("--rounds",
+                      type    = int,
+                      default = 5,
+                      dest    = "rounds",
+                      help    = "how many times each packet is parsed [default: %(default)s]")
+    args.add_argument("--pktsz",
+                      type    = int,
+                      default = 1452,
+                      dest    = "pktsz",
+                      help    = "maximum size of each packet [default: %(default)s]")
+    trial(args.parse_args())
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from leela.server.trial import helpers
+from leela.server.data import parser
+import argparse
+import random
+import time
+
+SEED = "leela.dmproc.trial_parser"
+
+def mkpacket(opts, keys):
+    p = []
+    c = opts.pktsz
+    while (c > 0):
+        n  = keys[len(p) % len(keys)]
+        if (random.random() < opts.ratio):
+            v = "{\"value\": %s}" % repr(random.random())
+            l = "data %d|%s %d|%s %d.0;" % (len(n), n, len(v), v, time.time())
+        else:
+            l = "event %d|%s %s %d.0;" % (len(n), n, repr(random.random()), time.time())
+        c -= len(l)
+        p.append(l)
+    return("".join(p))
+
+def parse_legacy(packet):
+    # this is how Databus used to consume packets: one char at a
+    # time, using parse_event_/parse_data_ on each message
+    tmp  = []
+    msgs = []
+    for c in packet:
+        tmp.append(c)
+        if (c == ';'):
+            tmp = "".join(tmp)
+            x   = None
+            if (tmp[0] == 'e'):
+                x = parser.parse_event_(tmp)[0]
+            elif (tmp[0] == 'd'):
+                x = parser.parse_data_(tmp)[0]
+            if (x is not None):
+                msgs.append(x)
+            tmp = []
+    return(msgs)
+
+def parse_many(packet):
+    return(parser.parse_many(packet)[0])
+
+def bench(label, f, packets):
+    m = helpers.progress()
+    t = time.time()
+    c = 0
+    for p in packets:
+        c += len(f(p))
+        m.measure(len(p))
+        m.dump_state(label)
+    m.done()
+    t = time.time() - t
+    helpers.debug("%s: %s msgs in %.3fs [%s]\n" % (label, helpers.fmt(c), t, helpers.fmt(c / t, units=m.units)))
+    return(t)
+
+def trial(opts):
+    keys    = helpers.strings(SEED, opts.uniq)
+    packets = [mkpacket(opts, keys) for _ in range(opts.packets)]
+    helpers.debug("benchmarking parser ... [packets: %s, pktsz: %s, keylen: %s]\n" % (helpers.fmt(opts.packets),
+                                                                                      helpers.fmt(opts.pktsz),
+                                                                                      len(keys[0])))
+    t0 = bench("parse_legacy", parse_legacy, packets)
+    t1 = bench("parse_many", parse_many, packets)
+    helpers.debug("speedup: %.2fx\n" % (t0 / t1))
+
+if (__name__ == "__main__"):
+    args = argparse.ArgumentParser()
+    args.add_argument("--uniq",
+                      type    = int,
+                      default = 10000,
+                      dest    = "uniq",
+                      help    = "number of distinct keys to generate [default: %(default)s]")
+    args.add_argument("--packets",
+                      type    = int,
+                      default = 1000,
+                      dest    = "packets",
+                      help    = "number of packets to parse [default: %(default)s]")
+    args.add_argument("--pktsz",
+                      type    = int,
+                      default = 32*1024,
+                      dest    = "pktsz",
+                      help    = "apromixate size of each packet [default: %(default)s]")
+    args.add_argument("--ratio",
+                      type    = float,
+                      default = 0.1,
+                      dest    = "ratio",
+                      help    = "the ratio of data messages in each packet [default: %(default)s]")
+    trial(args.parse_args())
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from leela.server.trial import helpers
+from leela.server.network import storage_proto
+from leela.server.data import event
+from leela.server import timeutil
+from leela.server import cache
+from twisted.python import failure
+import ConfigParser
+import argparse
+import time
+
+SEED = "leela.dmproc.trial_storage"
+
+def mkstorage(opts):
+    cfg = ConfigParser.ConfigParser()
+    cfg.add_section("cassandra")
+    cfg.set("cassandra", "backend", "sqlite")
+    cfg.set("cassandra", "sqlite_path", opts.path)
+    return(storage_proto.connect(cfg))
+
+def result(d):
+    r = []
+    d.addBoth(r.append)
+    if (isinstance(r[0], failure.Failure)):
+        r[0].raiseException()
+    return(r[0])
+
+def trial(opts):
+    storage = mkstorage(opts)
+    keys    = helpers.strings(SEED, opts.uniq)
+    t0      = timeutil.seconds(time.time()) - opts.points * 60
+    seen    = cache.LRU(opts.uniq * 2)
+    helpers.debug("benchmarking storage [sqlite] ... [keys: %s, points: %s]\n" % (helpers.fmt(opts.uniq), helpers.fmt(opts.points)))
+    m = helpers.progress()
+    c = 0
+    t = time.time()
+    for p in range(opts.points):
+        objects = [event.Event(k, float(p), t0 + p * 60) for k in keys]
+        for (_, batch) in storage.batches(objects) + storage.catalog_batches(objects, seen):
+            result(storage.batch_mutate(batch))
+        c += len(objects)
+        m.measure(len(objects))
+        m.dump_state("batch_mutate")
+    m.done()
+    t = time.time() - t
+    helpers.debug("batch_mutate: %s events in %.3fs [%s]\n" % (helpers.fmt(c), t, helpers.fmt(c / t, units=m.units)))
+    start  = timeutil.gmtime(t0)
+    finish = timeutil.gmtime(t0 + opts.points * 60)
+    m = helpers.progress()
+    c = 0
+    t = time.time()
+    for k in keys:
+        n = len(result(storage.load(event.Event.kind(), k, start, finish, opts.points)))
+        c += n
+        m.measure(n)
+        m.dump_state("load")
+    m.done()
+    t = time.time() - t
+    helpers.debug("load: %s events in %.3fs [%s]\n" % (helpers.fmt(c), t, helpers.fmt(c / t, units=m.units)))
+
+if (__name__ == "__main__"):
+    args = argparse.ArgumentParser()
+    args.add_argument("--uniq",
+                      type    = int,
+                      default = 1000,
+                      dest    = "uniq",
+                      help    = "number of distinct keys to write [default: %(default)s]")
+    args.add_argument("--points",
+                      type    = int,
+                      default = 60,
+                      dest    = "points",
+                      help    = "number of points [one per minute] to write to each key [default: %(default)s]")
+    args.add_argument("--path",
+                      default = ":memory:",
+                      dest    = "path",
+                      help    = "the sqlite database to use [default: %(default)s]")
+    trial(args.parse_args())
@@ -15,6 +15,7 @@
 #    limitations under the License.
 #
 
+import sys
 from zope.interface import implements
 from twisted.python import usage
 from twisted.plugin import IPlugin
@@ -28,6 +29,8 @@ from leela.server.services import storage
 from leela.server.services import http
 from leela.server.services import udp
 from leela.server.services import collectd
+from leela.server.services import workers
+from leela.server.network import databus
 from leela.server import logger
 from leela.server import config
 
@@ -44,7 +47,9 @@ class LeelaOption(usage.Options):
     optParameters = [ ["config"   , "", config.default_config_file(), "Leela config file to use"                             ],
                       ["service"  , "", "udp"                       , "What leela service to start (xmpp|storage|udp|http|collectd)"  ],
                       ["log-level", "", "warn"                      , "The log level (debug|info|warn|error)"                ],
-                      ["setenv"   , "", ""                          , "Provides options to the service (e.g. setenv=a:b,b:c)"]
+                      ["setenv"   , "", ""                          , "Provides options to the service (e.g. setenv=a:b,b:c)"],
+                      ["workers"  , "", "1"                         , "How many processes share the port (udp|collectd)"     ],
+                      ["worker"   , "", None                        , "Internal: the index of this worker process"           ]
                     ]
 
 class LeelaServiceMk(object):
@@ -72,11 +77,33 @@ class LeelaServiceMk(object):
     def storage_service(self, cfg, env):
         return(storage.StorageService(cfg, env["databus"]))
 
-    def udp_service(self, cfg, env):
-        return(udp.UdpService(cfg))
+    def supervisor(self, cfg, options):
+        # runs this very command once for each worker
+        args = [sys.executable, "-c", "from twisted.scripts.twistd import run; run()",
+                "--nodaemon", "--pidfile=", "leela",
+                "--service", options["service"],
+                "--config", options["config"],
+                "--log-level", options["log-level"],
+                "--setenv", options["setenv"]]
+        return(workers.Supervisor(int(options["workers"]),
+                                  args,
+                                  "leela.%s.%s" % (config.hostname(), options["service"]),
+                                  databus.relay_from(cfg, options["service"])))
 
-    def collectd_service(self, cfg, env):
-        return(collectd.CollectdService(cfg))
+    def worker(self, options):
+        if (options["worker"] is None):
+            return(None)
+        return(int(options["worker"]))
+
+    def udp_service(self, cfg, env, options):
+        if (int(options["workers"]) > 1 and options["worker"] is None):
+            return(self.supervisor(cfg, options))
+        return(udp.UdpService(cfg, self.worker(options)))
+
+    def collectd_service(self, cfg, env, options):
+        if (int(options["workers"]) > 1 and options["worker"] is None):
+            return(self.supervisor(cfg, options))
+        return(collectd.CollectdService(cfg, self.worker(options)))
 
     def http_service(self, cfg, env):
         srv = http.HttpService(cfg)
@@ -96,11 +123,11 @@ class LeelaServiceMk(object):
         elif (options["service"] == "storage"):
             return(self.storage_service(cfg, env))
         elif (options["service"] == "udp"):
-            return(self.udp_service(cfg, env))
+            return(self.udp_service(cfg, env, options))
         elif (options["service"] == "http"):
             return(self.http_service(cfg, env))
         elif (options["service"] == "collectd"):
-            return(self.collectd_service(cfg, env))
+            return(self.collectd_service(cfg, env, options))
         else:
             raise(RuntimeError("error: unknown service"))
 
@@ -0,0 +1,143 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+from nose.tools import *
+from leela.server import cache
+
+def test_lru_get_returns_default_on_miss():
+    c = cache.LRU(2)
+    eq_(None, c.get("foo"))
+    eq_("bar", c.get("foo", "bar"))
+    eq_(2, c.misses)
+
+def test_lru_get_returns_stored_values():
+    c = cache.LRU(2)
+    c.put("foo", 1)
+    eq_(1, c.get("foo"))
+    eq_(1, c.hits)
+
+def test_lru_evicts_least_recently_used():
+    c = cache.LRU(2)
+    c.put("foo", 1)
+    c.put("bar", 2)
+    c.get("foo")
+    c.put("baz", 3)
+    ok_("foo" in c)
+    ok_("bar" not in c)
+    ok_("baz" in c)
+    eq_(1, c.evictions)
+
+def test_lru_put_overwrites_without_evicting():
+    c = cache.LRU(2)
+    c.put("foo", 1)
+    c.put("bar", 2)
+    c.put("foo", 3)
+    eq_(3, c.get("foo"))
+    eq_((0, 2), (c.evictions, len(c)))
+
+def test_lru_stats():
+    c = cache.LRU(1)
+    c.put("foo", 1)
+    c.put("bar", 1)
+    c.get("foo")
+    c.get("bar")
+    eq_({"hits": 1, "misses": 1, "evictions": 1, "size": 1}, c.stats())
+
+@raises(ValueError)
+def test_lru_must_raise_on_invalid_size():
+    cache.LRU(0)
+
+def test_lru_pop_removes_entries():
+    c = cache.LRU(2)
+    c.put("foo", 1)
+    c.put("bar", 2)
+    eq_(1, c.pop("foo"))
+    eq_(None, c.pop("foo"))
+    ok_("foo" not in c)
+    c.put("baz", 3)
+    c.put("qux", 4)
+    eq_(["baz", "qux"], sorted(c.items.keys()))
+
+def test_lru_popitem_removes_the_least_recently_used():
+    c = cache.LRU(3)
+    c.put("foo", 1)
+    c.put("bar", 2)
+    c.get("foo")
+    eq_(("bar", 2), c.popitem())
+    eq_(("foo", 1), c.popitem())
+    assert_raises(KeyError, c.popitem)
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return(self.now)
+
+def test_ttlcache_keeps_entries_without_ttl():
+    clock = FakeClock()
+    c = cache.TTLCache(2, clock)
+    c.put("foo", 1)
+    clock.now = 2**32
+    eq_(1, c.get("foo"))
+    eq_(1, c.hits)
+
+def test_ttlcache_expires_entries():
+    clock = FakeClock()
+    c = cache.TTLCache(2, clock)
+    c.put("foo", 1, ttl=10)
+    clock.now = 9
+    eq_(1, c.get("foo"))
+    clock.now = 10
+    eq_(None, c.get("foo"))
+    eq_(0, len(c))
+    eq_({"hits": 1, "misses": 1, "evictions": 0, "expired": 1, "size": 0, "weight": 0}, c.stats())
+
+def test_ttlcache_is_size_bounded():
+    c = cache.TTLCache(2)
+    for k in range(3):
+        c.put(k, k)
+    eq_(2, len(c))
+    eq_(None, c.get(0))
+    eq_(1, c.stats()["evictions"])
+
+def test_ttlcache_is_bounded_by_weight():
+    c = cache.TTLCache(10, weight=len)
+    c.put("foo", [0] * 4)
+    c.put("bar", [0] * 4)
+    c.put("baz", [0] * 4)
+    eq_(None, c.get("foo"))
+    eq_(8, c.stats()["weight"])
+    eq_(1, c.stats()["evictions"])
+
+def test_ttlcache_does_not_keep_entries_heavier_than_maxsize():
+    c = cache.TTLCache(10, weight=len)
+    c.put("foo", [0])
+    c.put("bar", [0] * 11)
+    eq_(None, c.get("bar"))
+    eq_([0], c.get("foo"))
+
+def test_ttlcache_put_replaces_the_weight_of_an_entry():
+    c = cache.TTLCache(10, weight=len)
+    c.put("foo", [0] * 8)
+    c.put("foo", [0] * 2)
+    eq_(2, c.stats()["weight"])
+    c.pop("foo")
+    eq_(0, c.stats()["weight"])
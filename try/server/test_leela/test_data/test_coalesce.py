@@ -0,0 +1,52 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+from nose.tools import *
+from leela.server.data import event
+from leela.server.data import data
+from leela.server.data import coalesce
+
+def values(objects):
+    return(sorted([(o.kind(), o.name(), o.unixtimestamp(), o.value()) for o in objects]))
+
+def test_add_keeps_the_last_object_of_each_minute():
+    c = coalesce.Coalesce(100)
+    eq_([], c.add([event.Event("foo", 1.0, 60), event.Event("foo", 2.0, 60), event.Event("bar", 3.0, 60)]))
+    eq_([("event", "bar", 60, 3.0), ("event", "foo", 60, 2.0)], values(c.flush()))
+    eq_(1, c.coalesced)
+
+def test_add_does_not_coalesce_different_kinds_or_minutes():
+    c = coalesce.Coalesce(100)
+    c.add([event.Event("foo", 1.0, 60), data.Data("foo", 2.0, 60), event.Event("foo", 3.0, 120)])
+    eq_(3, len(c.flush()))
+    eq_(0, c.coalesced)
+
+def test_flush_releases_minutes_that_are_over():
+    c = coalesce.Coalesce(100, grace=5)
+    c.add([event.Event("foo", 1.0, 60), event.Event("foo", 2.0, 120)])
+    eq_([], c.flush(124))
+    eq_([("event", "foo", 60, 1.0)], values(c.flush(125)))
+    eq_([("event", "foo", 120, 2.0)], values(c.flush(185)))
+    eq_(0, c.size)
+
+def test_add_flushes_on_memory_pressure():
+    c = coalesce.Coalesce(2)
+    eq_([], c.add([event.Event("foo", 1.0, 60), event.Event("bar", 1.0, 60)]))
+    eq_(3, len(c.add([event.Event("baz", 1.0, 60)])))
+    eq_(0, c.size)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import struct
+from nose.tools import *
+from leela.server import cache
+from leela.server.data import collectd
+
+def part_string(ptype, s):
+    return(struct.pack(">2H", ptype, len(s) + 5) + s + "\0")
+
+def part_numeric(ptype, n):
+    return(struct.pack(">2Hq", ptype, 12, n))
+
+def part_signature(user):
+    return(struct.pack(">2H", collectd.TYPE_SIGNATURE, 36 + len(user)) + "\0" * 32 + user)
+
+def part_values(*values):
+    fmt = {collectd.DS_COUNTER: ">Q", collectd.DS_GAUGE: "<d", collectd.DS_DERIVE: ">q", collectd.DS_ABSOLUTE: ">Q"}
+    tmp = [struct.pack(">3H", collectd.TYPE_VALUES, 6 + 9 * len(values), len(values))]
+    tmp.extend([struct.pack("B", t) for (t, _) in values])
+    tmp.extend([struct.pack(fmt[t], v) for (t, v) in values])
+    return("".join(tmp))
+
+def mkpacket(*parts):
+    return(part_signature("leela") + part_string(collectd.TYPE_HOST, "foobar") + "".join(parts))
+
+def test_parse_packet_produces_metric_tuples():
+    p = mkpacket(part_numeric(collectd.TYPE_TIME, 10),
+                 part_string(collectd.TYPE_PLUGIN, "cpu"),
+                 part_string(collectd.TYPE_PLUGIN_INSTANCE, "0"),
+                 part_string(collectd.TYPE_TYPE, "cpu"),
+                 part_string(collectd.TYPE_TYPE_INSTANCE, "idle"),
+                 part_values((collectd.DS_DERIVE, 42)),
+                 part_string(collectd.TYPE_TYPE_INSTANCE, "user"),
+                 part_values((collectd.DS_COUNTER, 7)))
+    eq_([("derive", "leela.foobar.cpu-0.cpu-idle", 42, 10),
+         ("counter", "leela.foobar.cpu-0.cpu-user", 7, 10)], collectd.parse_packet(p))
+
+def test_parse_packet_adds_suffix_to_multivalued_parts():
+    p = mkpacket(part_numeric(collectd.TYPE_TIME_HI, 10 << 30),
+                 part_string(collectd.TYPE_PLUGIN, "load"),
+                 part_string(collectd.TYPE_TYPE, "load"),
+                 part_values((collectd.DS_GAUGE, 0.5), (collectd.DS_GAUGE, 1.0), (collectd.DS_GAUGE, 1.5)),
+                 part_string(collectd.TYPE_PLUGIN, "memory"),
+                 part_string(collectd.TYPE_TYPE, "memory"),
+                 part_values((collectd.DS_ABSOLUTE, 3)))
+    eq_([("gauge", "leela.foobar.load.load.0", 0.5, 10.0),
+         ("gauge", "leela.foobar.load.load.1", 1.0, 10.0),
+         ("gauge", "leela.foobar.load.load.2", 1.5, 10.0),
+         ("absolute", "leela.foobar.memory.memory", 3, 10.0)], collectd.parse_packet(p))
+
+def test_parse_packet_drops_unauthenticated_packets():
+    p = part_string(collectd.TYPE_HOST, "foobar") + part_numeric(collectd.TYPE_TIME, 10) + part_values((collectd.DS_GAUGE, 1.0))
+    eq_([], collectd.parse_packet(p))
+
+def test_parse_packet_ignores_unknown_parts():
+    p = mkpacket(part_numeric(collectd.TYPE_TIME, 10),
+                 part_string(0x7fff, "foobar"),
+                 part_string(collectd.TYPE_PLUGIN, "foobar"),
+                 part_values((collectd.DS_GAUGE, 1.0)))
+    eq_([("gauge", "leela.foobar.foobar", 1.0, 10)], collectd.parse_packet(p))
+
+@raises(ValueError)
+def test_parse_packet_must_raise_on_invalid_part_size():
+    collectd.parse_packet(mkpacket(struct.pack(">2H", collectd.TYPE_PLUGIN, 0)))
+
+@raises(ValueError)
+def test_parse_packet_must_raise_on_truncated_values():
+    collectd.parse_packet(mkpacket(part_numeric(collectd.TYPE_TIME, 10), part_values((collectd.DS_GAUGE, 1.0))[:-1]))
+
+def test_parse_packet_caches_keys():
+    c = cache.LRU(10)
+    p = mkpacket(part_numeric(collectd.TYPE_TIME, 10),
+                 part_string(collectd.TYPE_PLUGIN, "foobar"),
+                 part_values((collectd.DS_GAUGE, 1.0)))
+    (m0,) = collectd.parse_packet(p, c)
+    (m1,) = collectd.parse_packet(p, c)
+    eq_((1, 1, 1), (c.hits, c.misses, len(c)))
+    ok_(m0[1] is m1[1])
+
+def test_parse_packet_caches_keys_by_plugin():
+    c = cache.LRU(10)
+    p = mkpacket(part_numeric(collectd.TYPE_TIME, 10),
+                 part_string(collectd.TYPE_PLUGIN, "foobar"),
+                 part_string(collectd.TYPE_TYPE, "foo"),
+                 part_values((collectd.DS_GAUGE, 1.0)),
+                 part_string(collectd.TYPE_TYPE, "bar"),
+                 part_values((collectd.DS_GAUGE, 1.0), (collectd.DS_GAUGE, 2.0)))
+    eq_(["leela.foobar.foobar.foo", "leela.foobar.foobar.bar.0", "leela.foobar.foobar.bar.1"],
+        [m[1] for m in collectd.parse_packet(p, c)])
+    eq_(1, len(c))
+
+def test_parse_packet_hits_the_cache_when_keys_outnumber_its_size():
+    # 200 hosts with 4 plugins of 8 types each: 6400 keys but only
+    # 800 plugins, which fit in the cache
+    c       = cache.LRU(1024)
+    packets = []
+    for h in range(200):
+        parts = [part_signature("leela"), part_string(collectd.TYPE_HOST, "host-%d" % h), part_numeric(collectd.TYPE_TIME, 10)]
+        for pi in range(4):
+            parts.append(part_string(collectd.TYPE_PLUGIN, "cpu"))
+            parts.append(part_string(collectd.TYPE_PLUGIN_INSTANCE, str(pi)))
+            for t in range(8):
+                parts.append(part_string(collectd.TYPE_TYPE, "cpu-%d" % t))
+                parts.append(part_values((collectd.DS_DERIVE, t)))
+        packets.append("".join(parts))
+    for p in packets:
+        collectd.parse_packet(p, c)
+    (hits, misses) = (c.hits, c.misses)
+    for p in packets:
+        collectd.parse_packet(p, c)
+    eq_(0, c.misses - misses)
+    ok_(float(c.hits - hits) / (200 * 4 * 8) > 0.99)
@@ -21,7 +21,9 @@ import random
 import mock
 import collections
 from nose.tools import *
+from leela.server import cache
 from leela.server.data import event
+from leela.server.data import data
 from leela.server.data import marshall
 
 def test_serialize_unserialize_is_identity():
@@ -33,3 +35,100 @@ def test_serialize_unserialize_is_identity():
     eq_(e.timestamp(), e1.timestamp())
     eq_(e.value(), e1.value())
 
+def test_unserialize_events_agrees_with_unserialize_event():
+    kvs = [(random.randint(0, 86400), random.random()) for _ in range(10)]
+    es  = marshall.unserialize_events("FooBar", kvs, epoch=1970)
+    for ((k, v), e) in zip(kvs, es):
+        e1 = marshall.unserialize_event("FooBar", k, v, epoch=1970)
+        eq_((e1.name(), e1.value(), e1.unixtimestamp(), e1.timestamp()), (e.name(), e.value(), e.unixtimestamp(), e.timestamp()))
+
+def test_unserialize_datas_parses_json():
+    (d,) = marshall.unserialize_datas("foobar", [(0, "{\"one\": 1}")], epoch=1970)
+    eq_(("data", {"one": 1}, 0), (d.kind(), d.value(), d.unixtimestamp()))
+
+def test_group_mutations_groups_by_row_and_column_family():
+    ms = [("cf0", "foo", 0, "a"), ("cf0", "foo", 1, "b"), ("cf1", "foo", 0, "c"), ("cf0", "bar", 0, "d")]
+    eq_([(ms, {"foo": {"cf0": {0: "a", 1: "b"}, "cf1": {0: "c"}}, "bar": {"cf0": {0: "d"}}})],
+        marshall.group_mutations(tuple, ms, 10, 10))
+
+def test_group_mutations_honors_maxcols():
+    ms = [("cf", "foo", k, k) for k in range(5)]
+    eq_([2, 2, 1], [len(g) for (g, _) in marshall.group_mutations(tuple, ms, 10, 2)])
+
+def test_group_mutations_honors_maxrows():
+    ms = [("cf", "foo", 0, 0), ("cf", "bar", 0, 0), ("cf", "foo", 1, 1), ("cf", "baz", 0, 0)]
+    eq_([(ms[:3], {"foo": {"cf": {0: 0, 1: 1}}, "bar": {"cf": {0: 0}}}),
+         (ms[3:], {"baz": {"cf": {0: 0}}})], marshall.group_mutations(tuple, ms, 2, 10))
+
+def test_group_mutations_preserves_every_column():
+    ms = [("cf%d" % random.randint(0, 2), "key%d" % random.randint(0, 9), k, k) for k in range(100)]
+    got = []
+    for (g, batch) in marshall.group_mutations(tuple, ms, 3, 7):
+        ok_(len(g) <= 7)
+        ok_(sum([len(cfs) for cfs in batch.values()]) <= 3)
+        for (key, cfs) in batch.items():
+            for (cf, cols) in cfs.items():
+                got.extend([(cf, key, c, v) for (c, v) in cols.items()])
+    eq_(sorted(ms), sorted(got))
+
+def test_group_mutations_with_no_mutations():
+    eq_([], marshall.group_mutations(tuple, [], 1, 1))
+
+@raises(ValueError)
+def test_group_mutations_must_raise_on_invalid_limits():
+    marshall.group_mutations(tuple, [], 0, 1)
+
+def test_catalog_entries_yields_key_and_bucket():
+    e = event.Event("foobar", 0, 1357000000)
+    eq_([(2013, 1, "event:foo", "foobar"), (2013, 1, "event/", "foo")],
+        list(marshall.catalog_entries([e], cache.LRU(10), 3)))
+
+def test_catalog_entries_skips_seen_keys():
+    seen = cache.LRU(10)
+    e0   = event.Event("foobar", 0, 1357000000)
+    e1   = event.Event("foobaz", 0, 1357000000)
+    list(marshall.catalog_entries([e0], seen, 3))
+    eq_([(2013, 1, "event:foo", "foobaz")], list(marshall.catalog_entries([e0, e1], seen, 3)))
+
+def test_catalog_entries_per_kind_and_month():
+    e0 = event.Event("foobar", 0, 1357000000)
+    e1 = event.Event("foobar", 0, 1357000000 + 31 * 86400)
+    e2 = data.Data("foobar", 0, 1357000000)
+    eq_(["event:foo", "event:foo", "data:foo"],
+        [row for (_, _, row, col) in marshall.catalog_entries([e0, e1, e2], cache.LRU(10), 3) if col == "foobar"])
+
+def test_catalog_entries_buckets_utf8_bytes():
+    e = event.Event(u"ação", 0, 1357000000)
+    eq_([(2013, 1, "event:a\xc3", "a\xc3\xa7\xc3\xa3o"), (2013, 1, "event/", "a\xc3")],
+        list(marshall.catalog_entries([e], cache.LRU(10), 2)))
+
+def test_catalog_name_normalizes_and_encodes():
+    eq_("foo", marshall.catalog_name(u"FOO"))
+    eq_("a\xc3\xa7", marshall.catalog_name(u"AÇ"))
+    ok_(isinstance(marshall.catalog_name(u"foo"), str))
+
+def test_encode_decode_value_is_identity():
+    for v in [None, True, 1, 2**70, 0.5, u"foobar", [], {u"foo": [1, 2.0, u"bar", None, False]}]:
+        eq_(v, marshall.decode_value(marshall.encode_value(v)))
+
+def test_encode_value_compresses_large_values():
+    v = {u"foobar": [u"foobar"] * 100}
+    s = marshall.encode_value(v)
+    eq_(marshall.VALUE_JSON_ZLIB, s[0])
+    ok_(len(s) < 256)
+    eq_(v, marshall.decode_value(s))
+
+def test_encode_value_does_not_compress_small_values():
+    eq_(marshall.VALUE_JSON + "{\"foo\":1}", marshall.encode_value({u"foo": 1}))
+
+def test_decode_value_reads_legacy_json():
+    eq_({u"one": [1, u"two"]}, marshall.decode_value("{\"one\": [1, \"two\"]}"))
+    eq_(u"foobar", marshall.decode_value("\"foobar\""))
+    eq_(-1, marshall.decode_value("-1"))
+
+def test_serialize_unserialize_data_is_identity():
+    d = data.Data("foobar", {u"foo": [u"bar", 1]}, random.randint(0, 86400))
+    (k, v) = marshall.serialize_data(d, epoch=1970)
+    d1 = marshall.unserialize_data("foobar", k, v, epoch=1970)
+    eq_(d.value(), d1.value())
+    eq_(d.unixtimestamp(), d1.unixtimestamp())
@@ -24,6 +24,8 @@ from nose.tools import *
 from leela.server.data import parser
 from leela.server.data import event
 from leela.server.data import data
+from leela.server.data import metric
+from leela.server.data import pp
 
 @raises(ValueError)
 def test_parse_string_raise_if_string_does_not_starts_with():
@@ -198,3 +200,159 @@ def test_parse_data__never_fails():
 def test_parse_status_return_leftover():
     x = random.randint(0, 10)
     eq_((x, "foobar"), parser.parse_status("status %d;foobar" % x))
+
+def test_parse_many_parses_events_and_data():
+    t  = random.randint(0, 86400)
+    v  = random.random()
+    s  = "event 6|foobar %s %d.0;data 6|foobaz 10|{\"one\": 1} %d.0;" % (repr(v), t, t)
+    (msgs, rejected) = parser.parse_many(s)
+    eq_(0, rejected)
+    eq_(2, len(msgs))
+    eq_(("event", "foobar", v, t), (msgs[0].kind(), msgs[0].name(), msgs[0].value(), msgs[0].unixtimestamp()))
+    eq_(("data", "foobaz", {"one": 1}, t), (msgs[1].kind(), msgs[1].name(), msgs[1].value(), msgs[1].unixtimestamp()))
+
+def test_parse_many_agrees_with_parse_event():
+    s = "".join(["event 6|foobar %s %s;" % (repr(random.random()), repr(random.random())) for _ in range(10)])
+    (msgs, _) = parser.parse_many(s)
+    for m in msgs:
+        (e, s) = parser.parse_event(s)
+        eq_((e.name(), e.value(), e.unixtimestamp()), (m.name(), m.value(), m.unixtimestamp()))
+    eq_("", s)
+
+def test_parse_many_honors_name_length():
+    (msgs, rejected) = parser.parse_many("event 7|foo;bar 1.0 0.0;")
+    eq_(0, rejected)
+    eq_("foo;bar", msgs[0].name())
+
+def test_parse_many_skips_malformed_messages():
+    (msgs, rejected) = parser.parse_many("foobar;event 6|foobar 1.0 0.0;event 9|foobar 1.0 0.0;event 6|foobar 1.0 0.0;")
+    eq_(2, len(msgs))
+    eq_(2, rejected)
+
+def test_parse_many_rejects_truncated_messages():
+    (msgs, rejected) = parser.parse_many("event 6|foobar 1.0 0.0;event 6|foobar 1.0")
+    eq_(1, len(msgs))
+    eq_(1, rejected)
+
+def test_parse_many_accepts_nan_and_inf():
+    (msgs, _) = parser.parse_many("event 6|foobar nan 0.0;event 6|foobar -inf 0.0;")
+    ok_(math.isnan(msgs[0].value()))
+    ok_(math.isinf(msgs[1].value()))
+
+def test_parse_many_with_empty_string():
+    eq_(([], 0), parser.parse_many(""))
+
+def test_parse_metric():
+    for (kind, clazz) in [("gauge", metric.Gauge), ("counter", metric.Counter), ("derive", metric.Derive), ("absolute", metric.Absolute)]:
+        v = random.random()
+        (m, s) = parser.parse_metric("%s 6|foobar %s 10.0;" % (kind, repr(v)))
+        ok_(isinstance(m, clazz))
+        eq_(("foobar", v, 10.0), (m.key, m.val, m.time))
+        eq_("", s)
+
+def test_parse_metric_is_the_inverse_of_render_metric():
+    m0 = metric.Gauge("foobar", random.random(), float(random.randint(0, 86400)))
+    (m1, _) = parser.parse_metric(pp.render_metric(m0))
+    eq_((m0.type(), m0.key, m0.val, m0.time), (m1.type(), m1.key, m1.val, m1.time))
+
+def test_parse_metric_returns_leftover():
+    eq_("foobar", parser.parse_metric("gauge 6|foobar 1.0 0.0;foobar")[1])
+
+@raises(ValueError)
+def test_parse_metric_must_raise_on_error():
+    parser.parse_metric("gauge 6|foobar 1.0 0;")
+
+def test_parse_metric__never_fails():
+    eq_((None, ""), parser.parse_metric_("foobar"))
+
+def test_parse_metrics_counts_rejected_messages():
+    (ms, rejected) = parser.parse_metrics("gauge 6|foobar 1.0 0.0;gauge 6|foobar x 0.0;foobar;counter 7|foo;bar 1.0 0.0;")
+    eq_(["foobar", "foo;bar"], [m.key for m in ms])
+    eq_(2, rejected)
+
+def test_scan_metrics_yields_raw_messages():
+    s = "gauge 6|foobar 1.0 0.0;\ngauge 6|foobar nan 0.0;foobar; derive 6|foobar -inf 0.0;\n"
+    eq_(["gauge 6|foobar 1.0 0.0;", "gauge 6|foobar nan 0.0;", "foobar;", "derive 6|foobar -inf 0.0;"],
+        [msg for (_, msg) in parser.scan_metrics(s)])
+
+def test_scan_metrics_rejects_truncated_messages():
+    eq_([None], [m for (m, _) in parser.scan_metrics("gauge 6|foobar 1.0")])
+
+def test_parse_frames_tells_malformed_from_truncated_messages():
+    (msgs, malformed, truncated) = parser.parse_frames("event 6|foobar x 0.0;foobar;event 6|foobar 1.0 0.0;event 6|foo")
+    eq_(1, len(msgs))
+    eq_(2, malformed)
+    eq_(1, truncated)
+
+def test_split_keys_honors_length_prefixes():
+    s = "event 7|foo;bar 1.0 0.0;data 6|foobar 12|{\"a\": \";;\"} 0.0;"
+    (frames, malformed, truncated) = parser.split_keys(s)
+    eq_(["event 7|foo;bar 1.0 0.0;", "data 6|foobar 12|{\"a\": \";;\"} 0.0;"], [f for (_, f) in frames])
+    eq_((0, 0), (malformed, truncated))
+
+def test_split_keys_counts_malformed_and_truncated_messages():
+    (frames, malformed, truncated) = parser.split_keys("event foobar;event 6|foobar 1.0 0.0;event 6|foobar 1.0")
+    eq_(["event 6|foobar 1.0 0.0;"], [f for (_, f) in frames])
+    eq_((1, 1), (malformed, truncated))
+
+def test_split_keys_agrees_with_parse_many():
+    s = "".join(["event 6|foobar %s %s;" % (repr(random.random()), repr(random.random())) for _ in range(10)])
+    (frames, _, _) = parser.split_keys(s)
+    eq_(map(lambda f: parser.parse_event(f[1])[0].value(), frames),
+        map(lambda e: e.value(), parser.parse_many(s)[0]))
+
+def test_parse_many_accepts_binary_messages():
+    t  = random.random() * 86400
+    v  = random.random()
+    s  = pp.render_event_binary(event.Event("foobar", v, t)) + pp.render_data_binary(data.Data("foobaz", {"one": 1}, t))
+    (msgs, rejected) = parser.parse_many(s)
+    eq_(0, rejected)
+    eq_(("event", "foobar", v, t), (msgs[0].kind(), msgs[0].name(), msgs[0].value(), msgs[0].unixtimestamp()))
+    eq_(("data", "foobaz", {"one": 1}, t), (msgs[1].kind(), msgs[1].name(), msgs[1].value(), msgs[1].unixtimestamp()))
+
+def test_parse_many_accepts_mixed_encodings():
+    e = event.Event("foo;bar", 1.0, 0)
+    s = pp.render_event(e) + pp.render_event_binary(e) + pp.render_data_binary(data.Data("foobar", ";", 0)) + pp.render_event(e)
+    (msgs, rejected) = parser.parse_many(s)
+    eq_(0, rejected)
+    eq_(["foo;bar", "foo;bar", "foobar", "foo;bar"], [m.name() for m in msgs])
+
+def test_parse_frames_detects_truncated_binary_messages():
+    e = pp.render_event_binary(event.Event("foobar", 1.0, 0))
+    (msgs, malformed, truncated) = parser.parse_frames(e + e[:-1])
+    eq_(1, len(msgs))
+    eq_((0, 1), (malformed, truncated))
+
+def test_split_keys_splits_binary_messages():
+    e = pp.render_event_binary(event.Event("foobar", 1.0, 0))
+    d = pp.render_data_binary(data.Data("foobar", {"a": ";"}, 0))
+    (frames, malformed, truncated) = parser.split_keys(e + d + d[:-1])
+    eq_([e, d], [f for (_, f) in frames])
+    eq_((0, 1), (malformed, truncated))
+
+def test_split_keys_returns_the_name_of_each_message():
+    e = pp.render_event_binary(event.Event("foo", 1.0, 0))
+    s = "gauge 7|foo;bar 1.0 0.0;data 6|foobar 12|{\"a\": \";;\"} 0.0;" + e
+    (frames, malformed, truncated) = parser.split_keys(s + "event 6|foo")
+    eq_([("foo;bar", "gauge 7|foo;bar 1.0 0.0;"), ("foobar", "data 6|foobar 12|{\"a\": \";;\"} 0.0;"), ("foo", e)], frames)
+    eq_((0, 1), (malformed, truncated))
+
+def test_parse_json_multi():
+    eq_((["foo", "bar"], (2013, 1, 2, 3, 4), (2013, 2, 3, 4, 5)),
+        parser.parse_json_multi('{"keys": ["foo", "bar", "foo"], "start": "20130102T0304", "finish": "20130203T0405"}'))
+
+@raises(ValueError)
+def test_parse_json_multi_requires_keys():
+    parser.parse_json_multi('{"keys": [], "start": "20130102T0304", "finish": "20130203T0405"}')
+
+@raises(ValueError)
+def test_parse_json_multi_rejects_non_string_keys():
+    parser.parse_json_multi('{"keys": [1], "start": "20130102T0304", "finish": "20130203T0405"}')
+
+@raises(ValueError)
+def test_parse_json_multi_limits_the_number_of_keys():
+    parser.parse_json_multi('{"keys": ["foo", "bar"], "start": "20130102T0304", "finish": "20130203T0405"}', 1)
+
+@raises(KeyError)
+def test_parse_json_multi_requires_a_range():
+    parser.parse_json_multi('{"keys": ["foo"]}')
@@ -56,3 +56,28 @@ def test_render_storables():
     es = 10 * (event.Event("foobar", v, t),) + 5 * (data.Data("foobaz", [v], t), )
     eq_("".join(map(pp.render_storable, es)), pp.render_storables(es))
 
+
+def test_render_event_binary_is_smaller_than_text():
+    e = event.Event("foobar", random.random(), random.randint(0, 86400))
+    ok_(len(pp.render_event_binary(e)) < len(pp.render_event(e)))
+
+def test_render_storables_binary():
+    t  = random.randint(0, 10)
+    v  = random.random()
+    es = 10 * (event.Event("foobar", v, t),) + 5 * (data.Data("foobaz", [v], t), )
+    eq_("".join(map(pp.render_storable_binary, es)), pp.render_storables_binary(es))
+
+def test_storable_renderer():
+    eq_(pp.render_storable, pp.storable_renderer("text"))
+    eq_(pp.render_storable_binary, pp.storable_renderer("binary"))
+
+@raises(ValueError)
+def test_storable_renderer_must_raise_on_unknown_encodings():
+    pp.storable_renderer("foobar")
+
+def test_render_metric_tuple():
+    eq_("derive 6|foobar 1.0 10.0;", pp.render_metric_tuple(("derive", "foobar", 1, 10)))
+
+def test_render_metric_tuples():
+    ms = 10 * [("gauge", "foobar", random.random(), random.randint(0, 10))]
+    eq_("".join(map(pp.render_metric_tuple, ms)), pp.render_metric_tuples(ms))
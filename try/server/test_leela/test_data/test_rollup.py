@@ -0,0 +1,95 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+from nose.tools import *
+from leela.server.data import event
+from leela.server.data import rollup
+
+def test_plan_uses_raw_events_when_possible():
+    eq_(None, rollup.plan(0, 86400, 1441))
+
+def test_plan_picks_the_finest_resolution_that_fits():
+    eq_(300, rollup.plan(0, 86400, 1000))
+    eq_(3600, rollup.plan(0, 7 * 86400, 1000))
+    eq_(86400, rollup.plan(0, 365 * 86400, 1000))
+
+def test_plan_falls_back_to_the_coarsest_resolution():
+    eq_(86400, rollup.plan(0, 365 * 86400, 10))
+
+@raises(ValueError)
+def test_plan_requires_positive_maxpoints():
+    rollup.plan(0, 1, 0)
+
+def test_aggregate():
+    a = (1.0, 3.0, 6.0, 3)
+    eq_([1.0, 3.0, 6.0, 3, 2.0], [rollup.aggregate(n)(a) for n in ["min", "max", "sum", "count", "mean"]])
+
+@raises(ValueError)
+def test_aggregate_rejects_unknown_names():
+    rollup.aggregate("foobar")
+
+def test_rollup_accumulates_per_resolution():
+    r = rollup.Rollup(100, (300, 3600))
+    r.update([event.Event("foo", 1.0, 3600), event.Event("foo", 3.0, 3660), event.Event("foo", 2.0, 3900)])
+    eq_([("foo", 300, 3600, (1.0, 3.0, 4.0, 2), False),
+         ("foo", 300, 3900, (2.0, 2.0, 2.0, 1), False),
+         ("foo", 3600, 3600, (1.0, 3.0, 6.0, 3), False)], sorted(r.flush()))
+
+def test_rollup_flush_returns_dirty_buckets_only():
+    r = rollup.Rollup(100, (300,))
+    r.update([event.Event("foo", 1.0, 0), event.Event("bar", 1.0, 0)])
+    r.flush()
+    r.update([event.Event("foo", 2.0, 60)])
+    eq_([("foo", 300, 0, (1.0, 2.0, 3.0, 2), False)], r.flush())
+    eq_([], r.flush())
+
+def test_rollup_ignores_nan_and_inf():
+    r = rollup.Rollup(100, (300,))
+    r.update([event.Event("foo", float("nan"), 0), event.Event("foo", float("inf"), 0)])
+    eq_([], r.flush())
+
+def test_combine():
+    eq_((0.0, 3.0, 6.0, 4), rollup.combine((1.0, 3.0, 4.0, 2), (0.0, 2.0, 2.0, 2)))
+
+def test_downsample_aggregates_per_bucket():
+    events = [event.Event("foo", float(k), k * 60) for k in range(10)]
+    r      = rollup.downsample(events, 300, rollup.aggregate("max"))
+    eq_([(0, 4.0), (300, 9.0)], [(e.unixtimestamp(), e.value()) for e in r])
+    eq_(["foo", "foo"], [e.name() for e in r])
+
+def test_downsample_skips_nan():
+    r = rollup.downsample([event.Event("foo", float("nan"), 0), event.Event("foo", 1.0, 60)], 300, rollup.aggregate("count"))
+    eq_([1], [e.value() for e in r])
+
+def test_merge_combines_stored_buckets_once():
+    r = rollup.Rollup(100, (300,))
+    r.update([event.Event("foo", 1.0, 0), event.Event("bar", 1.0, 0)])
+    buckets = r.flush()
+    merged  = r.merge(buckets, {("foo", 300, 0): (0.0, 5.0, 10.0, 4)})
+    eq_([("bar", 300, 0, (1.0, 1.0, 1.0, 1), True),
+         ("foo", 300, 0, (0.0, 5.0, 11.0, 5), True)], sorted(merged))
+    r.update([event.Event("foo", 2.0, 60)])
+    eq_([("foo", 300, 0, (0.0, 5.0, 13.0, 6), True)], r.flush())
+
+def test_retry_makes_buckets_dirty_again():
+    r = rollup.Rollup(1, (300,))
+    r.update([event.Event("foo", 1.0, 0), event.Event("bar", 2.0, 0)])
+    buckets = sorted(r.flush())
+    r.retry(buckets)
+    eq_(buckets, sorted(r.flush()))
@@ -163,3 +163,20 @@ def test_set_time_with_the_year_component(clazz, kind):
     e.set_time((n, e.month(), e.day(), e.hour(), e.minute(), e.second()))
     eq_(o[1:], e.timestamp()[1:])
     eq_(n, e.year())
+
+@dataprovider((event.Event, "event"), (data.Data, "data"))
+def test_storable_has_no_dict(clazz, _):
+    ok_(not hasattr(clazz("foobar", 0, 0), "__dict__"))
+
+@dataprovider((event.Event, "event"), (data.Data, "data"))
+def test_make_many_normalizes_name(clazz, kind):
+    es = clazz.make_many("FooBar", [(0, 0), (1, 60)])
+    eq_([("foobar", 0, 0), ("foobar", 1, 60)], [(e.name(), e.value(), e.unixtimestamp()) for e in es])
+    eq_([kind, kind], [e.kind() for e in es])
+
+@dataprovider((event.Event, "event"), (data.Data, "data"))
+def test_set_unixtimestamp_updates_calendar_fields(clazz, _):
+    e = clazz("foobar", 0, 0)
+    eq_(1970, e.year())
+    e.set_unixtimestamp(3661)
+    eq_(storable.Timestamp._make((1970, 1, 1, 1, 1, 1)), e.timestamp())
@@ -0,0 +1,335 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import os
+import errno
+import socket
+import shutil
+import tempfile
+from nose.tools import *
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.internet import reactor
+from leela.server.data import event
+from leela.server.network import databus
+
+def test_shard_of_is_stable_and_in_range():
+    keys = ["foobar.%d" % k for k in range(1000)]
+    eq_(map(lambda k: databus.shard_of(k, 4), keys), map(lambda k: databus.shard_of(k, 4), keys))
+    eq_([0, 1, 2, 3], sorted(set(map(lambda k: databus.shard_of(k, 4), keys))))
+
+def test_shard_of_moves_few_keys_when_a_shard_is_added():
+    keys  = ["foobar.%d" % k for k in range(1000)]
+    moved = [k for k in keys if databus.shard_of(k, 4) != databus.shard_of(k, 5)]
+    ok_(all(databus.shard_of(k, 5) == 4 for k in moved))
+    ok_(len(moved) < 300)
+
+class TestRelay(object):
+
+    def setUp(self):
+        self.dir  = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "databus")
+        self.peer = None
+
+    def tearDown(self):
+        if (self.peer is not None):
+            self.peer.close()
+        shutil.rmtree(self.dir)
+
+    def listen(self):
+        self.peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        self.peer.bind(self.path)
+        self.peer.setblocking(False)
+
+    def recv(self):
+        packets = []
+        try:
+            while True:
+                packets.append(self.peer.recv(databus.MAXDGRAM))
+        except socket.error:
+            return(packets)
+
+    def mkrelay(self, maxsize=databus.MAXDGRAM):
+        return(databus.Relay(self.path, maxsize=maxsize))
+
+    def cancel(self, relay):
+        if (relay.timer is not None):
+            relay.timer.cancel()
+            relay.timer = None
+
+    def test_relay_sends_right_away(self):
+        self.listen()
+        relay = self.mkrelay()
+        relay.relay("foo;")
+        relay.relay("bar;")
+        eq_(["foo;", "bar;"], self.recv())
+        eq_(0, len(relay.queue))
+        eq_(0, relay.qbytes)
+        eq_(2, relay.packages)
+        eq_(8, relay.bytes)
+
+    def test_relay_queues_while_peer_is_gone(self):
+        relay = self.mkrelay()
+        relay.relay("foo;")
+        relay.relay("bar;")
+        ok_(relay.waiting())
+        eq_(2, len(relay.queue))
+        eq_(8, relay.qbytes)
+        self.cancel(relay)
+
+    def test_drain_packs_queued_packets_up_to_maxsize(self):
+        relay = self.mkrelay(maxsize=8)
+        for p in ["foo;", "bar;", "baz;", "foobar;"]:
+            relay.relay(p)
+        self.cancel(relay)
+        self.listen()
+        relay.drain()
+        eq_(["foo;bar;", "baz;", "foobar;"], self.recv())
+        eq_(0, relay.qbytes)
+        eq_(4, relay.packages)
+
+    def test_drain_sends_large_packets_alone(self):
+        relay = self.mkrelay(maxsize=4)
+        relay.relay("foobar;")
+        relay.relay("foo;")
+        self.cancel(relay)
+        self.listen()
+        relay.drain()
+        eq_(["foobar;", "foo;"], self.recv())
+
+    def test_backoff_doubles_until_the_peer_comes_back(self):
+        relay = self.mkrelay()
+        relay.relay("foo;")
+        eq_(databus.MINDELAY * 2, relay.delay)
+        self.cancel(relay)
+        relay.drain()
+        eq_(databus.MINDELAY * 4, relay.delay)
+        self.cancel(relay)
+        self.listen()
+        relay.drain()
+        eq_(databus.MINDELAY, relay.delay)
+        eq_(["foo;"], self.recv())
+
+    def test_relay_drops_packets_when_the_queue_is_full(self):
+        relay = self.mkrelay()
+        for _ in range(databus.MAXQUEUE + 1):
+            relay.enqueue("x")
+        eq_(databus.MAXQUEUE, len(relay.queue))
+        eq_(1, relay.dropped)
+
+    def test_sharded_relay_routes_by_name(self):
+        self.listen()
+        path  = self.path + ".1"
+        peer  = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        peer.bind(path)
+        relay = databus.ShardedRelay([self.path, path])
+        keys  = ["foobar.%d" % k for k in range(20)]
+        relay.relay("".join(["event %d|%s 1.0 0.0;" % (len(k), k) for k in keys]) + "event foobar;")
+        packet = "".join(self.recv())
+        eq_(1, relay.malformed)
+        for k in keys:
+            ok_((("|%s " % k) in packet) == (databus.shard_of(k, 2) == 0))
+        peer.close()
+
+    def test_sharded_relay_isolates_shards_that_are_down(self):
+        self.listen()
+        relay = databus.ShardedRelay([self.path, self.path + ".1"])
+        keys  = ["foobar.%d" % k for k in range(20)]
+        relay.relay("".join(["event %d|%s 1.0 0.0;" % (len(k), k) for k in keys]))
+        ok_(not relay.shards[0].waiting())
+        ok_(relay.shards[1].waiting())
+        eq_(0, len(relay.shards[0].queue))
+        self.cancel(relay.shards[1])
+
+class TestDatabus(object):
+
+    def setUp(self):
+        self.dir  = tempfile.mkdtemp()
+        self.peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        self.peer.bind(os.path.join(self.dir, "peer"))
+        self.peer.setblocking(False)
+        self.dbus = None
+
+    def tearDown(self):
+        if (self.dbus is not None):
+            if (self.dbus.relay.writing):
+                reactor.removeWriter(self.dbus.relay)
+            self.dbus.relay.close()
+            self.dbus.transport.stopListening()
+        self.peer.close()
+        shutil.rmtree(self.dir)
+
+    def listen(self, **kwargs):
+        # a databus on a port registered with the reactor
+        self.dbus = databus.listen_from(os.path.join(self.dir, "databus"), peer=os.path.join(self.dir, "peer"), **kwargs)
+        return(self.dbus)
+
+    def fill(self):
+        # until the peer can take no more datagrams
+        fd = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        fd.connect(os.path.join(self.dir, "peer"))
+        try:
+            while True:
+                fd.send("x", socket.MSG_DONTWAIT)
+        except socket.error, se:
+            eq_(errno.EAGAIN, se.args[0])
+        fd.close()
+
+    def recv(self):
+        packets = []
+        try:
+            while True:
+                packets.append(self.peer.recv(databus.MAXDGRAM))
+        except socket.error:
+            return([p for p in packets if p != "x"])
+
+    def test_send_broadcast_packs_events(self):
+        dbus = self.listen()
+        dbus.send_broadcast([event.Event("foo", 1.0, 0), event.Event("bar", 2.0, 0)])
+        eq_(["event 3|foo 1.0 0.0;event 3|bar 2.0 0.0;"], self.recv())
+        eq_((0, 2), (dbus.depth(), dbus.relay.packages))
+
+    def test_send_broadcast_waits_for_the_peer_on_eagain(self):
+        dbus = self.listen()
+        self.fill()
+        dbus.send_broadcast([event.Event("foo", 1.0, 0)])
+        dbus.send_broadcast([event.Event("bar", 2.0, 0)])
+        ok_(dbus.relay.writing)
+        eq_((2, 0), (dbus.depth(), dbus.relay.packages))
+        eq_([], self.recv())
+        dbus.relay.doWrite()
+        eq_(["event 3|foo 1.0 0.0;event 3|bar 2.0 0.0;"], self.recv())
+        eq_(0, dbus.depth())
+        ok_(not dbus.relay.writing)
+
+    def test_the_port_keeps_reading_while_a_broadcast_waits(self):
+        dbus = self.listen()
+        self.fill()
+        dbus.send_broadcast([event.Event("foo", 1.0, 0)])
+        ok_(dbus.transport in reactor.getReaders())
+        ok_(dbus.relay in reactor.getWriters())
+        dbus.attach("foo", Consumer())
+        fd = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM, 0)
+        fd.sendto("event 3|bar 1.0 0.0;", os.path.join(self.dir, "databus"))
+        fd.close()
+        dbus.transport.doRead()
+        eq_(["bar"], [e.name() for e in dbus.detach("foo")])
+
+    def test_send_broadcast_drops_the_oldest_events(self):
+        dbus = self.listen(maxqueue=2)
+        self.fill()
+        dbus.send_broadcast([event.Event(k, 1.0, 0) for k in ["foo", "bar", "baz"]])
+        self.recv()
+        dbus.relay.doWrite()
+        eq_(["event 3|bar 1.0 0.0;event 3|baz 1.0 0.0;"], self.recv())
+        eq_(1, dbus.relay.dropped)
+
+    def test_send_broadcast_drops_the_newest_events(self):
+        dbus = self.listen(maxqueue=2, overflow=databus.DROP_NEWEST)
+        self.fill()
+        dbus.send_broadcast([event.Event(k, 1.0, 0) for k in ["foo", "bar", "baz"]])
+        self.recv()
+        dbus.relay.doWrite()
+        eq_(["event 3|foo 1.0 0.0;event 3|bar 1.0 0.0;"], self.recv())
+        eq_(1, dbus.relay.dropped)
+
+@raises(RuntimeError)
+def test_send_broadcast_requires_a_peer():
+    databus.Databus(lambda _: None).send_broadcast([event.Event("foo", 1.0, 0)])
+
+@raises(ValueError)
+def test_databus_rejects_unknown_overflow_policies():
+    databus.Databus(lambda _: None, overflow="foobar")
+
+class Consumer(object):
+
+    def __init__(self, result=None):
+        self.batches = []
+        self.result  = result
+
+    def recv_broadcast(self, msgs):
+        self.batches.append(msgs)
+        return(self.result)
+
+def test_subscriber_delivers_from_the_reactor_loop():
+    clock = task.Clock()
+    cc    = Consumer()
+    sub   = databus.Subscriber(cc, clock=clock)
+    sub.push([1, 2])
+    sub.push([3])
+    eq_([], cc.batches)
+    clock.advance(0)
+    eq_([[1, 2, 3]], cc.batches)
+    eq_({"lag": 0, "delivered": 3, "dropped": 0}, sub.stats())
+
+def test_subscriber_delivers_in_batches():
+    clock = task.Clock()
+    cc    = Consumer()
+    sub   = databus.Subscriber(cc, batch=2, clock=clock)
+    sub.push([1, 2, 3, 4, 5])
+    clock.advance(0)
+    eq_([[1, 2], [3, 4], [5]], cc.batches)
+
+def test_subscriber_drops_its_oldest_messages():
+    clock = task.Clock()
+    cc    = Consumer()
+    sub   = databus.Subscriber(cc, backlog=3, clock=clock)
+    sub.push([1, 2])
+    sub.push([3, 4, 5])
+    clock.advance(0)
+    eq_([[3, 4, 5]], cc.batches)
+    eq_(2, sub.dropped)
+
+def test_subscriber_waits_for_deferreds():
+    clock = task.Clock()
+    d     = defer.Deferred()
+    cc    = Consumer(d)
+    sub   = databus.Subscriber(cc, batch=1, clock=clock)
+    sub.push([1, 2])
+    clock.advance(0)
+    eq_([[1]], cc.batches)
+    cc.result = None
+    d.callback(None)
+    clock.advance(0)
+    eq_([[1], [2]], cc.batches)
+
+def test_slow_subscribers_do_not_hold_others_back():
+    clock = task.Clock()
+    slow  = databus.Subscriber(Consumer(defer.Deferred()), batch=1, clock=clock)
+    fast  = databus.Subscriber(Consumer(), batch=1, clock=clock)
+    for sub in [slow, fast]:
+        sub.push([1, 2, 3])
+    clock.advance(0)
+    eq_((2, 0), (slow.lag(), fast.lag()))
+
+def test_detach_returns_undelivered_messages():
+    dbus = databus.Databus(lambda _: None)
+    dbus.attach("foo", Consumer())
+    dbus.datagramReceived("event 3|foo 1.0 0.0;")
+    eq_({"foo": {"lag": 1, "delivered": 0, "dropped": 0}}, dbus.stats())
+    eq_(["foo"], [e.name() for e in dbus.detach("foo")])
+    eq_({}, dbus.stats())
+
+def test_sum_counters_adds_up_by_name():
+    eq_({"foo": ("derive", 3), "bar": ("gauge", 1)},
+        databus.sum_counters([{"foo": ("derive", 1)}, {"foo": ("derive", 2), "bar": ("gauge", 1)}]))
+
+def test_mkmetrics_uses_the_counter_types():
+    ms = databus.mkmetrics("leela", {"foo": ("derive", 1), "bar": ("gauge", 2)}, 0)
+    eq_([("gauge", "leela.bar", 2), ("derive", "leela.foo", 1)], [(m.type(), m.key, m.val) for m in ms])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import ConfigParser
+from nose.tools import *
+from twisted.python import failure
+from leela.server import timeutil
+from leela.server.data import event
+from leela.server.data import excepts
+from leela.server.network import http_proto
+from leela.server.network import storage_proto
+
+def mkfailure(e):
+    try:
+        raise(e)
+    except:
+        return(failure.Failure())
+
+def test_render_multi_renders_each_series():
+    r = http_proto.render_multi({"foo": [event.Event("foo", 1.0, 60)], "bar": [event.Event("bar", 2.0, 120)]})
+    eq_({"foo": {"series": [[60, 1.0]]}, "bar": {"series": [[120, 2.0]]}}, r)
+
+def test_render_multi_reports_missing_keys():
+    eq_({"foo": {"status": 404, "reason": "Not Found"}}, http_proto.render_multi({"foo": []}))
+
+def test_render_multi_reports_purged_series_as_missing():
+    r = http_proto.render_multi({"foo": [event.Event("foo", float("nan"), 60)]}, http_proto.NAN_PURGE)
+    eq_({"foo": {"status": 404, "reason": "Not Found"}}, r)
+
+def test_load_multi_renders_keys_without_data_as_missing():
+    cfg = ConfigParser.ConfigParser()
+    cfg.add_section("cassandra")
+    cfg.set("cassandra", "backend", "sqlite")
+    storage = storage_proto.connect(cfg)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    for (_, batch) in storage.batches([event.Event("foo", float(k), t0 + k * 60) for k in range(3)]):
+        storage.batch_mutate(batch)
+    r = []
+    event.Event.load_multi(storage, ["foo", "bar"], 2013, 1, 1, 0, 0, 2013, 1, 1, 0, 59)\
+        .addCallback(http_proto.render_multi)\
+        .addBoth(r.append)
+    eq_({"foo": {"series": [[t0, 0.0], [t0 + 60, 1.0], [t0 + 120, 2.0]]},
+         "bar": {"status": 404, "reason": "Not Found"}}, r[0])
+
+def test_render_multi_reports_failures_per_key():
+    r = http_proto.render_multi({"foo": mkfailure(RuntimeError()),
+                                 "bar": mkfailure(excepts.NotFoundExcept()),
+                                 "baz": [event.Event("baz", 1.0, 60)]})
+    eq_({"status": 500, "reason": "Internal Server Error"}, r["foo"])
+    eq_({"status": 404, "reason": "Not Found"}, r["bar"])
+    eq_({"series": [[60, 1.0]]}, r["baz"])
+
+def test_render_multi_purges_nan():
+    r = http_proto.render_multi({"foo": [event.Event("foo", float("nan"), 60), event.Event("foo", 1.0, 120)]}, http_proto.NAN_PURGE)
+    eq_({"foo": {"series": [[120, 1.0]]}}, r)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import ConfigParser
+from nose.tools import *
+from leela.server import cache
+from leela.server import timeutil
+from leela.server.data import event
+from leela.server.data import data
+from leela.server.data import rollup
+from leela.server.network import storage_proto
+from leela.server.network import sqlite_proto
+
+def mkstorage(slices=None, **opts):
+    cfg = ConfigParser.ConfigParser()
+    cfg.add_section("cassandra")
+    cfg.set("cassandra", "backend", "sqlite")
+    for (k, v) in opts.iteritems():
+        cfg.set("cassandra", k, str(v))
+    return(storage_proto.connect(cfg, slices))
+
+def result(d):
+    r = []
+    d.addBoth(r.append)
+    return(r[0])
+
+def write(storage, objects):
+    for (_, batch) in storage.batches(objects):
+        result(storage.batch_mutate(batch))
+    for (_, batch) in storage.catalog_batches(objects, cache.LRU(1024)):
+        result(storage.batch_mutate(batch))
+
+def test_connect_selects_the_backend():
+    ok_(isinstance(mkstorage(), sqlite_proto.SqliteProto))
+
+@raises(ValueError)
+def test_connect_rejects_unknown_backends():
+    cfg = ConfigParser.ConfigParser()
+    cfg.add_section("cassandra")
+    cfg.set("cassandra", "backend", "foobar")
+    storage_proto.connect(cfg)
+
+def test_get_slice_is_newest_first():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event("foo", float(k), t0 + k * 60) for k in range(10)])
+    (cf, k0, k1, _) = storage.slice_of(event.Event.kind(), t0, t0 + 3600)
+    cols = result(storage.get_slice(key="foo", column_family=cf, start=k1, finish=k0, count=3))
+    eq_([9.0, 8.0, 7.0], [e.value() for e in storage_proto.unserialize_event("foo", cols)])
+
+def test_load_spans_months_in_order():
+    storage = mkstorage(page_size=4)
+    t0      = timeutil.timegm(2013, 1, 31, 23, 50, 0)
+    write(storage, [event.Event("foo", float(k), t0 + k * 60) for k in range(20)])
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 3600), 100))
+    eq_(range(20), [int(e.value()) for e in events])
+    eq_(range(t0, t0 + 20 * 60, 60), [e.unixtimestamp() for e in events])
+
+def test_load_honors_limit():
+    storage = mkstorage(page_size=4)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event("foo", float(k), t0 + k * 60) for k in range(20)])
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 3600), 5))
+    eq_(range(15, 20), [int(e.value()) for e in events])
+
+def test_load_reads_data():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [data.Data("foo", {"k": 1}, t0)])
+    events  = result(storage.load(data.Data.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 60), 10))
+    eq_([{"k": 1}], [e.value() for e in events])
+
+def test_load_multi_returns_each_key():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event(k, 1.0, t0) for k in ["foo", "bar"]])
+    r = result(storage.load_multi(event.Event.kind(), ["foo", "bar", "baz"], timeutil.gmtime(t0), timeutil.gmtime(t0 + 60)))
+    eq_(["bar", "baz", "foo"], sorted(r.keys()))
+    eq_([], r["baz"])
+    eq_([1.0], [e.value() for e in r["foo"]])
+
+def test_list_keys_is_ordered_and_paged():
+    storage = mkstorage(catalog_bucket=2)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event(k, 1.0, t0) for k in ["foo.c", "foo.a", "bar", "foo.b"]])
+    (keys, cursor) = result(storage.list_keys(event.Event.kind(), 2013, 1, "foo", None, 2))
+    eq_(["foo.a", "foo.b"], keys)
+    eq_((["foo.c"], None), result(storage.list_keys(event.Event.kind(), 2013, 1, "foo", cursor, 2)))
+
+def test_list_keys_normalizes_the_prefix():
+    storage = mkstorage(catalog_bucket=2)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event(k, 1.0, t0) for k in ["Foo.a", "foo.b"]])
+    eq_((["foo.a", "foo.b"], None), result(storage.list_keys(event.Event.kind(), 2013, 1, u"FOO", None, 10)))
+
+def test_list_keys_accepts_non_ascii_prefixes():
+    storage = mkstorage(catalog_bucket=2)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event(k, 1.0, t0) for k in [u"ação.a", u"ação.b", u"acao.c", "foo"]])
+    (keys, cursor) = result(storage.list_keys(event.Event.kind(), 2013, 1, u"açã", None, 1))
+    eq_([u"ação.a".encode("utf8")], keys)
+    eq_(([u"ação.b".encode("utf8")], None), result(storage.list_keys(event.Event.kind(), 2013, 1, u"açã", cursor.decode("utf8"), 10)))
+    eq_(([u"ação.a".encode("utf8"), u"ação.b".encode("utf8")], None), result(storage.list_keys(event.Event.kind(), 2013, 1, u"aç", None, 10)))
+
+def write_rollups(storage, buckets):
+    for (_, batch) in storage.rollup_batches(buckets):
+        result(storage.batch_mutate(batch))
+
+def test_load_rollups_returns_stored_buckets():
+    storage = mkstorage(multiget_keys=1)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write_rollups(storage, [("foo", 300, t0, (1.0, 2.0, 3.0, 2)), ("bar", 3600, t0, (4.0, 4.0, 4.0, 1))])
+    r = result(storage.load_rollups([("foo", 300, t0, None, False),
+                                     ("bar", 3600, t0, None, False),
+                                     ("baz", 300, t0, None, False),
+                                     ("foo", 300, t0 + 300, None, False)]))
+    eq_({("foo", 300, t0): (1.0, 2.0, 3.0, 2), ("bar", 3600, t0): (4.0, 4.0, 4.0, 1)}, r)
+
+def test_load_reads_rollups_when_maxpoints_is_given():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write_rollups(storage, [("foo", 3600, t0 + h * 3600, (0.0, float(h), 2.0 * h, 2)) for h in range(4)])
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 4 * 3600 - 1), 100, 5, "mean"))
+    eq_([(t0 + h * 3600, float(h)) for h in range(4)], [(e.unixtimestamp(), e.value()) for e in events])
+
+def test_load_falls_back_to_raw_events_before_rollups():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event("foo", float(k // 60), t0 + k * 60) for k in range(4 * 60)])
+    write_rollups(storage, [("foo", 3600, t0 + h * 3600, (h, h, 60.0 * h, 60)) for h in (2, 3)])
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 4 * 3600 - 1), 100, 5, "mean"))
+    eq_([(t0 + h * 3600, float(h)) for h in range(4)], [(e.unixtimestamp(), e.value()) for e in events])
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 4 * 3600 - 1), 3, 5, "count"))
+    eq_([(t0 + h * 3600, 60) for h in range(1, 4)], [(e.unixtimestamp(), e.value()) for e in events])
+
+def test_load_does_not_backfill_without_maxpoints():
+    storage = mkstorage()
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    eq_([], result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(t0), timeutil.gmtime(t0 + 3600), 100)))
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return(self.now)
+
+def test_load_page_is_cached():
+    slices  = cache.TTLCache(1024)
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event("foo", float(k), t0 + k * 60) for k in range(3)])
+    p0 = result(storage.load_page(event.Event.kind(), "foo", t0, t0 + 3600, 10))
+    p1 = result(storage.load_page(event.Event.kind(), "foo", t0, t0 + 3600, 10))
+    ok_(p0 is p1)
+    eq_((1, 1), (slices.hits, slices.misses))
+
+def test_remember_keeps_pages_past_the_horizon_until_evicted():
+    clock   = FakeClock()
+    slices  = cache.TTLCache(1024, clock)
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    page    = ([event.Event("foo", 1.0, t0)], None)
+    clock.now = t0 + storage.cache_horizon + 1
+    storage.remember(page, "foo", t0)
+    clock.now += 86400
+    ok_(slices.get("foo") is page)
+
+def test_rollup_pages_are_open_until_their_bucket_is_over():
+    clock   = FakeClock()
+    slices  = cache.TTLCache(1024, clock)
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    mean    = rollup.aggregate("mean")
+    clock.now = t0 + storage.cache_horizon + 1
+    for _ in range(2):
+        result(storage.load_page(event.Event.kind(), "foo", t0, t0, 10, 86400, mean))
+        clock.now += storage.cache_ttl
+    eq_((0, 1), (slices.hits, slices.expired))
+    for _ in range(2):
+        result(storage.load_page(event.Event.kind(), "foo", t0, t0, 10))
+        clock.now += storage.cache_ttl
+    eq_((1, 1), (slices.hits, slices.expired))
+
+def test_remember_keeps_pages_for_ttl_only():
+    clock   = FakeClock()
+    slices  = cache.TTLCache(1024, clock)
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    page    = ([event.Event("foo", 1.0, t0)], None)
+    eq_(page, storage.remember(page, "foo", t0))
+    clock.now = storage.cache_ttl - 1
+    ok_(slices.get("foo") is page)
+    clock.now = storage.cache_ttl
+    eq_(None, slices.get("foo"))
+
+def test_cached_pages_see_writes_to_past_minutes_after_ttl():
+    clock   = FakeClock()
+    slices  = cache.TTLCache(1024, clock)
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event("foo", 1.0, t0)])
+    eq_(1, len(result(storage.load_page(event.Event.kind(), "foo", t0, t0 + 3600, 10))[0]))
+    write(storage, [event.Event("foo", 2.0, t0 + 60)])
+    clock.now = storage.cache_ttl
+    eq_(2, len(result(storage.load_page(event.Event.kind(), "foo", t0, t0 + 3600, 10))[0]))
+
+def test_cache_is_bounded_by_events():
+    slices  = cache.TTLCache(4, weight=lambda page: len(page[0]))
+    storage = mkstorage(slices)
+    t0      = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+    write(storage, [event.Event(k, float(n), t0 + n * 60) for k in ["foo", "bar"] for n in range(3)])
+    for k in ["foo", "bar"]:
+        result(storage.load_page(event.Event.kind(), k, t0, t0 + 3600, 10))
+    eq_(1, len(slices))
+    eq_(3, slices.stats()["weight"])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import mock
+from nose.tools import *
+from leela.server.network import udp_proto
+
+def mkudp():
+    udp = udp_proto.UDP()
+    udp.forward_packet = mock.MagicMock()
+    return(udp)
+
+def test_handle_event_forwards_valid_metrics():
+    udp = mkudp()
+    udp.datagramReceived("gauge 6|foobar 1.0 0.0;counter 6|foobar 2.0 0.0;", None)
+    udp.forward_packet.assert_called_once_with("gauge 6|foobar 1.0 0.0;counter 6|foobar 2.0 0.0;")
+
+def test_handle_event_drops_malformed_metrics():
+    udp = mkudp()
+    udp.datagramReceived("gauge 6|foobar 1.0 0.0;gauge 6|foobar foobar 0.0;gauge 6|foobar 1.0 0.0;\n", None)
+    udp.forward_packet.assert_called_once_with("gauge 6|foobar 1.0 0.0;gauge 6|foobar 1.0 0.0;")
+
+def test_handle_event_forwards_nothing_if_all_metrics_are_malformed():
+    udp = mkudp()
+    udp.datagramReceived("gauge 6|foobar", None)
+    eq_(0, udp.forward_packet.call_count)
+
+def test_handle_event_translates_legacy_protocol():
+    udp = mkudp()
+    udp.datagramReceived("foobar: 1.0 60", None)
+    udp.forward_packet.assert_called_once_with("gauge 6|foobar 1.0 60.0;")
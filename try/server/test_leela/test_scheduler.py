@@ -0,0 +1,171 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+from nose.tools import *
+from twisted.internet import defer
+from leela.server import scheduler
+
+def test_submit_runs_jobs_immediately_when_idle():
+    s = scheduler.Scheduler(2, 2)
+    r = []
+    s.submit(lambda x: x + 1, 41).addCallback(r.append)
+    eq_([42], r)
+    eq_(1, s.completed)
+    eq_(0, s.inflight)
+
+def test_submit_keeps_at_most_maxinflight_jobs_running():
+    s  = scheduler.Scheduler(2, 10)
+    ds = [defer.Deferred() for _ in range(4)]
+    for d in ds:
+        s.submit(lambda d: d, d)
+    eq_(2, s.inflight)
+    eq_(2, len(s.pending))
+    ds[0].callback(None)
+    eq_(2, s.inflight)
+    eq_(1, len(s.pending))
+
+def test_submit_drops_oldest_pending_job():
+    s  = scheduler.Scheduler(1, 1)
+    r  = []
+    ds = [defer.Deferred() for _ in range(3)]
+    for (k, d) in enumerate(ds):
+        s.submit(lambda d: d, d).addCallbacks(lambda _, k=k: r.append(("ok", k)),
+                                            lambda f, k=k: r.append((f.type, k)))
+    eq_([(scheduler.DroppedExcept, 1)], r)
+    eq_(1, s.dropped)
+    ds[0].callback(None)
+    ds[2].callback(None)
+    eq_([(scheduler.DroppedExcept, 1), ("ok", 0), ("ok", 2)], r)
+
+def test_submit_spills_oldest_pending_job():
+    spilled = []
+    s = scheduler.Scheduler(1, 0, scheduler.SPILL, lambda x: spilled.append(x) or True)
+    s.submit(lambda: defer.Deferred())
+    s.submit(lambda x: x, "foobar").addErrback(lambda f: f.trap(scheduler.DroppedExcept))
+    eq_(["foobar"], spilled)
+    eq_((1, 0), (s.spilled, s.dropped))
+
+def test_jobs_the_spill_function_does_not_keep_are_dropped():
+    s = scheduler.Scheduler(1, 0, scheduler.SPILL, lambda x: False)
+    s.submit(lambda: defer.Deferred())
+    s.submit(lambda x: x, "foobar").addErrback(lambda f: f.trap(scheduler.DroppedExcept))
+    eq_((0, 1), (s.spilled, s.dropped))
+
+def test_failed_jobs_are_counted_and_propagated():
+    s = scheduler.Scheduler(1, 1)
+    r = []
+    s.submit(lambda: 1 / 0).addErrback(lambda f: r.append(f.type))
+    eq_([ZeroDivisionError], r)
+    eq_(1, s.failed)
+    eq_(0, s.inflight)
+
+def test_synchronous_jobs_do_not_recurse():
+    s = scheduler.Scheduler(1, 10000)
+    d = defer.Deferred()
+    s.submit(lambda: d)
+    for _ in range(10000):
+        s.submit(lambda: None)
+    d.callback(None)
+    eq_(10001, s.completed)
+
+def test_stats():
+    s = scheduler.Scheduler(1, 0)
+    s.submit(lambda: defer.Deferred())
+    s.submit(lambda: None).addErrback(lambda _: None)
+    eq_({"pending": 0, "inflight": 1, "completed": 0, "failed": 0, "dropped": 1, "spilled": 0}, s.stats())
+
+def test_wait_fires_once_every_job_is_done():
+    s  = scheduler.Scheduler(1, 10)
+    r  = []
+    ds = [defer.Deferred() for _ in range(2)]
+    for d in ds:
+        s.submit(lambda d: d, d).addCallback(r.append)
+    s.wait().addCallback(lambda _: r.append("idle"))
+    ds[0].callback(0)
+    eq_([0], r)
+    ds[1].callback(1)
+    eq_([0, 1, "idle"], r)
+
+def test_wait_fires_right_away_when_idle():
+    r = []
+    scheduler.Scheduler(1, 1).wait().addCallback(r.append)
+    eq_([None], r)
+
+@raises(ValueError)
+def test_spill_policy_requires_spill_function():
+    scheduler.Scheduler(1, 1, scheduler.SPILL)
+
+def test_fanout_consumes_results_in_order():
+    ds = [defer.Deferred() for _ in range(3)]
+    r  = []
+    d  = scheduler.fanout(lambda k: ds[k], range(3), 3, r.append)
+    ds[2].callback(2)
+    ds[1].callback(1)
+    eq_([], r)
+    ds[0].callback(0)
+    eq_([0, 1, 2], r)
+    ok_(d.called)
+
+def test_fanout_respects_maxinflight():
+    ds      = [defer.Deferred() for _ in range(4)]
+    started = []
+    scheduler.fanout(lambda k: started.append(k) or ds[k], range(4), 2, lambda _: None)
+    eq_([0, 1], started)
+    ds[1].callback(None)
+    eq_([0, 1, 2], started)
+
+def test_fanout_stops_when_consume_returns_true():
+    started = []
+    r       = []
+    def f(k):
+        started.append(k)
+        return(k)
+    d = scheduler.fanout(f, range(10), 1, lambda k: r.append(k) or k == 2)
+    eq_([0, 1, 2], r)
+    eq_([0, 1, 2], started)
+    ok_(d.called)
+
+def test_fanout_fails_with_the_first_failure():
+    r = []
+    d = scheduler.fanout(lambda k: 1 / k, [1, 0, 2], 3, lambda _: None)
+    d.addErrback(lambda f: r.append(f.type))
+    eq_([ZeroDivisionError], r)
+
+def test_fanout_with_no_jobs():
+    ok_(scheduler.fanout(lambda k: k, [], 1, lambda _: None).called)
+
+def test_fanout_waits_for_deferreds_returned_by_consume():
+    ds = [defer.Deferred() for _ in range(2)]
+    r  = []
+    def consume(k):
+        r.append(k)
+        return(ds[k])
+    d = scheduler.fanout(lambda k: k, range(2), 2, consume)
+    eq_([0], r)
+    ds[0].callback(False)
+    eq_([0, 1], r)
+    ok_(not d.called)
+    ds[1].callback(False)
+    ok_(d.called)
+
+def test_fanout_stops_when_consume_deferred_returns_true():
+    r = []
+    d = scheduler.fanout(lambda k: k, range(3), 3, lambda k: r.append(k) or defer.succeed(True))
+    eq_([0], r)
+    ok_(d.called)
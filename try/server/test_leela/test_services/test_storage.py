@@ -0,0 +1,195 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import ConfigParser
+from nose.tools import *
+from twisted.internet import defer
+from leela.server import timeutil
+from leela.server.data import pp
+from leela.server.data import event
+from leela.server.data import parser
+from leela.server.data import rollup
+from leela.server.network import storage_proto
+from leela.server.services import storage
+
+T0 = timeutil.timegm(2013, 1, 1, 0, 0, 0)
+
+def with_service(**opts):
+    # a StorageService on the sqlite backend, listening on a databus
+    # socket of its own; opts go to the storage section
+    def decorator(f):
+        def g():
+            path = tempfile.mkdtemp()
+            cfg  = ConfigParser.ConfigParser()
+            cfg.add_section("cassandra")
+            cfg.set("cassandra", "backend", "sqlite")
+            cfg.set("cassandra", "sqlite_path", os.path.join(path, "db"))
+            cfg.add_section("storage")
+            for (k, v) in opts.iteritems():
+                cfg.set("storage", k, str(v).replace("$dir", path))
+            svc = None
+            try:
+                svc = storage.StorageService(cfg, os.path.join(path, "dbus"))
+                f(svc)
+            finally:
+                if (svc is not None):
+                    svc.dbus.transport.stopListening()
+                    if (svc.spool is not None):
+                        svc.spool.close()
+                shutil.rmtree(path)
+        g.__name__ = f.__name__
+        return(g)
+    return(decorator)
+
+def busy(svc):
+    # takes the only scheduler slot until the deferred fires
+    d = defer.Deferred()
+    svc.sched.submit(lambda: d)
+    return(d)
+
+def result(d):
+    r = []
+    d.addBoth(r.append)
+    return(r[0])
+
+def stored_rollup(svc, name, resolution, t):
+    return(result(svc.storage.load_rollups([(name, resolution, t, None, False)])).get((name, resolution, t)))
+
+def spooled(svc):
+    (records, _) = svc.spool.read(1024)
+    return([e for r in records for e in parser.parse_frames(r)[0]])
+
+@with_service(inflight=1, pending=0, overflow="spill", spool="$dir/spool")
+def test_spill_policy_spools_the_overflowing_batch(svc):
+    busy(svc)
+    svc.write([event.Event("foo", float(k), T0 + k * 60) for k in range(3)])
+    eq_(range(3), [int(e.value()) for e in spooled(svc)])
+    eq_(["foo"] * 3, [e.name() for e in spooled(svc)])
+
+@with_service(inflight=1, pending=0, overflow="spill", spool="$dir/spool")
+def test_spill_policy_counts_catalog_batches_as_dropped(svc):
+    busy(svc)
+    svc.write([event.Event("foo", 1.0, T0)])
+    eq_((1, 1), (svc.sched.spilled, svc.sched.dropped))
+
+def hold_writes(svc):
+    # batch_mutate returns deferreds fired by the test
+    ds = []
+    def batch_mutate(batch):
+        ds.append(defer.Deferred())
+        return(ds[-1])
+    svc.storage.batch_mutate = batch_mutate
+    return(ds)
+
+@with_service(spool="$dir/spool")
+def test_replay_acks_once_the_writes_succeed(svc):
+    svc.spool.append(pp.render_storables_binary([event.Event("foo", 1.0, T0)]))
+    ds = hold_writes(svc)
+    svc.replay_spool()
+    svc.replay_spool()
+    ok_(svc.spool.size() > 0)
+    eq_(2, len(ds))
+    for d in ds:
+        d.callback(None)
+    eq_(0, svc.spool.size())
+    ok_(not svc.replaying)
+
+@with_service(spool="$dir/spool")
+def test_replay_does_not_ack_failed_writes(svc):
+    svc.spool.append(pp.render_storables_binary([event.Event("foo", 1.0, T0)]))
+    ds = hold_writes(svc)
+    svc.replay_spool()
+    ds[1].callback(None)
+    ds[0].errback(RuntimeError())
+    ok_(svc.spool.size() > 0)
+    ok_(not svc.healthy)
+    eq_([1.0], [e.value() for e in spooled(svc)])
+    ok_(not svc.replaying)
+
+@with_service(inflight=1, pending=0, overflow="drop-oldest", spool="$dir/spool")
+def test_drop_oldest_policy_does_not_spool(svc):
+    busy(svc)
+    svc.write([event.Event("foo", 1.0, T0)])
+    eq_([], spooled(svc))
+    ok_(svc.sched.dropped > 0)
+
+@raises(ValueError)
+@with_service(overflow="spill")
+def test_spill_policy_requires_spool(svc):
+    pass
+
+@with_service()
+def test_flush_rollups_merges_buckets_stored_before_a_restart(svc):
+    svc.commit([event.Event("foo", float(k), T0 + k * 60) for k in range(3)])
+    result(svc.flush_rollups())
+    eq_((0.0, 2.0, 3.0, 3), stored_rollup(svc, "foo", 300, T0))
+    svc.rollup = rollup.Rollup(1024)
+    svc.commit([event.Event("foo", float(k), T0 + k * 60) for k in range(3, 5)])
+    result(svc.flush_rollups())
+    eq_((0.0, 4.0, 10.0, 5), stored_rollup(svc, "foo", 300, T0))
+    svc.commit([event.Event("foo", 10.0, T0 + 240)])
+    result(svc.flush_rollups())
+    eq_((0.0, 10.0, 20.0, 6), stored_rollup(svc, "foo", 300, T0))
+
+@with_service()
+def test_flush_rollups_retries_buckets_it_cannot_read(svc):
+    svc.commit([event.Event("foo", 1.0, T0)])
+    load = svc.storage.load_rollups
+    svc.storage.load_rollups = lambda buckets: defer.fail(RuntimeError())
+    result(svc.flush_rollups())
+    svc.storage.load_rollups = load
+    eq_(None, stored_rollup(svc, "foo", 300, T0))
+    result(svc.flush_rollups())
+    eq_((1.0, 1.0, 1.0, 1), stored_rollup(svc, "foo", 300, T0))
+
+@with_service()
+def test_rollups_count_events_after_coalescing(svc):
+    svc.recv_broadcast([event.Event("foo", 1.0, T0), event.Event("foo", 2.0, T0 + 30)])
+    eq_([], svc.rollup.flush())
+    svc.commit(svc.pending.flush())
+    eq_([("foo", 300, T0, (2.0, 2.0, 2.0, 1), False)], [b for b in svc.rollup.flush() if b[1] == 300])
+
+@with_service()
+def test_stop_writes_undelivered_events_and_their_rollups(svc):
+    svc.startService()
+    svc.dbus.callbacks["storage"].push([event.Event("foo", float(k), T0 + k * 60) for k in range(3)])
+    result(svc.stopService())
+    storage = storage_proto.connect(svc.cfg)
+    events  = result(storage.load(event.Event.kind(), "foo", timeutil.gmtime(T0), timeutil.gmtime(T0 + 3600), 10))
+    eq_([0.0, 1.0, 2.0], [e.value() for e in events])
+    eq_({("foo", 300, T0): (0.0, 2.0, 3.0, 3)}, result(storage.load_rollups([("foo", 300, T0, None, False)])))
+
+@with_service()
+def test_stop_waits_for_outstanding_writes(svc):
+    svc.startService()
+    ds      = hold_writes(svc)
+    stopped = []
+    svc.storage.stopService = lambda: stopped.append(True)
+    svc.dbus.callbacks["storage"].push([event.Event("foo", 1.0, T0)])
+    done = []
+    svc.stopService().addBoth(done.append)
+    ok_(len(ds) > 0)
+    eq_([], stopped)
+    while (not done):
+        ds.pop().callback(None)
+    eq_([True], stopped)
+    eq_([], ds)
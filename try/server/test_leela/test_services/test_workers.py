@@ -0,0 +1,92 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import mock
+from nose.tools import *
+from twisted.internet import protocol
+from twisted.python import failure
+from twisted.internet import error
+from leela.server.services import workers
+
+def mksupervisor():
+    return(workers.Supervisor(2, ["true"], "leela.foobar.udp"))
+
+def died():
+    return(failure.Failure(error.ProcessTerminated(signal=9)))
+
+def test_listen_udp_shares_the_port_with_reuseport():
+    p0 = workers.listen_udp(0, protocol.DatagramProtocol(), "127.0.0.1", True)
+    try:
+        port = p0.getHost().port
+        p1   = workers.listen_udp(port, protocol.DatagramProtocol(), "127.0.0.1", True)
+        eq_(port, p1.getHost().port)
+        p1.stopListening()
+    finally:
+        p0.stopListening()
+
+def test_worker_protocol_reports_each_line():
+    sup   = mksupervisor()
+    proto = workers.WorkerProtocol(sup, 1)
+    proto.childDataReceived(workers.STATS_FD, '{"foo": ["derive", 1]}\n{"foo": ["der')
+    eq_({1: {"foo": ["derive", 1]}}, sup.last)
+    proto.childDataReceived(workers.STATS_FD, 'ive", 2]}\n')
+    eq_({1: {"foo": ["derive", 2]}}, sup.last)
+
+def test_worker_protocol_ignores_other_fds():
+    sup = mksupervisor()
+    workers.WorkerProtocol(sup, 1).childDataReceived(4, '{"foo": ["derive", 1]}\n')
+    eq_({}, sup.last)
+
+def test_worker_protocol_forwards_the_worker_log():
+    sup = mksupervisor()
+    with mock.patch("leela.server.logger.dolog") as dolog:
+        proto = workers.WorkerProtocol(sup, 1)
+        proto.childDataReceived(1, "foo\nba")
+        proto.childDataReceived(2, "Traceback\n")
+        proto.childDataReceived(1, "r\n")
+        eq_([mock.call("worker 1: foo"), mock.call("worker 1: Traceback"), mock.call("worker 1: bar")], dolog.call_args_list)
+        eq_({}, sup.last)
+
+def test_worker_protocol_forwards_partial_lines_when_the_worker_dies():
+    sup = mksupervisor()
+    with mock.patch("leela.server.logger.dolog") as dolog:
+        proto = workers.WorkerProtocol(sup, 1)
+        proto.childDataReceived(2, "ZeroDivisionError")
+        proto.processEnded(died())
+        eq_([mock.call("worker 1: ZeroDivisionError")], dolog.call_args_list)
+
+def test_totals_add_up_workers():
+    sup = mksupervisor()
+    sup.report(0, {"foo": ["derive", 1], "bar": ["gauge", 2]})
+    sup.report(1, {"foo": ["derive", 3], "bar": ["gauge", 4]})
+    eq_({"foo": ("derive", 4), "bar": ("gauge", 6)}, sup.totals())
+
+def test_totals_keep_the_derives_of_dead_workers():
+    sup = mksupervisor()
+    sup.report(0, {"foo": ["derive", 1], "bar": ["gauge", 2]})
+    sup.report(1, {"foo": ["derive", 3], "bar": ["gauge", 4]})
+    sup.died(0, died())
+    eq_({"foo": ("derive", 4), "bar": ("gauge", 4)}, sup.totals())
+    sup.report(0, {"foo": ["derive", 1], "bar": ["gauge", 2]})
+    eq_({"foo": ("derive", 5), "bar": ("gauge", 6)}, sup.totals())
+
+def test_stopped_supervisors_do_not_restart_workers():
+    sup = mksupervisor()
+    sup.died(0, died())
+    eq_(0, sup.restarts)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+from nose.tools import *
+from leela.server import spool
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return(self.now)
+
+def with_spool_dir(f):
+    def g():
+        path = tempfile.mkdtemp()
+        try:
+            f(os.path.join(path, "spool"))
+        finally:
+            shutil.rmtree(path)
+    g.__name__ = f.__name__
+    return(g)
+
+def segments(path):
+    return(sorted([f for f in os.listdir(path) if f.endswith(".spool")]))
+
+@with_spool_dir
+def test_read_returns_appended_records_in_order(path):
+    s = spool.Spool(path)
+    for k in range(10):
+        s.append("record-%d" % k)
+    (records, _) = s.read(4)
+    eq_(["record-0", "record-1", "record-2", "record-3"], records)
+
+@with_spool_dir
+def test_read_does_not_advance_without_ack(path):
+    s = spool.Spool(path)
+    s.append("foo")
+    s.append("bar")
+    eq_(["foo"], s.read(1)[0])
+    (records, cursor) = s.read(1)
+    eq_(["foo"], records)
+    s.ack(cursor)
+    eq_(["bar"], s.read(1)[0])
+
+@with_spool_dir
+def test_records_span_segments(path):
+    s = spool.Spool(path, segsize=64)
+    for k in range(10):
+        s.append("record-%d" % k)
+    ok_(len(segments(path)) > 1)
+    (records, cursor) = s.read(100)
+    eq_(["record-%d" % k for k in range(10)], records)
+    s.ack(cursor)
+    eq_(1, len(segments(path)))
+    eq_(0, s.size())
+
+@with_spool_dir
+def test_ack_removes_consumed_segments(path):
+    s = spool.Spool(path, segsize=64)
+    for k in range(10):
+        s.append("record-%d" % k)
+    n = len(segments(path))
+    s.ack(s.read(5)[1])
+    ok_(len(segments(path)) < n)
+    eq_(["record-5"], s.read(1)[0])
+
+@with_spool_dir
+def test_cursor_survives_restarts(path):
+    s = spool.Spool(path, segsize=64)
+    for k in range(10):
+        s.append("record-%d" % k)
+    s.ack(s.read(3)[1])
+    s.close()
+    s = spool.Spool(path, segsize=64)
+    eq_(["record-3"], s.read(1)[0])
+    s.append("record-10")
+    eq_(["record-%d" % k for k in range(3, 11)], s.read(100)[0])
+
+@with_spool_dir
+def test_corrupted_records_are_skipped(path):
+    s = spool.Spool(path, segsize=64)
+    for k in range(4):
+        s.append("record-%d" % k)
+    s.close()
+    first = os.path.join(path, segments(path)[0])
+    with open(first, "r+b") as fh:
+        fh.seek(spool.HEADER.size)
+        fh.write("X")
+    s = spool.Spool(path, segsize=64)
+    records = s.read(100)[0]
+    ok_("record-0" not in records)
+    ok_("record-3" in records)
+
+@with_spool_dir
+def test_truncated_tail_is_skipped(path):
+    s = spool.Spool(path)
+    s.append("foo")
+    s.append("bar")
+    s.close()
+    name = os.path.join(path, segments(path)[0])
+    with open(name, "r+b") as fh:
+        fh.truncate(os.path.getsize(name) - 1)
+    s = spool.Spool(path)
+    s.append("baz")
+    eq_(["foo", "baz"], s.read(100)[0])
+
+@with_spool_dir
+def test_size_and_lag(path):
+    clock = FakeClock()
+    s = spool.Spool(path, clock=clock)
+    eq_(0, s.size())
+    eq_(0, s.lag())
+    s.append("foobar")
+    clock.now = 10
+    s.append("foobar")
+    eq_(2 * (spool.HEADER.size + 6), s.size())
+    eq_(10, s.lag())
+    s.ack(s.read(1)[1])
+    eq_(0, s.lag())
+
+@with_spool_dir
+def test_lag_does_not_change_the_spool(path):
+    s = spool.Spool(path)
+    s.append("foobar")
+    with open(os.path.join(path, segments(path)[0]), "r+b") as fh:
+        fh.seek(spool.HEADER.size)
+        fh.write("X")
+    before = segments(path)
+    eq_(0, s.lag())
+    eq_(before, segments(path))
+    eq_([], s.read(10)[0])
+    ok_(len(segments(path)) > len(before))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8; -*-
+#
+# Copyright 2012 Juliano Martinez
+# Copyright 2012 Diego Souza
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+#
+
+import time
+import random
+import calendar
+from nose.tools import *
+from leela.server import timeutil
+
+def test_gmtime_agrees_with_time_gmtime():
+    for _ in range(1000):
+        t = random.randint(-2**34, 2**34)
+        eq_(time.gmtime(t)[:6], timeutil.gmtime(t))
+
+def test_gmtime_truncates_floats():
+    eq_((1970, 1, 1, 0, 0, 59), timeutil.gmtime(59.9))
+    eq_((1969, 12, 31, 23, 59, 59), timeutil.gmtime(-0.5))
+
+def test_timegm_agrees_with_calendar_timegm():
+    for _ in range(1000):
+        t = time.gmtime(random.randint(-2**34, 2**34))[:6]
+        eq_(calendar.timegm(t), timeutil.timegm(*t))
+
+def test_timegm_overflows_into_the_next_field():
+    eq_(calendar.timegm((2013, 1, 31, 24, 60, 60)), timeutil.timegm(2013, 1, 31, 24, 60, 60))
+
+def test_truncate_minute():
+    eq_(120, timeutil.truncate_minute(179.9))
+
+def test_month_bucket():
+    eq_((2012, 2), timeutil.month_bucket(calendar.timegm((2012, 2, 29, 23, 59, 59))))
+    eq_((2012, 3), timeutil.month_bucket(calendar.timegm((2012, 3, 1, 0, 0, 0))))
+
+def test_month_days():
+    eq_([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], [timeutil.month_days(2012, m) for m in range(1, 13)])
+    eq_(28, timeutil.month_days(1900, 2))
+
+def test_encode_decode_key_is_identity():
+    t = random.randint(0, 2**31)
+    eq_(t, timeutil.decode_key(timeutil.encode_key(t, 2000), 2000))
+
+def test_encode_key_counts_seconds_since_epoch():
+    eq_(61, timeutil.encode_key(calendar.timegm((2000, 1, 1, 0, 1, 1)), 2000))
+
+def test_split_months_within_a_month():
+    t0 = calendar.timegm((2013, 1, 10, 0, 0, 0))
+    t1 = calendar.timegm((2013, 1, 20, 0, 0, 0))
+    eq_([(2013, 1, t0, t1)], timeutil.split_months(t0, t1))
+
+def test_split_months_covers_the_whole_range():
+    t0 = calendar.timegm((2012, 11, 15, 0, 0, 0))
+    t1 = calendar.timegm((2013, 2, 3, 0, 0, 0))
+    eq_([(2012, 11, t0, calendar.timegm((2012, 11, 30, 23, 59, 59))),
+         (2012, 12, calendar.timegm((2012, 12, 1, 0, 0, 0)), calendar.timegm((2012, 12, 31, 23, 59, 59))),
+         (2013, 1, calendar.timegm((2013, 1, 1, 0, 0, 0)), calendar.timegm((2013, 1, 31, 23, 59, 59))),
+         (2013, 2, calendar.timegm((2013, 2, 1, 0, 0, 0)), t1)], timeutil.split_months(t0, t1))
+
+@raises(ValueError)
+def test_split_months_must_raise_if_start_is_greater_than_finish():
+    timeutil.split_months(1, 0)